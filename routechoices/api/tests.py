@@ -1,26 +1,50 @@
+import gzip
 import json
 import random
 import time
+import urllib.parse
+from io import StringIO
+from unittest.mock import patch
 
 import arrow
+import brotli
+import fakeredis
+import gps_data_codec
+import numpy as np
 from allauth.account.models import EmailAddress
+from background_task.models import Task
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import mail
 from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.management import call_command
 from django.test import override_settings
 from django_hosts.resolvers import reverse
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
+from routechoices.api.views import get_event_zip
+from routechoices.core.bg_tasks import build_event_snapshot
 from routechoices.core.models import (
+    EVENT_CACHE_INTERVAL,
     PRIVACY_PRIVATE,
     Club,
     Competitor,
     Device,
     Event,
+    EventSnapshot,
     Map,
 )
+from routechoices.lib.cache import clear_cache
+
+SHARED_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://cache:6379/0",
+        "OPTIONS": {"connection_class": fakeredis.FakeConnection},
+    },
+}
 
 
 class EssentialApiBase(APITestCase):
@@ -462,8 +486,291 @@ class EventApiTestCase(EssentialApiBase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data["event"]["name"], "Test event")
 
+    def test_live_event_data_since(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            open_registration=True,
+            start_date=arrow.get().shift(minutes=-10).datetime,
+            end_date=arrow.get().shift(hours=1).datetime,
+        )
+        device = Device.objects.create()
+        Competitor.objects.create(
+            name="Alice",
+            short_name="A",
+            event=event,
+            device=device,
+            start_time=arrow.get().shift(minutes=-10).datetime,
+        )
+        t = int(time.time())
+        device.add_locations([(t - i, 0.2, 0.1) for i in range(1, 300)])
+        url = self.reverse_and_check(
+            "event_data", f"/events/{event.aid}/data", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["nb_points"], 299)
+        self.assertNotIn("since", res.json())
+        since = t - 100
+        res = self.client.get(f"{url}?since={since}")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.headers.get("X-Cache-Hit"))
+        rounded_since = since - since % EVENT_CACHE_INTERVAL
+        self.assertEqual(res.json()["since"], rounded_since)
+        self.assertEqual(res.json()["nb_points"], t - rounded_since)
+        self.assertEqual(len(res.json()["competitors"]), 1)
+        locations = gps_data_codec.decode(res.json()["competitors"][0]["encoded_data"])
+        self.assertEqual(locations[0][0], rounded_since)
+        res = self.client.get(f"{url}?since={rounded_since}")
+        self.assertEqual(res.headers["X-Cache-Hit"], "1")
+        res = self.client.get(f"{url}?since=abc")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(f"{url}?since=1e20")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(f"{url}?since=-1")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_event_data_compression(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            start_date=arrow.get().shift(minutes=-10).datetime,
+            end_date=arrow.get().shift(hours=1).datetime,
+        )
+        device = Device.objects.create()
+        Competitor.objects.create(
+            name="Alice",
+            short_name="A",
+            event=event,
+            device=device,
+            start_time=arrow.get().shift(minutes=-10).datetime,
+        )
+        t = int(time.time())
+        device.add_locations([(t - i, 0.2 + i / 1e4, 0.1) for i in range(1, 500)])
+        url = self.reverse_and_check(
+            "event_data", f"/events/{event.aid}/data", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.headers.get("Content-Encoding"))
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        data = res.json()
+        etag = res.headers["ETag"]
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEqual(res.headers["X-Cache-Hit"], "1")
+        self.assertEqual(res.headers["Content-Encoding"], "br")
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(json.loads(brotli.decompress(res.content)), data)
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(res.content)), data)
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING="identity")
+        self.assertIsNone(res.headers.get("Content-Encoding"))
+        self.assertEqual(res.json(), data)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_event_data_single_flight(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            start_date=arrow.get().shift(hours=-2).datetime,
+            end_date=arrow.get().shift(hours=-1).datetime,
+        )
+        device = Device.objects.create()
+        device.add_location(arrow.get().shift(minutes=-72).timestamp(), 0.2, 0.1)
+        Competitor.objects.create(
+            name="Alice",
+            short_name="A",
+            event=event,
+            device=device,
+            start_time=arrow.get().shift(minutes=-75).datetime,
+        )
+        url = self.reverse_and_check(
+            "event_data", f"/events/{event.aid}/data", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        self.assertIsNone(res.headers.get("X-Cache-Hit"))
+        self.assertIsNone(
+            cache.get(f"{self.get_event_data_cache_key(event)}:processing")
+        )
+
+        # Another worker is generating the data, the latest data are served
+        event.invalidate_cache()
+        lock_key = f"{self.get_event_data_cache_key(event)}:processing"
+        cache.add(lock_key, 1)
+        res = self.client.get(url)
+        self.assertEqual(res.headers["X-Cache-Hit"], "1")
+        self.assertEqual(res.json()["nb_points"], 1)
+
+        # Without latest data, wait for them then generate them
+        cache.delete(f"event:{event.aid}:rendered_data:latest:archived")
+        with patch("routechoices.api.views.EVENT_DATA_WAIT_TIMEOUT", 0.1):
+            res = self.client.get(url)
+        self.assertIsNone(res.headers.get("X-Cache-Hit"))
+        self.assertEqual(res.json()["nb_points"], 1)
+
+    @staticmethod
+    def get_event_data_cache_key(event):
+        cache_version = Event.get_cache_version(event.aid)
+        return f"event:{event.aid}:rendered_data:v{cache_version}:archived"
+
+    def test_event_cache_version(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            start_date=arrow.get().shift(hours=-2).datetime,
+            end_date=arrow.get().shift(hours=-1).datetime,
+        )
+        version = Event.get_cache_version(event.aid)
+        self.assertEqual(Event.get_cache_version(event.aid), version)
+        event.invalidate_cache()
+        new_version = Event.get_cache_version(event.aid)
+        self.assertNotEqual(new_version, version)
+        # An evicted version is not reused
+        cache.delete(f"event:{event.aid}:cache_version")
+        self.assertNotIn(Event.get_cache_version(event.aid), (version, new_version))
+
+        url = self.reverse_and_check(
+            "event_zip", f"/events/{event.aid}/zip", "api", {"event_id": event.aid}
+        )
+        with patch(
+            "routechoices.api.views.get_event_zip", wraps=get_event_zip
+        ) as build_zip:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.client.get(url)
+            self.assertEqual(build_zip.call_count, 1)
+            device = Device.objects.create()
+            device.add_location(arrow.get().shift(minutes=-72).timestamp(), 0.2, 0.1)
+            Competitor.objects.create(
+                name="Alice",
+                short_name="A",
+                event=event,
+                device=device,
+                start_time=arrow.get().shift(minutes=-75).datetime,
+            )
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(build_zip.call_count, 2)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_shared_cache(self):
+        clear_cache()
+        # Cache of another app node, on the same Redis server
+        other_node = RedisCache(
+            SHARED_CACHES["default"]["LOCATION"], SHARED_CACHES["default"]
+        )
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            start_date=arrow.get().shift(hours=-2).datetime,
+            end_date=arrow.get().shift(hours=-1).datetime,
+        )
+        device = Device.objects.create()
+        device.add_location(arrow.get().shift(minutes=-72).timestamp(), 0.2, 0.1)
+        Competitor.objects.create(
+            name="Alice",
+            short_name="A",
+            event=event,
+            device=device,
+            start_time=arrow.get().shift(minutes=-75).datetime,
+        )
+        url = self.reverse_and_check(
+            "event_data", f"/events/{event.aid}/data", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        self.assertIsNone(res.headers.get("X-Cache-Hit"))
+        self.assertIsNotNone(other_node.get(self.get_event_data_cache_key(event)))
+        res = self.client.get(url)
+        self.assertEqual(res.headers["X-Cache-Hit"], "1")
+
+        # Invalidation from the other node
+        version = Event.get_cache_version(event.aid)
+        other_node.incr(f"event:{event.aid}:cache_version")
+        self.assertNotEqual(Event.get_cache_version(event.aid), version)
+        res = self.client.get(url)
+        self.assertIsNone(res.headers.get("X-Cache-Hit"))
+        self.assertEqual(res.json()["nb_points"], 1)
+
+        # While the other node generates the data, the latest data are served
+        event.invalidate_cache()
+        other_node.add(f"{self.get_event_data_cache_key(event)}:processing", 1)
+        res = self.client.get(url)
+        self.assertEqual(res.headers["X-Cache-Hit"], "1")
+
+    def test_conditional_requests(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            start_date=arrow.get().shift(hours=-2).datetime,
+            end_date=arrow.get().shift(hours=-1).datetime,
+        )
+        device = Device.objects.create()
+        device.add_location(arrow.get().shift(minutes=-72).timestamp(), 0.2, 0.1)
+        competitor = Competitor.objects.create(
+            name="Alice",
+            short_name="A",
+            event=event,
+            device=device,
+            start_time=arrow.get().shift(minutes=-75).datetime,
+        )
+        url = self.reverse_and_check(
+            "event_data", f"/events/{event.aid}/data", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        etag = res.headers["ETag"]
+        with self.assertNumQueries(1):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        device.add_location(arrow.get().shift(minutes=-71).timestamp(), 0.3, 0.1)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["nb_points"], 2)
+
+        url = self.reverse_and_check(
+            "event_detail", f"/events/{event.aid}", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        etag = res.headers["ETag"]
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        event.name = "Renamed event"
+        event.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        url = self.reverse_and_check(
+            "competitor_gpx_download",
+            f"/competitors/{competitor.aid}/gpx",
+            "api",
+            {"competitor_id": competitor.aid},
+        )
+        res = self.client.get(url)
+        etag = res.headers["ETag"]
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        device.add_location(arrow.get().shift(minutes=-70).timestamp(), 0.4, 0.1)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
     def test_cache_invalidation(self):
-        cache.clear()
+        clear_cache()
         club = Club.objects.create(name="Test club", slug="club")
         event_a = Event.objects.create(
             club=club,
@@ -646,8 +953,79 @@ class EventApiTestCase(EssentialApiBase):
         res = self.client.get(url)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
+    def test_archived_event_snapshot(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            start_date=arrow.get().shift(hours=-2).datetime,
+            end_date=arrow.get().shift(hours=-1).datetime,
+        )
+        device = Device.objects.create()
+        device.add_location(arrow.get().shift(minutes=-72).timestamp(), 0.2, 0.1)
+        competitor = Competitor.objects.create(
+            name="Alice",
+            short_name="A",
+            event=event,
+            device=device,
+            start_time=arrow.get().shift(minutes=-75).datetime,
+        )
+        self.assertFalse(EventSnapshot.objects.filter(event=event).exists())
+        url = self.reverse_and_check(
+            "event_data", f"/events/{event.aid}/data", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["nb_points"], 1)
+        # Built by a single background task, not in the request
+        self.assertFalse(EventSnapshot.objects.filter(event=event).exists())
+        snapshot_tasks = Task.objects.filter(
+            task_name="routechoices.core.bg_tasks.build_event_snapshot"
+        )
+        event.invalidate_cache()
+        n_tasks = snapshot_tasks.count()
+        self.assertGreater(n_tasks, 0)
+        event.invalidate_cache()
+        self.assertEqual(snapshot_tasks.count(), n_tasks)
+        build_event_snapshot.now(event.aid, time.time())
+        snapshot = EventSnapshot.objects.get(event=event)
+        self.assertEqual(snapshot.location_count, 1)
+        self.assertEqual(
+            snapshot.get_locations(competitor.aid),
+            gps_data_codec.decode(res.json()["competitors"][0]["encoded_data"]),
+        )
+
+        # The snapshot is served without reading the device locations
+        Device.objects.filter(id=device.id).update(locations_encoded="")
+        url_rerun = self.reverse_and_check(
+            "2d_rerun_race_data", "/woo/race_status/get_data.json", "api"
+        )
+        res = self.client.get(f"{url_rerun}?eventid={event.aid}")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["lastpos"], 1)
+        url_zip = self.reverse_and_check(
+            "event_zip", f"/events/{event.aid}/zip", "api", {"event_id": event.aid}
+        )
+        res = self.client.get(url_zip)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        # New locations during the event invalidate the snapshot
+        device.refresh_from_db()
+        device.add_location(arrow.get().shift(minutes=-71).timestamp(), 0.3, 0.1)
+        self.assertFalse(EventSnapshot.objects.filter(event=event).exists())
+        build_event_snapshot.now(event.aid, time.time())
+        snapshot = EventSnapshot.objects.get(event=event)
+        self.assertEqual(snapshot.location_count, 1)
+        res = self.client.get(url)
+        self.assertEqual(res.json()["nb_points"], 1)
+        self.assertEqual(
+            gps_data_codec.decode(res.json()["competitors"][0]["encoded_data"])[0][1],
+            0.3,
+        )
+
     def test_live_event_data(self):
-        cache.clear()
+        clear_cache()
         club = Club.objects.create(name="Test club", slug="club")
         event = Event.objects.create(
             club=club,
@@ -661,7 +1039,7 @@ class EventApiTestCase(EssentialApiBase):
         )
         res = self.client.get(url)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data["competitors"], [])
+        self.assertEqual(res.json()["competitors"], [])
         self.assertIsNone(res.headers.get("X-Cache-Hit"))
         res = self.client.get(url)
         self.assertEqual(res.headers["X-Cache-Hit"], "1")
@@ -745,6 +1123,215 @@ class LocationApiTestCase(EssentialApiBase):
         nb_points = len(Device.objects.get(aid=dev_id).locations["timestamps"])
         self.assertEqual(nb_points, 4)
 
+    @override_settings(QUEUE_POSTED_LOCATIONS=True)
+    def test_locations_api_gw_queued(self):
+        dev_id = self.get_device_id()
+        t = time.time()
+        for i in range(3):
+            res = self.client.post(
+                self.url,
+                {
+                    "device_id": dev_id,
+                    "latitudes": "1.1,1.2",
+                    "longitudes": "3.1,3.2",
+                    "timestamps": f"{t+2*i+1},{t+2*i}",
+                    "battery": 50 + i,
+                    "secret": settings.POST_LOCATION_SECRETS[0],
+                },
+            )
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        device = Device.objects.get(aid=dev_id)
+        self.assertEqual(device.location_count, 0)
+        self.assertEqual(device.queued_locations.count(), 3)
+        call_command("flush_queued_locations", "--once", stdout=StringIO())
+        device = Device.objects.get(aid=dev_id)
+        self.assertEqual(device.location_count, 6)
+        self.assertEqual(device.battery_level, 52)
+        self.assertEqual(device.queued_locations.count(), 0)
+        # A device that can not be flushed does not stop the command
+        res = self.client.post(
+            self.url,
+            {
+                "device_id": dev_id,
+                "latitudes": "1.3",
+                "longitudes": "3.3",
+                "timestamps": f"{t+10}",
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        stderr = StringIO()
+        with patch(
+            "routechoices.core.models.Device.merge_queued_locations",
+            side_effect=ValueError("Invalid locations"),
+        ):
+            call_command(
+                "flush_queued_locations", "--once", stdout=StringIO(), stderr=stderr
+            )
+        self.assertIn("Invalid locations", stderr.getvalue())
+        self.assertEqual(device.queued_locations.count(), 1)
+
+    def test_locations_batch_api_gw(self):
+        url = self.reverse_and_check("locations_batch_api_gw", "/locations/batch")
+        dev_id = self.get_device_id()
+        dev2_id = self.get_device_id()
+        t = int(time.time())
+        res = self.client.post(
+            url,
+            {
+                "devices": [
+                    {
+                        "device_id": dev_id,
+                        "latitudes": [1.1, 1.2],
+                        "longitudes": [3.1, 3.2],
+                        "timestamps": [t, t + 1],
+                        "battery": 74,
+                    },
+                    {
+                        "device_id": dev2_id,
+                        "latitudes": "1.1,1.2,1.3",
+                        "longitudes": "3.1,3.2,3.3",
+                        "timestamps": f"{t},{t+1},{t+2}",
+                    },
+                ],
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data["location_count"], 5)
+        self.assertEqual(res.data["devices"], {dev_id: 2, dev2_id: 3})
+        device = Device.objects.get(aid=dev_id)
+        self.assertEqual(device.location_count, 2)
+        self.assertEqual(device.battery_level, 74)
+        self.assertEqual(Device.objects.get(aid=dev2_id).location_count, 3)
+        # unknown device
+        res = self.client.post(
+            url,
+            {
+                "devices": [
+                    {
+                        "device_id": dev_id,
+                        "latitudes": [1.3],
+                        "longitudes": [3.3],
+                        "timestamps": [t + 2],
+                    },
+                    {
+                        "device_id": "doesnotexist",
+                        "latitudes": [1.1],
+                        "longitudes": [3.1],
+                        "timestamps": [t],
+                    },
+                ],
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Device.objects.get(aid=dev_id).location_count, 2)
+        # numeric device id without secret
+        device = Device.objects.create(aid="12345678")
+        res = self.client.post(
+            url,
+            {
+                "devices": [
+                    {
+                        "device_id": device.aid,
+                        "latitudes": [1.1],
+                        "longitudes": [3.1],
+                        "timestamps": [t],
+                    },
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        # invalid data
+        res = self.client.post(
+            url,
+            {
+                "devices": [
+                    {
+                        "device_id": dev_id,
+                        "latitudes": [1.1],
+                        "longitudes": [3.1, 3.2],
+                        "timestamps": [t],
+                    },
+                ],
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_locations_api_gw_compact_formats(self):
+        dev_id = self.get_device_id()
+        t = int(time.time())
+        res = self.client.post(
+            self.url,
+            {
+                "device_id": dev_id,
+                "encoded_data": gps_data_codec.encode(
+                    [(t, 1.1, 3.1), (t + 1, 1.2, 3.2)]
+                ),
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Device.objects.get(aid=dev_id).location_count, 2)
+        res = self.client.post(
+            self.url,
+            {
+                "device_id": dev_id,
+                "encoded_data": "not encoded",
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid data format", json.loads(res.content)[0])
+        query = urllib.parse.urlencode(
+            {"device_id": dev_id, "secret": settings.POST_LOCATION_SECRETS[0]}
+        )
+        body = np.array(
+            [[t + 2, t + 3], [130000, 140000], [330000, 340000]], dtype="<i4"
+        ).tobytes()
+        res = self.client.post(
+            f"{self.url}?{query}",
+            body,
+            content_type="application/vnd.routechoices.locations",
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        device = Device.objects.get(aid=dev_id)
+        self.assertEqual(device.location_count, 4)
+        self.assertEqual(device.locations_series[-1], (t + 3, 1.4, 3.4))
+        res = self.client.post(
+            f"{self.url}?{query}",
+            body[:-1],
+            content_type="application/vnd.routechoices.locations",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        # The parsed binary arrays can not be injected in the posted data
+        res = self.client.post(
+            self.url,
+            {
+                "device_id": dev_id,
+                "locations_arrays": "abc",
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = self.client.post(
+            self.url,
+            {
+                "device_id": dev_id,
+                "locations_arrays": [[1], [2], [3]],
+                "secret": settings.POST_LOCATION_SECRETS[0],
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Device.objects.get(aid=dev_id).location_count, 4)
+
     def test_locations_api_gw_invalid_cast(self):
         dev_id = self.get_device_id()
         t = time.time()
@@ -951,6 +1538,58 @@ class RouteUploadApiTestCase(EssentialApiBase):
             Competitor.objects.get(aid=self.competitor.aid).device.location_count, 3
         )
 
+    def test_route_upload_api_compact_formats(self):
+        t = int(time.time())
+        self.client.force_login(self.user)
+        res = self.client.post(
+            self.url,
+            {"encoded_data": gps_data_codec.encode([(t, 1.1, 3.1), (t + 1, 1.2, 3.2)])},
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        device = Competitor.objects.get(aid=self.competitor.aid).device
+        self.assertEqual(device.locations_series, [(t, 1.1, 3.1), (t + 1, 1.2, 3.2)])
+        body = np.array(
+            [[t + 1, t, t + 2], [110000, 120000, 9100000], [310000, 320000, 330000]],
+            dtype="<i4",
+        ).tobytes()
+        res = self.client.post(
+            self.url, body, content_type="application/vnd.routechoices.locations"
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid latitude value", json.loads(res.content)[0])
+        body = np.array(
+            [[t + 1, t, t + 2], [110000, 120000, 130000], [310000, 320000, 330000]],
+            dtype="<i4",
+        ).tobytes()
+        res = self.client.post(
+            self.url, body, content_type="application/vnd.routechoices.locations"
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        device = Competitor.objects.get(aid=self.competitor.aid).device
+        self.assertEqual(
+            device.locations_series,
+            [(t, 1.2, 3.2), (t + 1, 1.1, 3.1), (t + 2, 1.3, 3.3)],
+        )
+        # The parsed binary arrays can not be injected in the posted data
+        res = self.client.post(self.url, {"locations_arrays": "abc"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(
+            self.url, {"locations_arrays": [[1], [2], [3]]}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Minimum amount of locations is 2", json.loads(res.content)[0])
+        res = self.client.post(
+            self.url,
+            {
+                "latitudes": [{"lat": 1.1}, {"lat": 1.2}],
+                "longitudes": [3.1, 3.2],
+                "timestamps": [t, t + 1],
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid data format", json.loads(res.content)[0])
+
     def test_route_upload_api_invalid_cast(self):
         t = time.time()
         res = self.client.post(
@@ -30,6 +30,11 @@ urlpatterns = [
     re_path(r"^device_id/?$", views.get_device_id, name="device_id_api"),  # deprecated
     re_path(r"^device/?$", views.create_device_id, name="device_api"),
     re_path(r"^locations/?$", views.locations_api_gw, name="locations_api_gw"),
+    re_path(
+        r"^locations/batch/?$",
+        views.locations_batch_api_gw,
+        name="locations_batch_api_gw",
+    ),
     re_path(r"^time/?$", views.get_time, name="time_api"),
     re_path(r"^search/device/?$", views.device_search, name="device_search_api"),
     re_path(r"^search/user/?$", views.user_search, name="user_search_api"),
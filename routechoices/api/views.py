@@ -1,3 +1,4 @@
+import gzip
 import logging
 import re
 import time
@@ -6,7 +7,9 @@ from io import BytesIO
 from zipfile import ZipFile
 
 import arrow
+import brotli
 import gps_data_codec
+import numpy as np
 import orjson as json
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
@@ -15,19 +18,25 @@ from django.contrib.gis.geoip2 import GeoIP2
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from django.db.models import Prefetch, Q
 from django.http import HttpResponse
 from django.http.response import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.timezone import now
 from django_hosts.resolvers import reverse
+from drf_orjson_renderer.renderers import ORJSONRenderer
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import renderers, status
-from rest_framework.decorators import api_view, throttle_classes
-from rest_framework.exceptions import ValidationError
+from rest_framework.decorators import api_view, parser_classes, throttle_classes
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import BaseParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.throttling import AnonRateThrottle
+from rest_framework.utils.mediatypes import media_type_matches
 
 from routechoices.core.models import (
     EVENT_CACHE_INTERVAL,
@@ -48,8 +57,12 @@ from routechoices.core.models import (
     ImeiDevice,
     Map,
     MapAssignation,
+    QueuedLocations,
+    locations_to_gpx,
 )
+from routechoices.lib.cache import MISSING, cache_get, cache_set, wait_for_cache
 from routechoices.lib.globalmaptiles import GlobalMercator
+from routechoices.lib.gps_encoding import decode_arrays
 from routechoices.lib.helpers import (
     epoch_to_datetime,
     git_master_hash,
@@ -72,6 +85,10 @@ from routechoices.lib.validators import (
 
 logger = logging.getLogger(__name__)
 GLOBAL_MERCATOR = GlobalMercator()
+# Same as the nginx gzip_min_length
+COMPRESSION_MIN_LENGTH = 1000
+EVENT_DATA_LOCK_TIMEOUT = 15
+EVENT_DATA_WAIT_TIMEOUT = 5
 
 api_GET_view = api_view(["GET"])
 api_GET_HEAD_view = api_view(["GET", "HEAD"])
@@ -79,6 +96,34 @@ api_POST_view = api_view(["POST"])
 api_GET_POST_view = api_view(["GET", "POST"])
 
 
+class LocationsBinaryParser(BaseParser):
+    """
+    Locations packed as 3 arrays of little-endian int32: timestamps (UNIX epoch
+    in seconds), latitudes and longitudes (in 1e-5 degrees).
+    The other parameters are given in the query string.
+    """
+
+    media_type = "application/vnd.routechoices.locations"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = stream.read() if stream else b""
+        if len(body) % 12:
+            raise ParseError("Invalid data format")
+        values = np.frombuffer(body, dtype="<i4").reshape(3, -1)
+        data = parser_context["request"].query_params.dict()
+        data["locations_arrays"] = (
+            values[0].astype(np.int64),
+            values[1] / 1e5,
+            values[2] / 1e5,
+        )
+        return data
+
+
+locations_parser_classes = parser_classes(
+    list(api_settings.DEFAULT_PARSER_CLASSES) + [LocationsBinaryParser]
+)
+
+
 class PostDataThrottle(AnonRateThrottle):
     rate = "70/min"
 
@@ -124,6 +169,16 @@ event_param = openapi.Parameter(
     type=openapi.TYPE_STRING,
 )
 
+since_param = openapi.Parameter(
+    "since",
+    openapi.IN_QUERY,
+    description=(
+        "Only return locations after this time (UNIX epoch in seconds), "
+        f"rounded down to a multiple of {EVENT_CACHE_INTERVAL} seconds"
+    ),
+    type=openapi.TYPE_NUMBER,
+)
+
 mine_param = openapi.Parameter(
     "mine",
     openapi.IN_QUERY,
@@ -562,6 +617,10 @@ def event_detail(request, event_id):
 
     event.check_user_permission(request.user)
 
+    etag = get_event_detail_etag(request, event)
+    if not_modified_response := get_conditional_response(request, etag=etag):
+        return not_modified_response
+
     output = {
         "event": {
             "id": event.aid,
@@ -631,13 +690,34 @@ def event_detail(request, event_id):
             }
             output["maps"].append(map_data)
 
-    headers = {"ETag": f'W/"{safe64encodedsha(json.dumps(output))}"'}
+    headers = {"ETag": etag}
     if event.privacy == PRIVACY_PRIVATE:
         headers["Cache-Control"] = "Private"
 
     return Response(output, headers=headers)
 
 
+def get_event_detail_etag(request, event):
+    """Validator of the event details computed without building them"""
+    validator = [
+        request.get_host(),
+        event.aid,
+        Event.get_cache_version(event.aid),
+        event.start_date < now(),
+        event.club.modification_date,
+        event.notice.modification_date if event.has_notice else None,
+    ]
+    if event.map:
+        validator += [event.map.hash, event.map.modification_date]
+    for map_assignation in event.map_assignations.all():
+        validator += [
+            map_assignation.title,
+            map_assignation.map.hash,
+            map_assignation.map.modification_date,
+        ]
+    return f'W/"{safe64encodedsha(str(validator))}"'
+
+
 @swagger_auto_schema(
     method="post",
     operation_id="register_competitor",
@@ -936,7 +1016,11 @@ def competitor_api(request, competitor_id):
     method="post",
     operation_id="competitor_route_upload",
     operation_description=(
-        "Upload route for an existing competitor (Delete existing data)"
+        "Upload route for an existing competitor (Delete existing data)."
+        " Locations can also be posted as a binary body of type"
+        " application/vnd.routechoices.locations, made of 3 arrays of"
+        " little-endian int32: timestamps, latitudes and longitudes"
+        " (in 1e-5 degrees)."
     ),
     tags=["Competitors"],
     request_body=openapi.Schema(
@@ -964,8 +1048,15 @@ def competitor_api(request, competitor_id):
                 ),
                 example="1661489045,1661489046,1661489047",
             ),
+            "encoded_data": openapi.Schema(
+                type=openapi.TYPE_STRING,
+                description=(
+                    "Locations in the polyline encoding used for the GPS data "
+                    "of the events, replaces latitudes, longitudes and timestamps"
+                ),
+                example="__zyaY_ibE_ibE??A???",
+            ),
         },
-        required=["latitudes", "longitudes", "timestamps"],
     ),
     responses={
         "201": openapi.Response(
@@ -979,6 +1070,7 @@ def competitor_api(request, competitor_id):
     },
 )
 @api_POST_view
+@locations_parser_classes
 def competitor_route_upload(request, competitor_id):
     competitor = (
         Competitor.objects.select_related("event", "event__club", "device")
@@ -1004,71 +1096,120 @@ def competitor_route_upload(request, competitor_id):
     if event.start_date > now():
         raise ValidationError("Event has not yet started")
 
-    try:
-        lats = [float(x) for x in request.data.get("latitudes", "").split(",") if x]
-        lons = [float(x) for x in request.data.get("longitudes", "").split(",") if x]
-        times = [float(x) for x in request.data.get("timestamps", "").split(",") if x]
-    except ValueError:
-        raise ValidationError("Invalid data format")
+    arrays = get_posted_locations_arrays(
+        request.data, binary=is_binary_locations_post(request)
+    )
+    if arrays is None:
+        try:
+            arrays = tuple(
+                np.array(split_posted_values(request.data.get(key, "")), dtype=float)
+                for key in ("timestamps", "latitudes", "longitudes")
+            )
+        except (TypeError, ValueError):
+            raise ValidationError("Invalid data format")
+    timestamps, latitudes, longitudes = arrays
 
-    if not (len(lats) == len(lons) == len(times)):
+    if not (len(timestamps) == len(latitudes) == len(longitudes)):
         raise ValidationError(
             "Latitudes, longitudes, and timestamps, should have same amount of points"
         )
 
-    if len(lats) < 2:
+    if len(timestamps) < 2:
         raise ValidationError("Minimum amount of locations is 2")
 
-    loc_array = []
-    start_time = None
-    for tim, lat, lon in zip(times, lats, lons):
-        if tim and lat and lon:
-            try:
-                validate_longitude(lon)
-            except Exception:
-                raise ValidationError("Invalid longitude value")
-            try:
-                validate_latitude(lat)
-            except Exception:
-                raise ValidationError("Invalid latitude value")
-            try:
-                int(tim)
-            except Exception:
-                raise ValidationError("Invalid time value")
-            if event.start_date.timestamp() <= tim <= event.end_date.timestamp():
-                if not start_time or tim < start_time:
-                    start_time = int(tim)
-                loc_array.append((int(tim), lat, lon))
-
-    device = None
-    if len(loc_array) > 0:
-        device = Device.objects.create(
-            aid=f"{short_random_key()}_GPX",
-            user_agent=request.session.user_agent[:200],
-            is_gpx=True,
-        )
-        device.add_locations(loc_array)
-        competitor.device = device
-        competitor.start_time = epoch_to_datetime(start_time)
-        competitor.save()
+    timestamps, latitudes, longitudes = validate_locations_arrays(
+        timestamps, latitudes, longitudes
+    )
+    in_event = (timestamps >= event.start_date.timestamp()) & (
+        timestamps <= event.end_date.timestamp()
+    )
+    timestamps = timestamps[in_event].astype(np.int64)
+    latitudes = latitudes[in_event]
+    longitudes = longitudes[in_event]
+    location_count = len(timestamps)
 
-    if len(loc_array) == 0:
+    if location_count == 0:
         raise ValidationError("No locations within event schedule were detected")
 
+    device = Device(
+        aid=f"{short_random_key()}_GPX",
+        user_agent=request.session.user_agent[:200],
+        is_gpx=True,
+    )
+    # Keep the first location posted for each timestamp
+    _, unique_indexes = np.unique(timestamps, return_index=True)
+    device.locations_arrays = (
+        timestamps[unique_indexes],
+        latitudes[unique_indexes],
+        longitudes[unique_indexes],
+    )
+    device.save()
+    competitor.device = device
+    competitor.start_time = epoch_to_datetime(int(timestamps.min()))
+    competitor.save()
+
     return Response(
         {
             "id": competitor.aid,
-            "location_count": len(loc_array),
+            "location_count": location_count,
         },
         status=status.HTTP_201_CREATED,
     )
 
 
+def render_cacheable_response(data, headers=None):
+    """
+    Render data to JSON once, with its compressed variants and ETag, so the
+    response can be cached and served as is
+    """
+    content = ORJSONRenderer().render(data)
+    rendered = {
+        "content": content,
+        "headers": {"ETag": f'W/"{safe64encodedsha(content)}"', **(headers or {})},
+    }
+    if len(content) >= COMPRESSION_MIN_LENGTH:
+        rendered["br"] = brotli.compress(content, quality=6)
+        rendered["gzip"] = gzip.compress(content, compresslevel=9)
+    return rendered
+
+
+def get_accepted_encodings(request):
+    encodings = set()
+    for value in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = value.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def serve_rendered_response(request, rendered, headers=None):
+    headers = {**rendered["headers"], **(headers or {})}
+    if request.accepted_renderer.format != "json":
+        return Response(json.loads(rendered["content"]), headers=headers)
+    content = rendered["content"]
+    accepted_encodings = get_accepted_encodings(request)
+    for encoding in ("br", "gzip"):
+        if encoding in rendered and encoding in accepted_encodings:
+            content = rendered[encoding]
+            headers["Content-Encoding"] = encoding
+            break
+    response = HttpResponse(content, content_type="application/json", headers=headers)
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
 @swagger_auto_schema(
     method="get",
     operation_id="event_data",
     operation_description="Read competitors data from an event",
     tags=["Events"],
+    manual_parameters=[since_param],
     responses={
         "200": openapi.Response(
             description="Success response",
@@ -1095,22 +1236,35 @@ def competitor_route_upload(request, competitor_id):
 @api_GET_view
 def event_data(request, event_id):
     t0 = time.time()
-    cache_key_found = None
-    event = None
 
     use_cache = getattr(settings, "CACHE_EVENT_DATA", False)
 
     cache_interval = EVENT_CACHE_INTERVAL
-    live_cache_ts = int(t0 // cache_interval)
-    live_cache_key = f"event:{event_id}:data:{live_cache_ts}:live"
-    if use_cache and cache.has_key(live_cache_key):
-        cache_key_found = live_cache_key
+
+    # Only locations after that time are sent, rounded down to the cache
+    # interval so the clients polling at the same time share the same data
+    since = None
+    since_key = ""
+    if request.GET.get("since"):
         try:
-            data = cache.get(cache_key_found)
-        except Exception:
-            pass
-        else:
-            return Response(data, headers={"X-Cache-Hit": 1})
+            since = int(float(request.GET["since"]) // cache_interval * cache_interval)
+        except (ValueError, OverflowError):
+            raise ValidationError("Invalid since value")
+        # Must be a valid date, and no data can be newer than now
+        if since < 0 or since > t0 + cache_interval:
+            raise ValidationError("Invalid since value")
+        since_key = f":since:{since}"
+
+    cache_version = Event.get_cache_version(event_id)
+    live_cache_ts = int(t0 // cache_interval)
+    live_cache_key = (
+        f"event:{event_id}:rendered_data:v{cache_version}:{live_cache_ts}:live"
+        f"{since_key}"
+    )
+    if use_cache:
+        rendered = cache_get(live_cache_key)
+        if rendered is not MISSING:
+            return serve_rendered_response(request, rendered, {"X-Cache-Hit": 1})
 
     event = (
         Event.objects.select_related("club")
@@ -1121,51 +1275,121 @@ def event_data(request, event_id):
         response = {"error": "No event match this id"}
         return Response(response)
 
-    cache_ts = int(t0 // (cache_interval if event.is_live else 7 * 24 * 3600))
-    cache_suffix = "live" if event.is_live else "archived"
-    cache_key = f"event:{event_id}:data:{cache_ts}:{cache_suffix}"
-    prev_cache_key = f"event:{event_id}:data:{cache_ts - 1}:{cache_suffix}"
-    # then if we have a cache for that
-    # return it if we do
-    if use_cache and not event.is_live and cache.has_key(cache_key):
-        cache_key_found = cache_key
-
-    # If we dont have cache check if we are currently generating cache
-    # if so return previous cache data if available
-    elif (
-        use_cache
-        and cache.has_key(f"{cache_key}:processing")
-        and cache.has_key(prev_cache_key)
-    ):
-        cache_key_found = prev_cache_key
+    event.check_user_permission(request.user)
 
-    if cache_key_found:
-        try:
-            data = cache.get(cache_key_found)
-        except Exception:
-            pass
-        else:
-            return Response(data, headers={"X-Cache-Hit": 1})
+    etag = get_event_data_etag(event, cache_version, since)
+    if not_modified_response := get_conditional_response(request, etag=etag):
+        return not_modified_response
+
+    # Partial data of archived events are not cached as they could not be
+    # invalidated
+    if since is not None and not event.is_live:
+        use_cache = False
+
+    cache_suffix = "live" if event.is_live else "archived"
+    if event.is_live:
+        cache_key = live_cache_key
+    else:
+        # Archived data are kept until the event cache version changes
+        cache_key = f"event:{event_id}:rendered_data:v{cache_version}:archived"
+    # Last data generated, served while they are being generated again
+    latest_cache_key = (
+        f"event:{event_id}:rendered_data:latest:{cache_suffix}{since_key}"
+    )
+    lock_key = f"{cache_key}:processing"
 
-    # else generate data and set that we are generating cache
+    is_locked = False
     if use_cache:
+        rendered = None
+        if not event.is_live:
+            rendered = cache_get(cache_key)
+            if rendered is MISSING:
+                rendered = None
         try:
-            cache.set(f"{cache_key}:processing", 1, 15)
+            # Only one worker generates the data at a time, the others serve
+            # the latest data or wait for the new ones
+            if rendered is None:
+                is_locked = cache.add(lock_key, 1, EVENT_DATA_LOCK_TIMEOUT)
+                if not is_locked:
+                    rendered = cache.get(latest_cache_key)
+                    if rendered is None:
+                        rendered = wait_for_cache(cache_key, EVENT_DATA_WAIT_TIMEOUT)
         except Exception:
             pass
+        if rendered is not None:
+            return serve_rendered_response(request, rendered, {"X-Cache-Hit": 1})
+
+    headers = {"ETag": etag}
+    if event.privacy == PRIVACY_PRIVATE:
+        headers["Cache-Control"] = "Private"
+    try:
+        rendered = render_cacheable_response(get_event_data(event, since, t0), headers)
+        if use_cache:
+            cache_set(cache_key, rendered, 20 if event.is_live else None)
+            try:
+                cache.set(
+                    latest_cache_key,
+                    rendered,
+                    60 if event.is_live else 14 * 24 * 3600,
+                )
+            except Exception:
+                pass
+    finally:
+        if is_locked:
+            try:
+                cache.delete(lock_key)
+            except Exception:
+                pass
+
+    return serve_rendered_response(request, rendered)
 
-    event.check_user_permission(request.user)
 
+def get_event_data_etag(event, cache_version, since):
+    """
+    Validator of the event data computed without generating them, the data
+    of archived events only change with the event cache version, the ones of
+    live events also with the locations of the competitors devices
+    """
+    validator = f"{event.aid}:{cache_version}:{since}"
+    if event.is_live:
+        devices_state = event.competitors.values_list(
+            "device_id",
+            "device___location_count",
+            "device___last_location_datetime",
+            "device__battery_level",
+        ).order_by("id")
+        validator += f":{list(devices_state)}"
+    return f'W/"{safe64encodedsha(validator)}"'
+
+
+def get_event_data(event, since, t0):
     total_nb_pts = 0
     competitors_data = []
 
-    for competitor, from_date, end_date in event.iterate_competitors():
-        encoded_data = ""
-        if competitor.device_id:
-            encoded_data, nb_pts = competitor.device.get_locations_between_dates(
-                from_date, end_date, encode=True
+    since_date = epoch_to_datetime(since) if since is not None else None
+
+    competitors_tracks = []
+    # Tracks of ended events are read from their snapshot
+    snapshot = event.get_snapshot() if since is None else None
+    if snapshot:
+        total_nb_pts = snapshot.location_count
+        for competitor in event.competitors.all().order_by("start_time", "name"):
+            competitors_tracks.append(
+                (competitor, snapshot.tracks.get(competitor.aid, ""))
             )
-            total_nb_pts += nb_pts
+    else:
+        for competitor, from_date, end_date in event.iterate_competitors():
+            encoded_data = ""
+            if since_date:
+                from_date = max(from_date, since_date)
+            if competitor.device_id and from_date <= end_date:
+                encoded_data, nb_pts = competitor.device.get_locations_between_dates(
+                    from_date, end_date, encode=True
+                )
+                total_nb_pts += nb_pts
+            competitors_tracks.append((competitor, encoded_data))
+
+    for competitor, encoded_data in competitors_tracks:
         competitor_data = {
             "id": competitor.aid,
             "encoded_data": encoded_data,
@@ -1183,18 +1407,9 @@ def event_data(request, event_id):
         "duration": (time.time() - t0),
         "timestamp": time.time(),
     }
-
-    headers = {"ETag": f'W/"{safe64encodedsha(json.dumps(response))}"'}
-    if event.privacy == PRIVACY_PRIVATE:
-        headers["Cache-Control"] = "Private"
-
-    if use_cache:
-        try:
-            cache.set(cache_key, response, 20 if event.is_live else 7 * 24 * 3600 + 60)
-        except Exception:
-            pass
-
-    return Response(response, headers=headers)
+    if since is not None:
+        response["since"] = since
+    return response
 
 
 @swagger_auto_schema(
@@ -1220,33 +1435,66 @@ def event_zip(request, event_id):
         return Response(response)
     event.check_user_permission(request.user)
 
+    raster_maps = []
+    if event.map:
+        raster_maps.append((event.map, event.map_title or "Main map"))
+    for ass in event.map_assignations.all():
+        raster_maps.append((ass.map, ass.title))
+
+    # Archives of ended events are kept until the event cache version or
+    # their maps change
+    use_cache = getattr(settings, "CACHE_EVENT_DATA", False) and event.ended
+    response_data = None
+    if use_cache:
+        maps_key = safe64encodedsha(
+            ":".join(f"{raster_map.hash}:{title}" for raster_map, title in raster_maps)
+        )
+        cache_key = (
+            f"event:{event.aid}:zip:v{Event.get_cache_version(event.aid)}:{maps_key}"
+        )
+        try:
+            response_data = cache.get(cache_key)
+        except Exception:
+            pass
+
+    if response_data is None:
+        response_data = get_event_zip(event, raster_maps)
+        if use_cache:
+            try:
+                cache.set(cache_key, response_data, None)
+            except Exception:
+                pass
+
+    headers = {"ETag": f'W/"{safe64encodedsha(response_data)}"'}
+    if event.privacy == PRIVACY_PRIVATE:
+        headers["Cache-Control"] = "Private"
+    response = StreamingHttpRangeResponse(
+        request, response_data, content_type="application/zip", headers=headers
+    )
+    response["Content-Disposition"] = set_content_disposition(f"{event.name}.zip")
+    return response
+
+
+def get_event_zip(event, raster_maps):
+    snapshot = event.get_snapshot()
+
     archive = BytesIO()
     with ZipFile(archive, "w") as fp:
         for competitor, from_date, end_date in event.iterate_competitors():
             if competitor.device_id:
-                data = competitor.device.gpx(from_date, end_date)
+                if snapshot:
+                    data = locations_to_gpx(snapshot.get_locations(competitor.aid))
+                else:
+                    data = competitor.device.gpx(from_date, end_date)
                 filename = f"gpx/{competitor.name} [{competitor.aid}].gpx"
                 with fp.open(filename, "w") as gpx_file:
                     gpx_file.write(data.encode("utf-8"))
-        raster_maps = []
-        if event.map:
-            raster_maps.append((event.map, event.map_title or "Main map"))
-        for ass in event.map_assignations.all():
-            raster_maps.append((ass.map, ass.title))
         for raster_map, title in raster_maps:
             data = raster_map.kmz
             filename = f"kmz/{title}.kmz"
             with fp.open(filename, "w") as kmz_file:
                 kmz_file.write(data)
-    response_data = archive.getvalue()
-    headers = {"ETag": f'W/"{safe64encodedsha(response_data)}"'}
-    if event.privacy == PRIVACY_PRIVATE:
-        headers["Cache-Control"] = "Private"
-    response = StreamingHttpRangeResponse(
-        request, response_data, content_type="application/zip", headers=headers
-    )
-    response["Content-Disposition"] = set_content_disposition(f"{event.name}.zip")
-    return response
+    return archive.getvalue()
 
 
 @swagger_auto_schema(
@@ -1264,10 +1512,155 @@ def ip_latlon(request):
     return Response({"status": "success", "lat": lat, "lon": lon}, headers=headers)
 
 
+def split_posted_values(values):
+    if isinstance(values, str):
+        return [x for x in values.split(",") if x]
+    if isinstance(values, list):
+        return values
+    raise ValidationError("Invalid data format")
+
+
+def parse_posted_locations(timestamps, latitudes, longitudes):
+    """
+    Validate locations posted as lists or comma separated strings,
+    return them as a list of (timestamp, latitude, longitude)
+    """
+    try:
+        lats = [float(x) for x in split_posted_values(latitudes)]
+        lons = [float(x) for x in split_posted_values(longitudes)]
+        times = [int(float(x)) for x in split_posted_values(timestamps)]
+    except (TypeError, ValueError, OverflowError):
+        raise ValidationError("Invalid data format")
+    if not (len(lats) == len(lons) == len(times)):
+        raise ValidationError(
+            "Latitudes, longitudes, and timestamps, should have same amount of points"
+        )
+    loc_array = []
+    for tim, lat, lon in zip(times, lats, lons):
+        if tim and lat and lon:
+            try:
+                validate_longitude(lon)
+            except DjangoValidationError:
+                raise ValidationError("Invalid longitude value")
+            try:
+                validate_latitude(lat)
+            except DjangoValidationError:
+                raise ValidationError("Invalid latitude value")
+            loc_array.append((tim, lat, lon))
+    return loc_array
+
+
+def is_binary_locations_post(request):
+    return media_type_matches(LocationsBinaryParser.media_type, request.content_type)
+
+
+def get_posted_locations_arrays(data, binary=False):
+    """
+    Return the locations posted in binary or as encoded data, as arrays of
+    timestamps, latitudes and longitudes, None if posted otherwise.
+    """
+    if binary:
+        # Only set by LocationsBinaryParser, never read from the posted data
+        return data["locations_arrays"]
+    encoded_data = data.get("encoded_data")
+    if not encoded_data:
+        return None
+    if not isinstance(encoded_data, str):
+        raise ValidationError("Invalid data format")
+    try:
+        return decode_arrays(encoded_data)
+    except ValueError:
+        raise ValidationError("Invalid data format")
+
+
+def validate_locations_arrays(timestamps, latitudes, longitudes):
+    """
+    Check the locations arrays bounds, return them without the locations
+    having a null value
+    """
+    if not (len(timestamps) == len(latitudes) == len(longitudes)):
+        raise ValidationError(
+            "Latitudes, longitudes, and timestamps, should have same amount of points"
+        )
+    is_set = (timestamps != 0) & (latitudes != 0) & (longitudes != 0)
+    timestamps = timestamps[is_set]
+    latitudes = latitudes[is_set]
+    longitudes = longitudes[is_set]
+    if not np.isfinite(timestamps).all():
+        raise ValidationError("Invalid time value")
+    if not ((longitudes >= -180) & (longitudes <= 180)).all():
+        raise ValidationError("Invalid longitude value")
+    if not ((latitudes >= -90) & (latitudes <= 90)).all():
+        raise ValidationError("Invalid latitude value")
+    return timestamps, latitudes, longitudes
+
+
+def parse_posted_locations_data(data, binary=False):
+    """Return the locations posted in any of the supported formats"""
+    arrays = get_posted_locations_arrays(data, binary)
+    if arrays is None:
+        return parse_posted_locations(
+            data.get("timestamps", ""),
+            data.get("latitudes", ""),
+            data.get("longitudes", ""),
+        )
+    timestamps, latitudes, longitudes = validate_locations_arrays(*arrays)
+    return list(
+        zip(
+            timestamps.astype(np.int64).tolist(),
+            latitudes.tolist(),
+            longitudes.tolist(),
+        )
+    )
+
+
+def parse_battery_level(value):
+    # Invalid values do not raise exception to stay compatible with legacy apps
+    try:
+        battery_level = int(value)
+    except Exception:
+        return None
+    if battery_level < 0 or battery_level > 100:
+        return None
+    return battery_level
+
+
+def save_posted_locations(device, loc_array, battery_level, user_agent):
+    """
+    Add the locations posted to the API to the device, or queue them when
+    QUEUE_POSTED_LOCATIONS is enabled
+    """
+    user_agent_changed = user_agent != device.user_agent
+    if not getattr(settings, "QUEUE_POSTED_LOCATIONS", False):
+        if user_agent_changed:
+            device.user_agent = user_agent
+        if battery_level is not None:
+            device.battery_level = battery_level
+        if len(loc_array) > 0:
+            device.add_locations(loc_array, save=False)
+        device.save()
+    elif loc_array or battery_level is not None or user_agent_changed:
+        # Merged into the device later by the flush_queued_locations command
+        queued_locations = QueuedLocations(
+            device=device,
+            battery_level=battery_level,
+            user_agent=user_agent if user_agent_changed else "",
+        )
+        queued_locations.locations_series = loc_array
+        queued_locations.save()
+
+
 @swagger_auto_schema(
     method="post",
     operation_id="upload_device_locations",
-    operation_description="Upload a list of device location",
+    operation_description=(
+        "Upload a list of device location."
+        " Locations can also be posted as a binary body of type"
+        " application/vnd.routechoices.locations, made of 3 arrays of"
+        " little-endian int32: timestamps, latitudes and longitudes"
+        " (in 1e-5 degrees), other parameters being then passed in the"
+        " query string."
+    ),
     tags=["Devices"],
     request_body=openapi.Schema(
         type=openapi.TYPE_OBJECT,
@@ -1298,13 +1691,21 @@ def ip_latlon(request):
                 ),
                 example="1661489045,1661489046,1661489047",
             ),
+            "encoded_data": openapi.Schema(
+                type=openapi.TYPE_STRING,
+                description=(
+                    "Locations in the polyline encoding used for the GPS data "
+                    "of the events, replaces latitudes, longitudes and timestamps"
+                ),
+                example="__zyaY_ibE_ibE??A???",
+            ),
             "battery": openapi.Schema(
                 type=openapi.TYPE_INTEGER,
                 description="Battery load percentage value",
                 example="85",
             ),
         },
-        required=["device_id", "latitudes", "longitudes", "timestamps"],
+        required=["device_id"],
     ),
     responses={
         "201": openapi.Response(
@@ -1325,6 +1726,7 @@ def ip_latlon(request):
 )
 @api_POST_view
 @throttle_classes([PostDataThrottle])
+@locations_parser_classes
 def locations_api_gw(request):
     secret_provided = request.data.get(
         "secret"
@@ -1340,63 +1742,153 @@ def locations_api_gw(request):
     ):
         raise PermissionDenied("Authentication Failed")
 
-    device = Device.objects.filter(aid=device_id).first()
+    device_qs = Device.objects.filter(aid=device_id)
+    if getattr(settings, "QUEUE_POSTED_LOCATIONS", False):
+        device_qs = device_qs.defer("locations_encoded")
+    device = device_qs.first()
     if not device:
         raise ValidationError("No such device ID")
 
-    device_user_agent = request.session.user_agent[:200]
-    if not device.user_agent or device_user_agent != device.user_agent:
-        device.user_agent = device_user_agent
-
-    try:
-        lats = [float(x) for x in request.data.get("latitudes", "").split(",") if x]
-        lons = [float(x) for x in request.data.get("longitudes", "").split(",") if x]
-        times = [
-            int(float(x)) for x in request.data.get("timestamps", "").split(",") if x
-        ]
-    except ValueError:
-        raise ValidationError("Invalid data format")
-    if not (len(lats) == len(lons) == len(times)):
-        raise ValidationError(
-            "Latitudes, longitudes, and timestamps, should have same amount of points"
-        )
-    loc_array = []
-    for tim, lat, lon in zip(times, lats, lons):
-        if tim and lat and lon:
-            try:
-                validate_longitude(lon)
-            except DjangoValidationError:
-                raise ValidationError("Invalid longitude value")
-            try:
-                validate_latitude(lat)
-            except DjangoValidationError:
-                raise ValidationError("Invalid latitude value")
-            loc_array.append((tim, lat, lon))
-
+    loc_array = parse_posted_locations_data(
+        request.data, binary=is_binary_locations_post(request)
+    )
+    battery_level = None
     if battery_level_posted:
-        try:
-            battery_level = int(battery_level_posted)
-        except Exception:
-            pass
-            # raise ValidationError("Invalid battery_level value type")
-            # Do not raise exception to stay compatible with legacy apps
-        else:
-            if battery_level < 0 or battery_level > 100:
-                # raise ValidationError("battery_level value not in 0-100 range")
-                # Do not raise exception to stay compatible with legacy apps
-                pass
-            else:
-                device.battery_level = battery_level
+        battery_level = parse_battery_level(battery_level_posted)
 
-    if len(loc_array) > 0:
-        device.add_locations(loc_array, save=False)
-    device.save()
+    save_posted_locations(
+        device, loc_array, battery_level, request.session.user_agent[:200]
+    )
     return Response(
         {"status": "ok", "location_count": len(loc_array), "device_id": device.aid},
         status=status.HTTP_201_CREATED,
     )
 
 
+@swagger_auto_schema(
+    method="post",
+    operation_id="upload_devices_locations",
+    operation_description=(
+        "Upload lists of locations for multiple devices in a single request"
+    ),
+    tags=["Devices"],
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "devices": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "device_id": openapi.Schema(
+                            type=openapi.TYPE_STRING,
+                            description="<device id>",
+                        ),
+                        "latitudes": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_NUMBER),
+                            description="List of locations latitudes (in degrees)",
+                            example=[60.12345, 60.12346, 60.12347],
+                        ),
+                        "longitudes": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_NUMBER),
+                            description="List of locations longitudes (in degrees)",
+                            example=[20.12345, 20.12346, 20.12347],
+                        ),
+                        "timestamps": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                            description=(
+                                "List of locations timestamps (UNIX epoch in seconds)"
+                            ),
+                            example=[1661489045, 1661489046, 1661489047],
+                        ),
+                        "battery": openapi.Schema(
+                            type=openapi.TYPE_INTEGER,
+                            description="Battery load percentage value",
+                            example="85",
+                        ),
+                    },
+                    required=["device_id", "latitudes", "longitudes", "timestamps"],
+                ),
+            ),
+        },
+        required=["devices"],
+    ),
+    responses={
+        "201": openapi.Response(
+            description="Success response",
+            examples={
+                "application/json": {
+                    "status": "ok",
+                    "location_count": 5,
+                    "devices": {"<device id>": 3, "<other device id>": 2},
+                }
+            },
+        ),
+        "400": openapi.Response(
+            description="Validation Error",
+            examples={"application/json": ["<error message>"]},
+        ),
+    },
+)
+@api_POST_view
+@throttle_classes([PostDataThrottle])
+def locations_batch_api_gw(request):
+    secret_provided = request.data.get("secret")
+    devices_data = request.data.get("devices")
+    if not devices_data or not isinstance(devices_data, list):
+        raise ValidationError("Missing devices parameter")
+
+    posted_data = {}
+    for device_data in devices_data:
+        if not isinstance(device_data, dict):
+            raise ValidationError("Invalid data format")
+        device_id = device_data.get("device_id")
+        if not device_id or not isinstance(device_id, str):
+            raise ValidationError("Missing device_id parameter")
+        if device_id in posted_data:
+            raise ValidationError(f"Device ID {device_id} is listed more than once")
+        if (
+            not request.user.is_authenticated
+            and re.match(r"^[0-9]+$", device_id)
+            and secret_provided not in settings.POST_LOCATION_SECRETS
+        ):
+            raise PermissionDenied("Authentication Failed")
+        loc_array = parse_posted_locations_data(device_data)
+        battery_level = None
+        if device_data.get("battery"):
+            battery_level = parse_battery_level(device_data.get("battery"))
+        posted_data[device_id] = (loc_array, battery_level)
+
+    device_qs = Device.objects.filter(aid__in=posted_data.keys())
+    if getattr(settings, "QUEUE_POSTED_LOCATIONS", False):
+        device_qs = device_qs.defer("locations_encoded")
+    devices = {device.aid: device for device in device_qs}
+    unknown_device_ids = [aid for aid in posted_data.keys() if aid not in devices]
+    if unknown_device_ids:
+        raise ValidationError(f"No such device ID: {', '.join(unknown_device_ids)}")
+
+    user_agent = request.session.user_agent[:200]
+    with transaction.atomic():
+        for device_id, (loc_array, battery_level) in posted_data.items():
+            save_posted_locations(
+                devices[device_id], loc_array, battery_level, user_agent
+            )
+    location_counts = {
+        device_id: len(loc_array) for device_id, (loc_array, _) in posted_data.items()
+    }
+    return Response(
+        {
+            "status": "ok",
+            "location_count": sum(location_counts.values()),
+            "devices": location_counts,
+        },
+        status=status.HTTP_201_CREATED,
+    )
+
+
 class DataRenderer(renderers.BaseRenderer):
     media_type = "application/download"
     format = "raw"
@@ -1751,9 +2243,21 @@ def competitor_gpx_download(request, competitor_id):
 
     event.check_user_permission(request.user)
 
+    # Validator computed without decoding the locations
+    validator = [competitor.aid, Event.get_cache_version(event.aid)]
+    if competitor.device:
+        validator += [
+            competitor.device_id,
+            competitor.device._location_count,
+            competitor.device._last_location_datetime,
+        ]
+    etag = f'W/"{safe64encodedsha(str(validator))}"'
+    if not_modified_response := get_conditional_response(request, etag=etag):
+        return not_modified_response
+
     gpx_data = competitor.gpx
 
-    headers = {}
+    headers = {"ETag": etag}
     if event.privacy == PRIVACY_PRIVATE:
         headers["Cache-Control"] = "Private"
 
@@ -1866,13 +2370,19 @@ def two_d_rerun_race_data(request):
 
     event.check_user_permission(request.user)
 
+    snapshot = event.get_snapshot()
+
     total_nb_pts = 0
     results = []
     for competitor, from_date, end_date in event.iterate_competitors():
         if competitor.device_id:
-            locations, nb_pts = competitor.device.get_locations_between_dates(
-                from_date, end_date
-            )
+            if snapshot:
+                locations = snapshot.get_locations(competitor.aid)
+                nb_pts = len(locations)
+            else:
+                locations, nb_pts = competitor.device.get_locations_between_dates(
+                    from_date, end_date
+                )
             total_nb_pts += nb_pts
             results += [
                 [
@@ -2,12 +2,12 @@ import base64
 from io import BytesIO
 
 import arrow
-from django.core.cache import cache
 from django.core.files import File
 from rest_framework.test import APIClient
 
 from routechoices.api.tests import EssentialApiBase
 from routechoices.core.models import Club, Event, EventSet, Map
+from routechoices.lib.cache import clear_cache
 
 
 class ClubViewsTestCase(EssentialApiBase):
@@ -17,7 +17,7 @@ class ClubViewsTestCase(EssentialApiBase):
         self.club.admins.set([self.user])
 
     def test_club_logo_load(self):
-        cache.clear()
+        clear_cache()
         icon_bytes = base64.b64decode(
             "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXN"
             "SR0IArs4c6QAAAA1JREFUGFdjED765z8ABZcC1M3x7TQAAAAASUVORK5CYII="
@@ -635,6 +635,11 @@ class DeviceAdmin(admin.ModelAdmin):
     )
     show_full_result_count = False
 
+    def save_model(self, request, obj, form, change):
+        if "locations_encoded" in form.changed_data:
+            obj.update_cached_data()
+        super().save_model(request, obj, form, change)
+
     def download_gpx(self, obj):
         return mark_safe(
             '<input value="Download GPX File" '
@@ -3,6 +3,7 @@ import urllib.parse
 
 from background_task import background
 
+from routechoices.core.models import Event, EventSnapshot, Map, get_tile_map
 from routechoices.lib.third_party_downloader import (
     GpsSeurantaNet,
     Livelox,
@@ -83,3 +84,37 @@ def import_single_event_from_livelox(event_id):
     solution = Livelox()
     event = solution.import_event(event_id)
     return event
+
+
+@background(schedule=0)
+def build_event_snapshot(event_id, requested_ts):
+    event = Event.objects.filter(aid=event_id).first()
+    if not event or not event.ended:
+        return
+    snapshot = EventSnapshot.objects.filter(event=event).first()
+    # Already built from data more recent than the request
+    if snapshot and snapshot.creation_date.timestamp() >= requested_ts:
+        return
+    EventSnapshot.build(event)
+
+
+@background(schedule=0)
+def build_map_tile_pyramid(map_id, map_hash):
+    raster_map = Map.objects.filter(aid=map_id).first()
+    # Map modified or deleted since, or pyramid already built
+    if (
+        not raster_map
+        or raster_map.hash != map_hash
+        or raster_map.tile_pyramid_hash == map_hash
+    ):
+        return
+    raster_map.build_tile_pyramid()
+
+
+@background(schedule=0)
+def encode_map_tile(map_id, map_hash, tile_args):
+    raster_map = get_tile_map(map_id)
+    # Map modified or deleted since
+    if not raster_map or raster_map.hash != map_hash:
+        return
+    raster_map.create_tile(*tile_args)
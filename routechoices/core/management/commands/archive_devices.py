@@ -1,5 +1,6 @@
 from datetime import timedelta
 
+import numpy as np
 from django.core.management.base import BaseCommand
 from django.utils.timezone import now
 
@@ -26,7 +27,7 @@ class Command(BaseCommand):
             competitors = device.competitor_set.all()
             periods_used = []
             last_start = None
-            locs = device.locations
+            timestamps, latitudes, longitudes = device.locations_arrays
             device.remove_duplicates(force)
             for competitor in competitors:
                 event = competitor.event
@@ -38,39 +39,30 @@ class Command(BaseCommand):
                         last_start = competitor.start_time
                 end = min(event.end_date, now())
                 periods_used.append((start, end))
-            archived_indexes = []
             if last_start is None:
                 continue
-            for idx, timestamp in enumerate(locs["timestamps"]):
-                archive = False
-                if timestamp >= last_start.timestamp():
-                    archive = False
-                for p in periods_used:
-                    if (
-                        p[0].timestamp() <= timestamp <= p[1].timestamp()
-                        and timestamp < last_start.timestamp()
-                    ):
-                        archive = True
-                        break
-                if archive:
-                    archived_indexes.append(idx)
-            dev_archived_loc_count = len(archived_indexes)
+            is_archived = np.zeros(len(timestamps), dtype=bool)
+            for p in periods_used:
+                is_archived |= (timestamps >= p[0].timestamp()) & (
+                    timestamps <= p[1].timestamp()
+                )
+            is_archived &= timestamps < last_start.timestamp()
+            dev_archived_loc_count = int(is_archived.sum())
             if dev_archived_loc_count:
                 n_device_archived += 1
                 self.stdout.write(
                     f"Device {device.aid}, archiving {dev_archived_loc_count} locations"
                 )
             if force and dev_archived_loc_count:
-                archived_locs = {
-                    "timestamps": [locs["timestamps"][i] for i in archived_indexes],
-                    "latitudes": [locs["latitudes"][i] for i in archived_indexes],
-                    "longitudes": [locs["longitudes"][i] for i in archived_indexes],
-                }
                 archive_dev = Device(
                     aid=f"{short_random_key()}_ARC",
                     is_gpx=True,
                 )
-                archive_dev.locations = archived_locs
+                archive_dev.locations_arrays = (
+                    timestamps[is_archived],
+                    latitudes[is_archived],
+                    longitudes[is_archived],
+                )
                 archive_dev.save()
                 DeviceArchiveReference.objects.create(
                     original=device, archive=archive_dev
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from routechoices.core.models import Map
+
+
+class Command(BaseCommand):
+    help = "Render the tile pyramids of the maps that do not have an up to date one."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--map", dest="map_ids", nargs="+", type=str)
+        parser.add_argument("--force", action="store_true", default=False)
+
+    def handle(self, *args, **options):
+        qs = Map.objects.exclude(image="").order_by("-modification_date")
+        if options["map_ids"]:
+            qs = qs.filter(aid__in=options["map_ids"])
+        n_maps = 0
+        for raster_map in qs.iterator():
+            if not options["force"] and raster_map.tile_pyramid_hash == raster_map.hash:
+                continue
+            try:
+                n_tiles = raster_map.build_tile_pyramid()
+            except Exception as e:
+                self.stderr.write(f"Could not build tiles of map {raster_map.aid}: {e}")
+                continue
+            n_maps += 1
+            self.stdout.write(f"Map {raster_map.aid}: {n_tiles} tiles stored")
+        self.stdout.write(self.style.SUCCESS(f"Built tile pyramids of {n_maps} maps"))
@@ -1,9 +1,12 @@
-from django.core.cache import cache
 from django.core.management.base import BaseCommand
 
+from routechoices.lib.cache import clear_cache
+from routechoices.lib.raster_store import clear_rasters
+
 
 class Command(BaseCommand):
     help = "Clear cache"
 
     def handle(self, *args, **options):
-        cache.clear()
+        clear_cache()
+        clear_rasters()
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+
+from routechoices.core.models import Device, QueuedLocations
+
+
+class Command(BaseCommand):
+    help = "Merge the locations queued by the API into their devices."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5)
+        parser.add_argument("--once", action="store_true", default=False)
+
+    def flush(self):
+        n = 0
+        device_ids = set(
+            QueuedLocations.objects.values_list("device_id", flat=True).distinct()
+        )
+        for device_id in device_ids:
+            try:
+                with transaction.atomic():
+                    device = (
+                        Device.objects.select_for_update().filter(id=device_id).first()
+                    )
+                    if device:
+                        n += device.merge_queued_locations()
+            except Exception as e:
+                # Left queued, the other devices are still flushed
+                self.stderr.write(
+                    f"Could not flush the locations of device {device_id}: {e}"
+                )
+        return n
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        while True:
+            try:
+                t0 = time.time()
+                n = self.flush()
+                if options["once"]:
+                    self.stdout.write(f"{n} locations flushed")
+                    break
+                if n:
+                    self.stdout.write(f"{n} locations flushed")
+                time.sleep(max(0, interval - (time.time() - t0)))
+                # Not kept open past its max age while the command runs
+                close_old_connections()
+            except KeyboardInterrupt:
+                break
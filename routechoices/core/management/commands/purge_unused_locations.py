@@ -26,7 +26,7 @@ class Command(BaseCommand):
             orig_pts_count = device.location_count
             device.remove_duplicates(force)
             pts_count_after_deduplication = device.location_count
-            locs = device.locations
+            timestamps, latitudes, longitudes = device.locations_arrays
             periods_used = []
             competitors = device.competitor_set.all()
             for competitor in competitors:
@@ -38,22 +38,14 @@ class Command(BaseCommand):
                 end = min(event.end_date, two_weeks_ago)
                 if start < end:
                     periods_used.append((start, end))
-            valid_indexes = []
-            for idx, timestamp in enumerate(locs["timestamps"]):
-                is_valid = False
-                if timestamp >= two_weeks_ago.timestamp():
-                    is_valid = True
-                if not is_valid:
-                    for p in periods_used:
-                        if p[0].timestamp() <= timestamp <= p[1].timestamp():
-                            is_valid = True
-                            break
-                if is_valid:
-                    valid_indexes.append(idx)
-            dev_del_loc_count_total = orig_pts_count - len(valid_indexes)
-            dev_del_loc_count_invalids = pts_count_after_deduplication - len(
-                valid_indexes
-            )
+            is_valid = timestamps >= two_weeks_ago.timestamp()
+            for p in periods_used:
+                is_valid |= (timestamps >= p[0].timestamp()) & (
+                    timestamps <= p[1].timestamp()
+                )
+            valid_count = int(is_valid.sum())
+            dev_del_loc_count_total = orig_pts_count - valid_count
+            dev_del_loc_count_invalids = pts_count_after_deduplication - valid_count
             if dev_del_loc_count_total:
                 if orig_pts_count - pts_count_after_deduplication > 0:
                     self.stdout.write(
@@ -69,12 +61,11 @@ class Command(BaseCommand):
                     )
             deleted_count += dev_del_loc_count_total
             if force and dev_del_loc_count_invalids:
-                new_locs = {
-                    "timestamps": [locs["timestamps"][i] for i in valid_indexes],
-                    "latitudes": [locs["latitudes"][i] for i in valid_indexes],
-                    "longitudes": [locs["longitudes"][i] for i in valid_indexes],
-                }
-                device.locations = new_locs
+                device.locations_arrays = (
+                    timestamps[is_valid],
+                    latitudes[is_valid],
+                    longitudes[is_valid],
+                )
                 device.save()
         if force:
             self.stdout.write(
@@ -28,6 +28,15 @@ class Command(BaseCommand):
                 key = obj["Key"]
                 yield key
 
+    def process_tile_file(self, tile_name, force):
+        # tiles/<map aid>/<map hash>/...
+        if "/".join(tile_name.split("/")[1:3]) not in self.tile_pyramids:
+            self.n_image_removed += 1
+            if force:
+                s3_delete_key(tile_name, settings.AWS_S3_BUCKET)
+        else:
+            self.n_image_keeped += 1
+
     def process_image_file(self, image_name, force):
         if image_name not in self.image_paths:
             self.n_image_removed += 1
@@ -58,12 +67,19 @@ class Command(BaseCommand):
             )
         )
 
+        # Pyramids of the current maps, including the ones being built
+        self.tile_pyramids = {
+            f"{raster_map.aid}/{raster_map.hash}" for raster_map in Map.objects.all()
+        }
+
         self.n_image_removed = 0
         self.n_image_keeped = 0
         self.s3 = get_s3_client()
         for directory in ("maps", "logos", "banners"):
             for filename in self.scan_directory(directory):
                 self.process_image_file(filename, force)
+        for filename in self.scan_directory("tiles/"):
+            self.process_tile_file(filename, force)
 
         if force:
             self.stdout.write(
@@ -4,6 +4,7 @@ import sys
 from django.core.management.base import BaseCommand
 from tornado.ioloop import IOLoop
 
+from routechoices.lib.live_push import LivePushServer
 from routechoices.lib.tcp_protocols import (
     gt06,
     mictrack,
@@ -41,6 +42,9 @@ class Command(BaseCommand):
         parser.add_argument(
             "--tracktape-port", nargs="?", type=int, help="Tracktape Handler Port"
         )
+        parser.add_argument(
+            "--sse-port", nargs="?", type=int, help="Live Locations Push Port"
+        )
 
     def handle(self, *args, **options):
         signal.signal(signal.SIGTERM, sigterm_handler)
@@ -62,6 +66,9 @@ class Command(BaseCommand):
         if options.get("xexun_port"):
             xexun_server = xexun.XexunServer()
             xexun_server.listen(options["xexun_port"])
+        if options.get("sse_port"):
+            sse_server = LivePushServer()
+            sse_server.listen(options["sse_port"])
         try:
             print("Start listening TCP data...", flush=True)
             IOLoop.current().start()
@@ -78,6 +85,8 @@ class Command(BaseCommand):
                 tracktape_server.stop()
             if options.get("xexun_port"):
                 xexun_server.stop()
+            if options.get("sse_port"):
+                sse_server.stop()
             IOLoop.current().stop()
         finally:
             print("Stopped listening TCP data...", flush=True)
@@ -0,0 +1,44 @@
+import signal
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from routechoices.lib.tile_render_service import (
+    TileRenderServer,
+    get_tile_render_socket,
+)
+
+
+def sigterm_handler(_signo, _stack_frame):
+    # Raises SystemExit(0):
+    sys.exit(0)
+
+
+class Command(BaseCommand):
+    help = "Run the service rendering the map tiles in a pool of processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", type=str, help="Unix socket path")
+        parser.add_argument("--workers", type=int, help="Rendering processes")
+        parser.add_argument(
+            "--queue-size", type=int, help="Pending renders before refusing tiles"
+        )
+
+    def handle(self, *args, **options):
+        address = options["socket"] or get_tile_render_socket()
+        if not address:
+            raise CommandError("Set TILE_RENDER_SOCKET or give a --socket path")
+        signal.signal(signal.SIGTERM, sigterm_handler)
+        server = TileRenderServer(
+            address=address,
+            workers=options["workers"],
+            queue_size=options["queue_size"],
+        )
+        try:
+            print(f"Start rendering tiles on {address}...", flush=True)
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            server.stop()
+            print("Stopped rendering tiles...", flush=True)
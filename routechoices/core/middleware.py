@@ -7,7 +7,6 @@ import arrow
 from corsheaders.middleware import CorsMiddleware as OrigCorsMiddleware
 from django.conf import settings
 from django.contrib.gis.geoip2 import GeoIP2
-from django.core.cache import cache
 from django.core.exceptions import DisallowedHost
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
 from django.middleware.csrf import CsrfViewMiddleware as OrigCsrfViewMiddleware
@@ -21,6 +20,7 @@ from django_hosts.middleware import HostsBaseMiddleware
 from rest_framework import status
 
 from routechoices.core.models import Club
+from routechoices.lib.cache import MISSING, cache_get, cache_set
 
 XFF_EXEMPT_URLS = []
 if hasattr(settings, "XFF_EXEMPT_URLS"):
@@ -163,8 +163,8 @@ class HostsRequestMiddleware(HostsBaseMiddleware):
                 "www",
             ):
                 cache_key = f"club_slug_exists:{slug}"
-                cached_slug = cache.get(cache_key)
-                if cached_slug:
+                cached_slug = cache_get(cache_key)
+                if cached_slug is not MISSING:
                     club_slug = cached_slug
                 else:
                     club_exists = Club.objects.filter(slug__iexact=slug).exists()
@@ -186,11 +186,11 @@ class HostsRequestMiddleware(HostsBaseMiddleware):
                             request, "club/404.html", status=status.HTTP_404_NOT_FOUND
                         )
                     club_slug = slug.lower()
-                    cache.set(cache_key, club_slug, 60)
+                    cache_set(cache_key, club_slug, 60)
         else:
             cache_key = f"club_domain_exists:{raw_host}"
-            cached_slug = cache.get(cache_key)
-            if cached_slug:
+            cached_slug = cache_get(cache_key)
+            if cached_slug is not MISSING:
                 club_slug = cached_slug
             else:
                 club = Club.objects.filter(domain__iexact=raw_host).first()
@@ -199,7 +199,7 @@ class HostsRequestMiddleware(HostsBaseMiddleware):
                         request, "404-cname.html", status=status.HTTP_404_NOT_FOUND
                     )
                 club_slug = club.slug
-                cache.set(cache_key, club_slug, 60)
+                cache_set(cache_key, club_slug, 60)
             original_host = f"{club_slug}{default_subdomain_suffix}"
             host, kwargs = self.get_host(original_host)
             request.use_cname = True
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2024-10-14 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0078_rename_usersetting_usersettings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceLocationChunk",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_location_datetime", models.DateTimeField()),
+                ("last_location_datetime", models.DateTimeField()),
+                ("location_count", models.PositiveIntegerField(default=0)),
+                ("locations_encoded", models.TextField(blank=True, default="")),
+                (
+                    "device",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="location_chunks",
+                        to="core.device",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "device location chunk",
+                "verbose_name_plural": "device location chunks",
+                "ordering": ["first_location_datetime"],
+                "indexes": [
+                    models.Index(
+                        models.F("device_id"),
+                        models.F("first_location_datetime"),
+                        models.F("last_location_datetime"),
+                        name="core_device_loc_chunk_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2024-10-15 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0079_devicelocationchunk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="devicelocationchunk",
+            name="locations_index",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2024-10-16 10:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0080_devicelocationchunk_locations_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueuedLocations",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("creation_date", models.DateTimeField(auto_now_add=True)),
+                ("locations_encoded", models.TextField(blank=True, default="")),
+                (
+                    "battery_level",
+                    models.PositiveIntegerField(blank=True, default=None, null=True),
+                ),
+                ("user_agent", models.CharField(blank=True, max_length=200)),
+                (
+                    "device",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="queued_locations",
+                        to="core.device",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "queued locations",
+                "verbose_name_plural": "queued locations",
+                "ordering": ["id"],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2024-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0081_queuedlocations"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EventSnapshot",
+            fields=[
+                (
+                    "event",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="snapshot",
+                        serialize=False,
+                        to="core.event",
+                    ),
+                ),
+                ("creation_date", models.DateTimeField()),
+                ("tracks", models.JSONField(default=dict)),
+                ("location_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
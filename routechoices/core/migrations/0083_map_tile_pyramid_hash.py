@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2024-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0082_eventsnapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="map",
+            name="tile_pyramid_hash",
+            field=models.CharField(blank=True, editable=False, max_length=8),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.1 on 2024-10-18 15:21
+
+import math
+
+from django.db import migrations, models
+
+ORIGIN_SHIFT = math.pi * 6378137
+
+
+def set_mercator_bbox(apps, schema_editor):
+    Map = apps.get_model("core", "Map")
+    for rmap in Map.objects.all().only("id", "corners_coordinates").iterator():
+        try:
+            coords = [float(x) for x in rmap.corners_coordinates.split(",")]
+            xs = [lon * ORIGIN_SHIFT / 180.0 for lon in coords[1::2]]
+            ys = [
+                math.log(math.tan((90 + lat) * math.pi / 360.0))
+                / (math.pi / 180.0)
+                * ORIGIN_SHIFT
+                / 180.0
+                for lat in coords[::2]
+            ]
+        except (ValueError, ZeroDivisionError):
+            continue
+        Map.objects.filter(id=rmap.id).update(
+            mercator_min_x=min(xs),
+            mercator_max_x=max(xs),
+            mercator_min_y=min(ys),
+            mercator_max_y=max(ys),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0083_map_tile_pyramid_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="map",
+            name="mercator_max_x",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="map",
+            name="mercator_max_y",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="map",
+            name="mercator_min_x",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="map",
+            name="mercator_min_y",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(set_mercator_bbox, migrations.RunPython.noop),
+    ]
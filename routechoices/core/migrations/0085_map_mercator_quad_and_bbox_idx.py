@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2024-10-18 17:02
+
+import math
+
+from django.db import migrations, models
+
+ORIGIN_SHIFT = math.pi * 6378137
+
+
+def set_mercator_quad(apps, schema_editor):
+    Map = apps.get_model("core", "Map")
+    for rmap in Map.objects.all().only("id", "corners_coordinates").iterator():
+        try:
+            coords = [float(x) for x in rmap.corners_coordinates.split(",")]
+            quad = [
+                [
+                    lon * ORIGIN_SHIFT / 180.0,
+                    math.log(math.tan((90 + lat) * math.pi / 360.0))
+                    / (math.pi / 180.0)
+                    * ORIGIN_SHIFT
+                    / 180.0,
+                ]
+                for lat, lon in zip(coords[::2], coords[1::2])
+            ]
+        except (ValueError, ZeroDivisionError):
+            continue
+        Map.objects.filter(id=rmap.id).update(mercator_quad_coordinates=quad)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0084_map_mercator_bbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="map",
+            name="mercator_quad_coordinates",
+            field=models.JSONField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="map",
+            index=models.Index(
+                models.F("mercator_min_x"),
+                models.F("mercator_max_x"),
+                models.F("mercator_min_y"),
+                models.F("mercator_max_y"),
+                name="core_map_mercator_bbox_idx",
+            ),
+        ),
+        migrations.RunPython(set_mercator_quad, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2024-10-18 19:12
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+
+
+def set_chunked_location_count(apps, schema_editor):
+    Device = apps.get_model("core", "Device")
+    DeviceLocationChunk = apps.get_model("core", "DeviceLocationChunk")
+    chunked_counts = (
+        DeviceLocationChunk.objects.filter(device_id=OuterRef("id"))
+        .values("device_id")
+        .annotate(total=Sum("location_count"))
+        .values("total")
+    )
+    Device.objects.filter(
+        id__in=DeviceLocationChunk.objects.values("device_id")
+    ).update(_chunked_location_count=Subquery(chunked_counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0085_map_mercator_quad_and_bbox_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="device",
+            name="_chunked_location_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_chunked_location_count, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 import base64
 import bisect
+import functools
 import logging
 import math
 import os.path
@@ -21,17 +22,16 @@ import numpy as np
 from allauth.account.models import EmailAddress
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.gis.geos import LinearRing, Polygon
 from django.core.cache import cache
 from django.core.exceptions import BadRequest, PermissionDenied, ValidationError
 from django.core.files.base import ContentFile, File
 from django.core.mail import EmailMessage
 from django.core.paginator import Paginator
 from django.core.validators import MaxValueValidator, MinValueValidator, validate_slug
-from django.db import models
+from django.db import models, transaction
 from django.db.models import F, Min, Q
 from django.db.models.functions import ExtractMonth, ExtractYear, Upper
-from django.db.models.signals import post_delete, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.http.response import Http404
 from django.shortcuts import get_object_or_404
@@ -43,7 +43,18 @@ from PIL import Image, ImageDraw
 from pillow_heif import register_avif_opener
 
 from routechoices.lib import plausible
+from routechoices.lib.cache import MISSING, cache_get, cache_set, wait_for_cache
 from routechoices.lib.globalmaptiles import GlobalMercator
+from routechoices.lib.gps_encoding import (
+    build_sparse_index,
+    decode_arrays,
+    decode_first_location,
+    decode_locations_between,
+    encode_appended_locations,
+    encode_arrays,
+    encoded_location_count,
+    round_coordinate,
+)
 from routechoices.lib.helpers import (
     adjugate_matrix,
     avg_angles,
@@ -53,6 +64,7 @@ from routechoices.lib.helpers import (
     epoch_to_datetime,
     general_2d_projection,
     get_current_site,
+    polygon_intersects_rectangle,
     project,
     random_device_id,
     random_key,
@@ -62,7 +74,21 @@ from routechoices.lib.helpers import (
     time_base32,
 )
 from routechoices.lib.jxl import register_jxl_opener
+from routechoices.lib.live_push import is_live_push_enabled, publish_locations
+from routechoices.lib.raster_store import load_raster, save_raster
+from routechoices.lib.s3 import s3_get_object, s3_put_object
+from routechoices.lib.slippy_tiles import (
+    MERCATOR_ORIGIN_SHIFT,
+    mercator_bounds_tiles_range,
+    mercator_bounds_to_tile_xy,
+    tile_xy_to_mercator_bounds,
+)
 from routechoices.lib.storages import OverwriteImageStorage
+from routechoices.lib.tile_disk_cache import (
+    get_tile_disk_cache_dir,
+    invalidate_disk_tiles,
+    remove_map_disk_tiles,
+)
 from routechoices.lib.validators import (
     validate_corners_coordinates,
     validate_domain_name,
@@ -82,6 +108,8 @@ logger = logging.getLogger(__name__)
 
 GLOBAL_MERCATOR = GlobalMercator()
 EVENT_CACHE_INTERVAL = 5
+# Seconds after its start a snapshot task is not scheduled again
+SNAPSHOT_LOCK_DELAY = 60
 
 WEBP_MAX_SIZE = 16383
 
@@ -89,6 +117,10 @@ LOCATION_TIMESTAMP_INDEX = 0
 LOCATION_LATITUDE_INDEX = 1
 LOCATION_LONGITUDE_INDEX = 2
 
+# Number of locations stored in each sealed chunk of a device locations
+LOCATION_CHUNK_SIZE = 3600
+LOCATION_INDEX_STEP = 100
+
 
 class Point:
     def __init__(self, x, y=None):
@@ -411,6 +443,307 @@ def map_upload_path(instance=None, file_name=None):
 NOT_CACHED_TILE = 0
 CACHED_TILE = 1
 CACHED_BLANK_TILE = 2
+STORED_TILE = 3
+IMAGE_LEVEL_MIN_SIZE = 256
+METATILE_LOCK_TIMEOUT = 30
+METATILE_WAIT_TIMEOUT = 10
+# Formats much slower to encode, served as FAST_TILE_MIME until encoded
+SLOW_TILE_MIMES = ("image/avif", "image/jxl")
+FAST_TILE_MIME = "image/webp"
+TILE_ENCODING_LOCK_TIMEOUT = 60
+
+
+def is_tile_pyramid_enabled():
+    return getattr(settings, "TILE_PYRAMID_ENABLED", False)
+
+
+def is_tile_fast_first_enabled():
+    return getattr(settings, "TILE_FAST_FIRST_ENABLED", False)
+
+
+def get_metatile_size():
+    return getattr(settings, "METATILE_SIZE", 4)
+
+
+def get_tile_pyramid_sizes():
+    return getattr(settings, "TILE_PYRAMID_SIZES", [512])
+
+
+def get_tile_pyramid_mimes():
+    return getattr(settings, "TILE_PYRAMID_MIMES", ["image/webp"])
+
+
+def image_levels_count(width, height):
+    count = 1
+    while max(width, height) > IMAGE_LEVEL_MIN_SIZE:
+        width, height = (width + 1) // 2, (height + 1) // 2
+        count += 1
+    return count
+
+
+def build_image_levels(img):
+    """
+    Downsample an image by halving its size until it fits in a tile,
+    return the list of levels starting with the image itself
+    """
+    levels = [img]
+    while max(levels[-1].shape[:2]) > IMAGE_LEVEL_MIN_SIZE:
+        height, width = levels[-1].shape[:2]
+        levels.append(
+            cv2.resize(
+                levels[-1],
+                ((width + 1) // 2, (height + 1) // 2),
+                interpolation=cv2.INTER_AREA,
+            )
+        )
+    return levels
+
+
+def encode_tile(tile_img, img_mime):
+    extra_args = []
+    if img_mime in ("image/avif", "image/jxl"):
+        color_converted = cv2.cvtColor(tile_img, cv2.COLOR_BGRA2RGBA)
+        pil_image = Image.fromarray(color_converted)
+        buffer = BytesIO()
+        pil_image.save(buffer, img_mime[6:].upper(), optimize=True, quality=40)
+        return buffer.getvalue()
+    if img_mime == "image/webp":
+        extra_args = [int(cv2.IMWRITE_WEBP_QUALITY), 40]
+    elif img_mime == "image/jpeg":
+        extra_args = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
+    _, buffer = cv2.imencode(f".{img_mime[6:]}", tile_img, extra_args)
+    return BytesIO(buffer).getvalue()
+
+
+def tile_cache_key_suffix(
+    output_width, output_height, img_mime, min_lon, max_lon, min_lat, max_lat
+):
+    # Same key for a tile of the grid whatever the rounding of its bounds
+    tile_xyz = mercator_bounds_to_tile_xy(min_lon, max_lon, min_lat, max_lat)
+    if tile_xyz is not None:
+        tile_x, tile_y, tile_z = tile_xyz
+        return (
+            f"tile:{output_width}x{output_height}:"
+            f"{tile_z}/{tile_x}/{tile_y}:"
+            f"{img_mime}"
+        )
+    return (
+        f"tile:{output_width}x{output_height}:"
+        f"{min_lon},{max_lon},{min_lat},{max_lat}:"
+        f"{img_mime}"
+    )
+
+
+def alpha_composite(bottom_img, top_img):
+    """Draw a BGRA image over another one of the same size"""
+    top_alpha = top_img[:, :, 3:].astype(np.float32) / 255
+    bottom_alpha = bottom_img[:, :, 3:].astype(np.float32) / 255 * (1 - top_alpha)
+    alpha = top_alpha + bottom_alpha
+    color = (
+        top_img[:, :, :3] * top_alpha + bottom_img[:, :, :3] * bottom_alpha
+    ) / np.maximum(alpha, 1e-6)
+    return np.dstack((color, alpha * 255)).round().astype(np.uint8)
+
+
+def get_tile_map(map_id):
+    """
+    Map, or composite of maps for ids joined by "+", with the tiles interface
+    of a Map, None if one of the maps does not exist anymore
+    """
+    map_ids = map_id.split("+")
+    raster_maps = {
+        raster_map.aid: raster_map for raster_map in Map.objects.filter(aid__in=map_ids)
+    }
+    if len(raster_maps) != len(set(map_ids)):
+        return None
+    if len(map_ids) == 1:
+        return raster_maps[map_id]
+    return MapComposite([raster_maps[aid] for aid in map_ids])
+
+
+class MapComposite:
+    """
+    Several maps drawn in their order over one another, with the tiles
+    interface of a Map
+    """
+
+    def __init__(self, raster_maps):
+        self.raster_maps = list(raster_maps)
+
+    @property
+    def aid(self):
+        return "+".join(raster_map.aid for raster_map in self.raster_maps)
+
+    @property
+    def hash(self):
+        return safe64encodedsha(
+            "|".join(
+                f"{raster_map.aid}:{raster_map.hash}" for raster_map in self.raster_maps
+            )
+        )
+
+    def tile_cache_key(
+        self, output_width, output_height, img_mime, min_lon, max_lon, min_lat, max_lat
+    ):
+        return f"maps:{self.hash}:" + tile_cache_key_suffix(
+            output_width, output_height, img_mime, min_lon, max_lon, min_lat, max_lat
+        )
+
+    def tile_maps(self, min_x, max_x, min_y, max_y):
+        return [
+            raster_map
+            for raster_map in self.raster_maps
+            if raster_map.intersects_with_tile(min_x, max_x, min_y, max_y)
+        ]
+
+    def bbox_intersects_with_tile(self, min_x, max_x, min_y, max_y):
+        return any(
+            raster_map.bbox_intersects_with_tile(min_x, max_x, min_y, max_y)
+            for raster_map in self.raster_maps
+        )
+
+    def get_ready_tile(
+        self,
+        output_width,
+        output_height,
+        img_mime,
+        min_x,
+        max_x,
+        min_y,
+        max_y,
+    ):
+        """Same as Map.get_ready_tile"""
+        bounds = (min_x, max_x, min_y, max_y)
+        raster_maps = self.tile_maps(*bounds)
+        if not raster_maps:
+            return (
+                render_blank_tile(output_width, output_height, img_mime),
+                CACHED_BLANK_TILE,
+            )
+        if len(raster_maps) == 1:
+            return raster_maps[0].get_ready_tile(
+                output_width, output_height, img_mime, *bounds
+            )
+        if getattr(settings, "CACHE_TILES", False):
+            cached = cache_get(
+                MapComposite(raster_maps).tile_cache_key(
+                    output_width, output_height, img_mime, *bounds
+                )
+            )
+            if cached is not MISSING:
+                return cached, CACHED_TILE
+        return None, None
+
+    def create_tile(
+        self,
+        output_width,
+        output_height,
+        img_mime,
+        min_x,
+        max_x,
+        min_y,
+        max_y,
+    ):
+        """
+        Coordinates must be given in spherical mercator X Y
+        """
+        bounds = (min_x, max_x, min_y, max_y)
+        data_out, cache_hit = self.get_ready_tile(
+            output_width, output_height, img_mime, *bounds
+        )
+        if data_out is not None:
+            return data_out, cache_hit
+
+        # Only the maps drawn on the tile are part of its key
+        raster_maps = self.tile_maps(*bounds)
+        if len(raster_maps) == 1:
+            return raster_maps[0].create_tile(
+                output_width, output_height, img_mime, *bounds
+            )
+        use_cache = getattr(settings, "CACHE_TILES", False)
+        tile_img = None
+        for raster_map in raster_maps:
+            map_tile_img = raster_map.warp_tile(
+                raster_map.get_image_level(
+                    raster_map.tile_image_level(min_x, max_x, output_width),
+                    use_cache,
+                ),
+                output_width,
+                output_height,
+                *bounds,
+            )
+            if tile_img is None:
+                tile_img = map_tile_img
+            else:
+                tile_img = alpha_composite(tile_img, map_tile_img)
+        data_out = encode_tile(tile_img, img_mime)
+        if use_cache:
+            cache_set(
+                MapComposite(raster_maps).tile_cache_key(
+                    output_width, output_height, img_mime, *bounds
+                ),
+                data_out,
+                3600 * 24 * 30,
+            )
+        return data_out, NOT_CACHED_TILE
+
+    def schedule_tile_encoding(
+        self,
+        output_width,
+        output_height,
+        img_mime,
+        min_x,
+        max_x,
+        min_y,
+        max_y,
+    ):
+        """Render and cache a tile in a background task"""
+        from routechoices.core.bg_tasks import encode_map_tile
+
+        tile_args = [output_width, output_height, img_mime, min_x, max_x, min_y, max_y]
+        lock_key = f"{self.tile_cache_key(*tile_args)}:encoding"
+        try:
+            # Scheduled once, not on every request until it is done
+            if not cache.add(lock_key, 1, TILE_ENCODING_LOCK_TIMEOUT):
+                return
+        except Exception:
+            return
+        encode_map_tile(self.aid, self.hash, tile_args)
+
+
+# Shared by all the maps, encoded once per process
+@functools.lru_cache(maxsize=64)
+def render_blank_tile(output_width, output_height, img_mime):
+    if img_mime in ("image/avif", "image/jxl"):
+        buffer = BytesIO()
+        pil_image = Image.new(
+            mode="RGBA",
+            size=(output_height, output_width),
+            color=(255, 255, 255, 0),
+        )
+        pil_image.save(
+            buffer,
+            img_mime[6:].upper(),
+            optimize=True,
+            quality=10,
+        )
+        return buffer.getvalue()
+    n_channels = 3 if img_mime == "image/jpeg" else 4
+    transparent_img = np.zeros(
+        (output_height, output_width, n_channels), dtype=np.uint8
+    )
+    extra_args = []
+    if img_mime == "image/webp":
+        extra_args = [int(cv2.IMWRITE_WEBP_QUALITY), 10]
+    elif img_mime == "image/jpeg":
+        transparent_img[:, :] = (255, 255, 255)
+        extra_args = [int(cv2.IMWRITE_JPEG_QUALITY), 10]
+    _, buffer = cv2.imencode(
+        f".{img_mime[6:]}",
+        transparent_img,
+        extra_args,
+    )
+    return BytesIO(buffer).getvalue()
 
 
 class Map(models.Model):
@@ -445,15 +778,65 @@ class Map(models.Model):
         "eg: 60.519,22.078,60.518,22.115,60.491,22.112,60.492,22.073",
         validators=[validate_corners_coordinates],
     )
+    tile_pyramid_hash = models.CharField(max_length=8, blank=True, editable=False)
+    # Bounding box in spherical mercator, to discard tiles outside of the map
+    mercator_min_x = models.FloatField(null=True, editable=False)
+    mercator_max_x = models.FloatField(null=True, editable=False)
+    mercator_min_y = models.FloatField(null=True, editable=False)
+    mercator_max_y = models.FloatField(null=True, editable=False)
+    # Corners in spherical mercator, clockwise from top left
+    mercator_quad_coordinates = models.JSONField(null=True, editable=False)
 
     class Meta:
         ordering = ["-creation_date"]
         verbose_name = "map"
         verbose_name_plural = "maps"
+        indexes = [
+            models.Index(
+                "mercator_min_x",
+                "mercator_max_x",
+                "mercator_min_y",
+                "mercator_max_y",
+                name="core_map_mercator_bbox_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name}"
 
+    def save(self, *args, **kwargs):
+        self.update_mercator_bbox()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "corners_coordinates" in update_fields:
+            kwargs["update_fields"] = [
+                *update_fields,
+                "mercator_min_x",
+                "mercator_max_x",
+                "mercator_min_y",
+                "mercator_max_y",
+                "mercator_quad_coordinates",
+            ]
+        super().save(*args, **kwargs)
+        remove_map_disk_tiles(self.aid, keep_hash=self.hash)
+        if self.pk and get_tile_disk_cache_dir():
+            event_ids = list(
+                Event.objects.filter(
+                    Q(map_id=self.pk) | Q(map_assignations__map_id=self.pk)
+                )
+                .values_list("aid", flat=True)
+                .distinct()
+            )
+            # Layers of the events may now show another version of the map
+            transaction.on_commit(
+                lambda: [invalidate_disk_tiles(event_id) for event_id in event_ids]
+            )
+        if (
+            is_tile_pyramid_enabled()
+            and self.image
+            and self.tile_pyramid_hash != self.hash
+        ):
+            self.schedule_tile_pyramid()
+
     @property
     def path(self):
         return self.image.name
@@ -461,15 +844,12 @@ class Map(models.Model):
     @property
     def data(self):
         cache_key = f"map:{self.image.name}:data"
-        cached = cache.get(cache_key)
-        if cached:
+        cached = cache_get(cache_key)
+        if cached is not MISSING:
             return cached
         with self.image.open("rb") as fp:
             data = fp.read()
-        try:
-            cache.set(cache_key, data, 3600)
-        except Exception:
-            pass
+        cache_set(cache_key, data, 3600)
         return data
 
     @property
@@ -699,11 +1079,8 @@ class Map(models.Model):
     def tile_cache_key(
         self, output_width, output_height, img_mime, min_lon, max_lon, min_lat, max_lat
     ):
-        return (
-            f"map:{self.aid}:{self.hash}:tile:"
-            f"{output_width}x{output_height}:"
-            f"{min_lon},{max_lon},{min_lat},{max_lat}:"
-            f"{img_mime}"
+        return f"map:{self.aid}:{self.hash}:" + tile_cache_key_suffix(
+            output_width, output_height, img_mime, min_lon, max_lon, min_lat, max_lat
         )
 
     def create_tile(
@@ -719,106 +1096,260 @@ class Map(models.Model):
         """
         Coordinates must be given in spherical mercator X Y
         """
+        data_out, cache_hit = self.get_ready_tile(
+            output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+        )
+        if data_out is not None:
+            return data_out, cache_hit
+
         cache_key = self.tile_cache_key(
             output_width, output_height, img_mime, min_x, max_x, min_y, max_y
         )
         use_cache = getattr(settings, "CACHE_TILES", False)
-        cached = None
+        tile_xyz = mercator_bounds_to_tile_xy(min_x, max_x, min_y, max_y)
+        if use_cache and tile_xyz is not None and output_width == output_height:
+            data_out = self.create_metatile(output_width, img_mime, *tile_xyz)
+            if data_out is not None:
+                return data_out, NOT_CACHED_TILE
+
+        data_out = self.render_tile(
+            self.get_image_level(
+                self.tile_image_level(min_x, max_x, output_width), use_cache
+            ),
+            output_width,
+            output_height,
+            img_mime,
+            min_x,
+            max_x,
+            min_y,
+            max_y,
+        )
         if use_cache:
-            try:
-                cached = cache.get(cache_key)
-            except Exception:
-                pass
-            else:
-                if cached:
-                    return cached, CACHED_TILE
+            cache_set(cache_key, data_out, 3600 * 24 * 30)
+        return data_out, NOT_CACHED_TILE
 
+    def get_ready_tile(
+        self,
+        output_width,
+        output_height,
+        img_mime,
+        min_x,
+        max_x,
+        min_y,
+        max_y,
+    ):
+        """
+        Tile that does not need to be rendered: blank, cached or stored.
+        Return (None, None) if it must be rendered.
+        """
+        # Most requested tiles are outside of the map
         if not self.intersects_with_tile(min_x, max_x, min_y, max_y):
-            blank_cache_key = f"tile:blank:{output_width}x{output_height}:{img_mime}"
-            if use_cache:
-                try:
-                    cached = cache.get(blank_cache_key)
-                except Exception:
-                    pass
-                else:
-                    if cached:
-                        try:
-                            cache.set(cache_key, cached, 3600 * 24 * 30)
-                        except Exception:
-                            pass
-                        return cached, CACHED_BLANK_TILE
-
-            if img_mime in ("image/avif", "image/jxl"):
-                buffer = BytesIO()
-                pil_image = Image.new(
-                    mode="RGBA",
-                    size=(output_height, output_width),
-                    color=(255, 255, 255, 0),
-                )
-                pil_image.save(
-                    buffer,
-                    img_mime[6:].upper(),
-                    optimize=True,
-                    quality=10,
-                )
-                data_out = buffer.getvalue()
-            else:
-                n_channels = 3 if img_mime == "image/jpeg" else 4
-                transparent_img = np.zeros(
-                    (output_height, output_width, n_channels), dtype=np.uint8
-                )
-                extra_args = []
-                if img_mime == "image/webp":
-                    extra_args = [int(cv2.IMWRITE_WEBP_QUALITY), 10]
-                elif img_mime == "image/jpeg":
-                    transparent_img[:, :] = (255, 255, 255)
-                    extra_args = [int(cv2.IMWRITE_JPEG_QUALITY), 10]
-                _, buffer = cv2.imencode(
-                    f".{img_mime[6:]}",
-                    transparent_img,
-                    extra_args,
-                )
-                data_out = BytesIO(buffer).getvalue()
-            if use_cache:
-                try:
-                    cache.set(cache_key, data_out, 3600 * 24 * 30)
-                    cache.set(blank_cache_key, data_out, 3600 * 24 * 30)
-                except Exception:
-                    pass
-            return data_out, NOT_CACHED_TILE
+            return (
+                render_blank_tile(output_width, output_height, img_mime),
+                CACHED_BLANK_TILE,
+            )
 
-        img_alpha = None
+        cache_key = self.tile_cache_key(
+            output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+        )
+        use_cache = getattr(settings, "CACHE_TILES", False)
         if use_cache:
+            cached = cache_get(cache_key)
+            if cached is not MISSING:
+                return cached, CACHED_TILE
+
+        data_out = self.get_stored_tile(
+            output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+        )
+        if data_out is not None:
+            if use_cache:
+                cache_set(cache_key, data_out, 3600 * 24 * 30)
+            return data_out, STORED_TILE
+        return None, None
+
+    def schedule_tile_encoding(
+        self,
+        output_width,
+        output_height,
+        img_mime,
+        min_x,
+        max_x,
+        min_y,
+        max_y,
+    ):
+        """Render and cache a tile in a background task"""
+        from routechoices.core.bg_tasks import encode_map_tile
+
+        tile_args = [output_width, output_height, img_mime, min_x, max_x, min_y, max_y]
+        lock_key = f"{self.tile_cache_key(*tile_args)}:encoding"
+        try:
+            # Scheduled once, not on every request until it is done
+            if not cache.add(lock_key, 1, TILE_ENCODING_LOCK_TIMEOUT):
+                return
+        except Exception:
+            return
+        encode_map_tile(self.aid, self.hash, tile_args)
+
+    def create_metatile(self, tile_size, img_mime, tile_x, tile_y, tile_z):
+        """
+        Render the block of neighbouring tiles containing a tile of the grid
+        with a single warp, cache all of them and return the requested one.
+        Return None if it could not be done.
+        """
+        n_tiles = min(get_metatile_size(), 2**tile_z)
+        meta_x = tile_x - tile_x % n_tiles
+        meta_y = tile_y - tile_y % n_tiles
+        cache_key = self.tile_cache_key(
+            tile_size,
+            tile_size,
+            img_mime,
+            *tile_xy_to_mercator_bounds(tile_x, tile_y, tile_z),
+        )
+        lock_key = (
+            f"map:{self.aid}:{self.hash}:metatile:{tile_size}:"
+            f"{tile_z}/{meta_x}/{meta_y}:{img_mime}:processing"
+        )
+        try:
+            is_locked = cache.add(lock_key, 1, METATILE_LOCK_TIMEOUT)
+            if not is_locked:
+                # Another worker renders the metatile, wait for our tile
+                return wait_for_cache(cache_key, METATILE_WAIT_TIMEOUT)
+        except Exception:
+            return None
+        try:
+            min_x, _, _, max_y = tile_xy_to_mercator_bounds(meta_x, meta_y, tile_z)
+            _, max_x, min_y, _ = tile_xy_to_mercator_bounds(
+                meta_x + n_tiles - 1, meta_y + n_tiles - 1, tile_z
+            )
+            metatile_img = self.warp_tile(
+                self.get_image_level(
+                    self.tile_image_level(min_x, max_x, n_tiles * tile_size), True
+                ),
+                n_tiles * tile_size,
+                n_tiles * tile_size,
+                min_x,
+                max_x,
+                min_y,
+                max_y,
+            )
+            data_out = None
+            for i in range(n_tiles):
+                for j in range(n_tiles):
+                    bounds = tile_xy_to_mercator_bounds(meta_x + i, meta_y + j, tile_z)
+                    # Tiles outside the map are served as blank tiles
+                    if not self.intersects_with_tile(*bounds):
+                        continue
+                    tile_data = encode_tile(
+                        np.ascontiguousarray(
+                            metatile_img[
+                                j * tile_size : (j + 1) * tile_size,
+                                i * tile_size : (i + 1) * tile_size,
+                            ]
+                        ),
+                        img_mime,
+                    )
+                    cache_set(
+                        self.tile_cache_key(tile_size, tile_size, img_mime, *bounds),
+                        tile_data,
+                        3600 * 24 * 30,
+                    )
+                    if (meta_x + i, meta_y + j) == (tile_x, tile_y):
+                        data_out = tile_data
+            return data_out
+        finally:
             try:
-                img_alpha = cache.get(f"img_data_{self.image.name}_raw")
+                cache.delete(lock_key)
             except Exception:
                 pass
 
+    def get_image_level(self, level, use_cache):
+        """Downsampled level of the map image, from the raster store if possible"""
+        img_alpha = None
+        if use_cache:
+            img_alpha = load_raster(f"{self.image.name}:level:{level}")
         if img_alpha is None:
-            orig = self.data
-            orig_mime_type = magic.from_buffer(orig, mime=True)
-            if orig_mime_type == "image/gif":
-                img = Image.open(BytesIO(orig)).convert("RGBA")
-                img_alpha = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGRA)
-            else:
-                img_nparr = np.fromstring(orig, np.uint8)
-                img = cv2.imdecode(img_nparr, cv2.IMREAD_UNCHANGED)
-                img_alpha = cv2.cvtColor(np.array(img), cv2.COLOR_BGR2BGRA)
+            image_levels = build_image_levels(self.image_array)
+            img_alpha = image_levels[level]
+            if use_cache:
+                for i, image_level in enumerate(image_levels):
+                    save_raster(f"{self.image.name}:level:{i}", image_level)
+        return img_alpha
+
+    @property
+    def image_array(self):
+        """Map image as a BGRA array"""
+        orig = self.data
+        orig_mime_type = magic.from_buffer(orig, mime=True)
+        if orig_mime_type == "image/gif":
+            img = Image.open(BytesIO(orig)).convert("RGBA")
+            return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGRA)
+        img_nparr = np.fromstring(orig, np.uint8)
+        img = cv2.imdecode(img_nparr, cv2.IMREAD_UNCHANGED)
+        return cv2.cvtColor(np.array(img), cv2.COLOR_BGR2BGRA)
+
+    def tile_image_level(self, min_x, max_x, output_width):
+        """
+        Index of the downsampled level of the map image with a resolution
+        just above the one of the tile, bounds given in spherical mercator
+        """
+        tl = self.map_xy_to_spherical_mercator(0, 0)
+        tr = self.map_xy_to_spherical_mercator(self.width, 0)
+        bl = self.map_xy_to_spherical_mercator(0, self.height)
+        map_area = abs(
+            (tr[0] - tl[0]) * (bl[1] - tl[1]) - (tr[1] - tl[1]) * (bl[0] - tl[0])
+        )
+        if not map_area:
+            return 0
+        # Map image pixels per tile pixel
+        ratio = (
+            math.sqrt(self.width * self.height / map_area)
+            * (max_x - min_x)
+            / output_width
+        )
+        if ratio < 2:
+            return 0
+        return min(
+            int(math.log2(ratio)), image_levels_count(self.width, self.height) - 1
+        )
 
-            if use_cache and not cache.has_key(f"img_data_{self.image.name}_raw"):
-                cache.set(f"img_data_{self.image.name}_raw", img_alpha, 3600 * 24 * 30)
+    def render_tile(
+        self,
+        img_alpha,
+        output_width,
+        output_height,
+        img_mime,
+        min_x,
+        max_x,
+        min_y,
+        max_y,
+    ):
+        """
+        Warp the map image array, or one of its downsampled levels, to the
+        tile bounds, given in spherical mercator X Y, and encode it
+        """
+        return encode_tile(
+            self.warp_tile(
+                img_alpha, output_width, output_height, min_x, max_x, min_y, max_y
+            ),
+            img_mime,
+        )
 
+    def warp_tile(
+        self, img_alpha, output_width, output_height, min_x, max_x, min_y, max_y
+    ):
+        """Warp the map image array to the bounds, given in spherical mercator"""
         tl = self.map_xy_to_spherical_mercator(0, 0)
         tr = self.map_xy_to_spherical_mercator(self.width, 0)
         br = self.map_xy_to_spherical_mercator(self.width, self.height)
         bl = self.map_xy_to_spherical_mercator(0, self.height)
 
+        img_height, img_width = img_alpha.shape[:2]
         p1 = np.float32(
             [
                 [0, 0],
-                [self.width, 0],
-                [self.width, self.height],
-                [0, self.height],
+                [img_width, 0],
+                [img_width, img_height],
+                [0, img_height],
             ]
         )
 
@@ -862,49 +1393,158 @@ class Map(models.Model):
             tile_img = cv2.resize(
                 tile_img, (output_width, output_height), interpolation=cv2.INTER_AREA
             )
-        extra_args = []
-        if img_mime in ("image/avif", "image/jxl"):
-            color_converted = cv2.cvtColor(tile_img, cv2.COLOR_BGRA2RGBA)
-            pil_image = Image.fromarray(color_converted)
-            buffer = BytesIO()
-            pil_image.save(buffer, img_mime[6:].upper(), optimize=True, quality=40)
-            data_out = buffer.getvalue()
-        else:
-            if img_mime == "image/webp":
-                extra_args = [int(cv2.IMWRITE_WEBP_QUALITY), 40]
-            elif img_mime == "image/jpeg":
-                extra_args = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
-            _, buffer = cv2.imencode(f".{img_mime[6:]}", tile_img, extra_args)
-            data_out = BytesIO(buffer).getvalue()
+        return tile_img
 
-        if use_cache:
-            try:
-                cache.set(cache_key, data_out, 3600 * 24 * 30)
-            except Exception:
-                pass
-        return data_out, NOT_CACHED_TILE
+    def stored_tile_path(self, tile_size, tile_x, tile_y, tile_z, img_mime):
+        return (
+            f"tiles/{self.aid}/{self.hash}/{tile_size}/"
+            f"{tile_z}/{tile_x}/{tile_y}.{img_mime[6:]}"
+        )
 
-    def intersects_with_tile(self, min_x, max_x, min_y, max_y):
-        tile_bounds_poly = Polygon(
-            LinearRing(
-                (min_x, min_y),
-                (min_x, max_y),
-                (max_x, max_y),
-                (max_x, min_y),
-                (min_x, min_y),
+    def get_stored_tile(
+        self, output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+    ):
+        """
+        Return the tile from the pre-rendered tile pyramid if it was built,
+        None otherwise
+        """
+        if (
+            self.tile_pyramid_hash != self.hash
+            or output_width != output_height
+            or output_width not in get_tile_pyramid_sizes()
+            or img_mime not in get_tile_pyramid_mimes()
+        ):
+            return None
+        tile_xyz = mercator_bounds_to_tile_xy(min_x, max_x, min_y, max_y)
+        if tile_xyz is None:
+            return None
+        tile_x, tile_y, tile_z = tile_xyz
+        min_zoom, max_zoom = self.tile_pyramid_zoom_range(output_width)
+        if not min_zoom <= tile_z <= max_zoom:
+            return None
+        try:
+            return s3_get_object(
+                self.stored_tile_path(output_width, tile_x, tile_y, tile_z, img_mime),
+                settings.AWS_S3_BUCKET,
             )
+        except Exception:
+            return None
+
+    def tile_pyramid_zoom_range(self, tile_size):
+        """
+        Zoom levels of the pre-rendered tiles of a given size, from the one
+        where the map fits in a tile to the one matching the map resolution
+        """
+        extent = max(
+            self.max_xy["x"] - self.min_xy["x"], self.max_xy["y"] - self.min_xy["y"]
         )
-        map_bounds_poly = Polygon(
-            LinearRing(
-                self.map_xy_to_spherical_mercator(0, 0),
-                self.map_xy_to_spherical_mercator(0, self.height),
-                self.map_xy_to_spherical_mercator(self.width, self.height),
-                self.map_xy_to_spherical_mercator(self.width, 0),
-                self.map_xy_to_spherical_mercator(0, 0),
+        max_zoom = min(self.max_zoom - round(math.log2(tile_size / 256)), 22)
+        if extent <= 0:
+            return max_zoom, max_zoom
+        min_zoom = math.floor(math.log2(2 * MERCATOR_ORIGIN_SHIFT / extent))
+        return min(max(min_zoom, 0), max_zoom), max_zoom
+
+    def tile_pyramid_tiles(self, tile_size):
+        """Iterate on the x, y, zoom of the tiles of the pyramid intersecting the map"""
+        min_zoom, max_zoom = self.tile_pyramid_zoom_range(tile_size)
+        for tile_z in range(min_zoom, max_zoom + 1):
+            min_tx, max_tx, min_ty, max_ty = mercator_bounds_tiles_range(
+                self.min_xy["x"],
+                self.max_xy["x"],
+                self.min_xy["y"],
+                self.max_xy["y"],
+                tile_z,
             )
+            for tile_x in range(min_tx, max_tx + 1):
+                for tile_y in range(min_ty, max_ty + 1):
+                    if self.intersects_with_tile(
+                        *tile_xy_to_mercator_bounds(tile_x, tile_y, tile_z)
+                    ):
+                        yield tile_x, tile_y, tile_z
+
+    def build_tile_pyramid(self):
+        """
+        Render the tiles of the map for every size and format of the pyramid
+        and store them, the pyramid is used once they are all stored
+        """
+        map_hash = self.hash
+        image_levels = build_image_levels(self.image_array)
+        n_tiles = 0
+        for tile_size in get_tile_pyramid_sizes():
+            for tile_x, tile_y, tile_z in self.tile_pyramid_tiles(tile_size):
+                bounds = tile_xy_to_mercator_bounds(tile_x, tile_y, tile_z)
+                img_alpha = image_levels[
+                    self.tile_image_level(bounds[0], bounds[1], tile_size)
+                ]
+                for img_mime in get_tile_pyramid_mimes():
+                    s3_put_object(
+                        self.stored_tile_path(
+                            tile_size, tile_x, tile_y, tile_z, img_mime
+                        ),
+                        settings.AWS_S3_BUCKET,
+                        self.render_tile(
+                            img_alpha, tile_size, tile_size, img_mime, *bounds
+                        ),
+                        img_mime,
+                    )
+                    n_tiles += 1
+        # Only if the map was not modified meanwhile
+        Map.objects.filter(
+            pk=self.pk,
+            image=self.image.name,
+            corners_coordinates=self.corners_coordinates,
+        ).update(tile_pyramid_hash=map_hash)
+        self.tile_pyramid_hash = map_hash
+        return n_tiles
+
+    def schedule_tile_pyramid(self):
+        from routechoices.core.bg_tasks import build_map_tile_pyramid
+
+        build_map_tile_pyramid(self.aid, self.hash, remove_existing_tasks=True)
+
+    def compute_mercator_quad(self):
+        """Corners of the map in spherical mercator, clockwise from top left"""
+        bound = self.bound
+        quad = []
+        for corner in ("topLeft", "topRight", "bottomRight", "bottomLeft"):
+            xy = GLOBAL_MERCATOR.latlon_to_meters(bound[corner])
+            quad.append((xy["x"], xy["y"]))
+        return quad
+
+    @property
+    def mercator_quad(self):
+        if self.mercator_quad_coordinates is not None:
+            return [tuple(xy) for xy in self.mercator_quad_coordinates]
+        return self.compute_mercator_quad()
+
+    def update_mercator_bbox(self):
+        try:
+            quad = self.compute_mercator_quad()
+        except ValueError:
+            self.mercator_quad_coordinates = None
+            self.mercator_min_x = self.mercator_max_x = None
+            self.mercator_min_y = self.mercator_max_y = None
+            return
+        self.mercator_quad_coordinates = [list(xy) for xy in quad]
+        self.mercator_min_x = min(x for x, _ in quad)
+        self.mercator_max_x = max(x for x, _ in quad)
+        self.mercator_min_y = min(y for _, y in quad)
+        self.mercator_max_y = max(y for _, y in quad)
+
+    def bbox_intersects_with_tile(self, min_x, max_x, min_y, max_y):
+        return self.mercator_min_x is None or not (
+            max_x < self.mercator_min_x
+            or min_x > self.mercator_max_x
+            or max_y < self.mercator_min_y
+            or min_y > self.mercator_max_y
+        )
+
+    def intersects_with_tile(self, min_x, max_x, min_y, max_y):
+        if not self.bbox_intersects_with_tile(min_x, max_x, min_y, max_y):
+            return False
+        return polygon_intersects_rectangle(
+            self.mercator_quad, min_x, max_x, min_y, max_y
         )
-        tile_bounds_poly_prep = tile_bounds_poly.prepared
-        return tile_bounds_poly_prep.intersects(map_bounds_poly)
 
     def strip_exif(self):
         if self.image.closed:
@@ -1463,7 +2103,20 @@ class Event(models.Model):
 
     def save(self, *args, **kwargs):
         self.invalidate_cache()
+        disk_tiles_changed = (
+            self.pk
+            and get_tile_disk_cache_dir()
+            and Event.objects.filter(pk=self.pk)
+            .exclude(
+                privacy=self.privacy, map_id=self.map_id, start_date=self.start_date
+            )
+            .exists()
+        )
         super().save(*args, **kwargs)
+        if disk_tiles_changed:
+            # After the commit, so that no tile request loads the event as it
+            # was under the new version
+            transaction.on_commit(lambda: invalidate_disk_tiles(self.aid))
 
     def check_user_permission(self, user):
         if self.privacy == PRIVACY_PRIVATE and (
@@ -1579,6 +2232,46 @@ class Event(models.Model):
             title = assignation.title
         return event, raster_map, title
 
+    @classmethod
+    def get_public_maps(cls, user, event_id, map_indexes=None):
+        """
+        Maps of an event in their order, only the ones at map_indexes (1 based)
+        if given, return the event and the list of maps
+        """
+        event_qs = (
+            cls.objects.all()
+            .select_related("club", "map")
+            .prefetch_related(
+                models.Prefetch(
+                    "map_assignations",
+                    queryset=MapAssignation.objects.select_related("map"),
+                )
+            )
+            .filter(
+                start_date__lt=now(),
+            )
+        )
+        event = get_object_or_404(event_qs, aid=event_id)
+        event.check_user_permission(user)
+
+        event_maps = [event.map] + [
+            assignation.map for assignation in event.map_assignations.all()
+        ]
+        if map_indexes is None:
+            raster_maps = [raster_map for raster_map in event_maps if raster_map]
+        else:
+            raster_maps = []
+            for map_index in sorted(set(map_indexes)):
+                if not 0 < map_index <= len(event_maps):
+                    raise Http404
+                raster_map = event_maps[map_index - 1]
+                if not raster_map:
+                    raise Http404
+                raster_maps.append(raster_map)
+        if not raster_maps:
+            raise Http404
+        return event, raster_maps
+
     @classmethod
     def extract_event_lists(cls, request, club=None):
         page = request.GET.get("page")
@@ -1855,17 +2548,66 @@ class Event(models.Model):
             raise ValidationError(errors)
         super().validate_unique(exclude)
 
+    @staticmethod
+    def get_cache_version(event_id):
+        """
+        Version of the cached data of an event, part of their cache keys,
+        changed by invalidate_cache
+        """
+        cache_key = f"event:{event_id}:cache_version"
+        version = cache.get(cache_key)
+        if version is None:
+            # Never reuse the version of an evicted key
+            cache.add(cache_key, time.time_ns(), None)
+            version = cache.get(cache_key, time.time_ns())
+        return version
+
     def invalidate_cache(self):
-        t0 = time.time()
-        cache_interval = EVENT_CACHE_INTERVAL
-        for cache_suffix in ("live", "archived"):
-            cache_ts = int(
-                t0 // (cache_interval if cache_suffix == "live" else 7 * 24 * 3600)
-            )
-            cache_key = f"event:{self.aid}:data:{cache_ts}:{cache_suffix}"
-            cache.delete(cache_key)
-            cache_key = f"event:{self.aid}:data:{cache_ts - 1}:{cache_suffix}"
-            cache.delete(cache_key)
+        cache_key = f"event:{self.aid}:cache_version"
+        try:
+            cache.incr(cache_key)
+        except ValueError:
+            if not cache.add(cache_key, time.time_ns(), None):
+                cache.incr(cache_key)
+        if self.id:
+            EventSnapshot.objects.filter(event_id=self.id).delete()
+        self.schedule_snapshot()
+
+    def schedule_snapshot(self):
+        from routechoices.core.bg_tasks import build_event_snapshot
+
+        # Rounded to the minute so close invalidations schedule a single task
+        requested_ts = max(self.end_date.timestamp(), time.time())
+        requested_ts = math.ceil(requested_ts / 60) * 60
+        # Not a task row written on every location of a busy event
+        lock_key = f"event:{self.aid}:snapshot_scheduled:{requested_ts}"
+        try:
+            if not cache.add(
+                lock_key, 1, max(requested_ts - time.time(), 0) + SNAPSHOT_LOCK_DELAY
+            ):
+                return
+        except Exception:
+            pass
+        build_event_snapshot(
+            self.aid,
+            requested_ts,
+            schedule=epoch_to_datetime(requested_ts),
+            remove_existing_tasks=True,
+        )
+
+    def get_snapshot(self):
+        """
+        Return the snapshot of the competitors tracks of an ended event,
+        None if the event has not ended or if the snapshot is not built yet,
+        it is then built by a background task.
+        """
+        if not self.ended:
+            return None
+        try:
+            return self.snapshot
+        except EventSnapshot.DoesNotExist:
+            self.schedule_snapshot()
+            return None
 
     @property
     def has_notice(self):
@@ -1969,6 +2711,95 @@ class MapAssignation(models.Model):
         ordering = ["id"]
 
 
+@receiver([post_delete], sender=Map)
+def remove_map_disk_tiles_receiver(sender, instance, **kwargs):
+    remove_map_disk_tiles(instance.aid)
+
+
+@receiver([post_delete], sender=Event)
+def invalidate_event_disk_tiles_receiver(sender, instance, **kwargs):
+    event_id = instance.aid
+    transaction.on_commit(lambda: invalidate_disk_tiles(event_id))
+
+
+@receiver([post_save, post_delete], sender=MapAssignation)
+def invalidate_map_assignation_disk_tiles_receiver(sender, instance, **kwargs):
+    # Layers of the event may now show other maps
+    event_id = (
+        Event.objects.filter(id=instance.event_id).values_list("aid", flat=True).first()
+    )
+    if event_id:
+        transaction.on_commit(lambda: invalidate_disk_tiles(event_id))
+
+
+def locations_to_gpx(locations):
+    current_site = get_current_site()
+    gpx = gpxpy.gpx.GPX()
+    gpx.creator = current_site.name
+    gpx_track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(gpx_track)
+
+    gpx_segment = gpxpy.gpx.GPXTrackSegment()
+    for location in locations:
+        gpx_segment.points.append(
+            gpxpy.gpx.GPXTrackPoint(
+                location[LOCATION_LATITUDE_INDEX],
+                location[LOCATION_LONGITUDE_INDEX],
+                time=epoch_to_datetime(location[LOCATION_TIMESTAMP_INDEX]),
+            )
+        )
+    gpx_track.segments.append(gpx_segment)
+    return gpx.to_xml()
+
+
+class EventSnapshot(models.Model):
+    """
+    Tracks of the competitors of an ended event, so they can be served
+    without decoding the devices locations.
+    Deleted when the event cache is invalidated.
+    """
+
+    event = models.OneToOneField(
+        Event, related_name="snapshot", on_delete=models.CASCADE, primary_key=True
+    )
+    # Time at which the tracks were read
+    creation_date = models.DateTimeField()
+    # Competitor aid -> encoded locations
+    tracks = models.JSONField(default=dict)
+    location_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.event}: {self.creation_date}"
+
+    @classmethod
+    def build(cls, event):
+        creation_date = now()
+        tracks = {}
+        location_count = 0
+        for competitor, from_date, end_date in event.iterate_competitors():
+            if competitor.device_id:
+                encoded_data, nb_pts = competitor.device.get_locations_between_dates(
+                    from_date, end_date, encode=True
+                )
+                tracks[competitor.aid] = encoded_data
+                location_count += nb_pts
+        snapshot, _ = cls.objects.update_or_create(
+            event=event,
+            defaults={
+                "creation_date": creation_date,
+                "tracks": tracks,
+                "location_count": location_count,
+            },
+        )
+        return snapshot
+
+    def get_locations(self, competitor_id):
+        encoded_data = self.tracks.get(competitor_id)
+        if not encoded_data:
+            return []
+        return gps_data_codec.decode(encoded_data)
+
+
 class Device(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     modification_date = models.DateTimeField(auto_now=True)
@@ -2004,6 +2835,14 @@ class Device(models.Model):
         null=True, blank=True, editable=False, max_digits=10, decimal_places=5
     )
     _location_count = models.PositiveIntegerField(editable=False, default=0)
+    # Number of locations in the sealed chunks, so counting the locations
+    # needs no query
+    _chunked_location_count = models.PositiveIntegerField(editable=False, default=0)
+
+    # Pending changes to the sealed location chunks, written on save
+    _location_chunks_cache = None
+    _dirty_location_chunks = None
+    _reset_location_chunks = False
 
     class Meta:
         ordering = ["aid"]
@@ -2065,29 +2904,142 @@ class Device(models.Model):
         ]
 
     @property
-    def locations_series(self):
+    def tail_locations_series(self):
+        """Locations not yet sealed into a chunk, the newest ones"""
         if not self.locations_encoded:
             return []
         return gps_data_codec.decode(self.locations_encoded)
 
+    @property
+    def tail_location_count(self):
+        return encoded_location_count(self.locations_encoded)
+
+    def get_location_chunks(self, from_date=None, end_date=None, /, *, data=True):
+        """
+        Return the sealed chunks of locations of this device, ordered by time,
+        including the modifications not yet saved.
+        If dates are given, only the chunks overlapping that period are returned.
+        """
+        if self._reset_location_chunks or not self.pk:
+            return []
+        if not data and from_date is None and end_date is None:
+            if self._location_chunks_cache is None:
+                self._location_chunks_cache = list(
+                    self.location_chunks.defer("locations_encoded", "locations_index")
+                )
+            chunks = self._location_chunks_cache
+        else:
+            qs = self.location_chunks.all()
+            if from_date is not None:
+                qs = qs.filter(last_location_datetime__gte=from_date)
+            if end_date is not None:
+                qs = qs.filter(first_location_datetime__lte=end_date)
+            if not data:
+                qs = qs.defer("locations_encoded", "locations_index")
+            chunks = list(qs)
+        dirty_chunks = self._dirty_location_chunks or {}
+        return [dirty_chunks.get(chunk.pk, chunk) for chunk in chunks]
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._location_chunks_cache = None
+        self._dirty_location_chunks = None
+        self._reset_location_chunks = False
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "locations_encoded" not in update_fields:
+            super().save(*args, **kwargs)
+            return
+        if update_fields is not None:
+            kwargs["update_fields"] = [*update_fields, "_chunked_location_count"]
+        new_chunks = self._seal_location_chunks()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self._reset_location_chunks:
+                self.location_chunks.all().delete()
+            for chunk in (self._dirty_location_chunks or {}).values():
+                chunk.save()
+            for chunk in new_chunks:
+                chunk.device = self
+            DeviceLocationChunk.objects.bulk_create(new_chunks)
+        self._location_chunks_cache = None
+        self._dirty_location_chunks = None
+        self._reset_location_chunks = False
+
+    def _seal_location_chunks(self):
+        """
+        Move the oldest locations of the tail into chunks once the tail
+        holds more than LOCATION_CHUNK_SIZE locations.
+        At least one location is always kept in the tail.
+        """
+        tail_count = self.tail_location_count
+        if tail_count <= LOCATION_CHUNK_SIZE:
+            return []
+        locs = self.tail_locations_series
+        nb_chunks = (tail_count - 1) // LOCATION_CHUNK_SIZE
+        new_chunks = []
+        for i in range(nb_chunks):
+            chunk = DeviceLocationChunk()
+            chunk.locations_series = locs[
+                i * LOCATION_CHUNK_SIZE : (i + 1) * LOCATION_CHUNK_SIZE
+            ]
+            new_chunks.append(chunk)
+            self._chunked_location_count += chunk.location_count
+        self.locations_encoded = gps_data_codec.encode(
+            locs[nb_chunks * LOCATION_CHUNK_SIZE :]
+        )
+        return new_chunks
+
+    @property
+    def locations_series(self):
+        locs = []
+        for chunk in self.get_location_chunks():
+            locs += chunk.locations_series
+        locs += self.tail_locations_series
+        return locs
+
     @locations_series.setter
     def locations_series(self, locations_list):
         sorted_locations = list(
             sorted(locations_list, key=itemgetter(LOCATION_TIMESTAMP_INDEX))
         )
-        self.locations_encoded = gps_data_codec.encode(sorted_locations)
+        self._replace_locations_encoded(gps_data_codec.encode(sorted_locations))
+
+    @property
+    def locations_arrays(self):
+        """Locations as arrays of timestamps, latitudes and longitudes"""
+        arrays = [
+            decode_arrays(chunk.locations_encoded)
+            for chunk in self.get_location_chunks()
+        ]
+        arrays.append(decode_arrays(self.locations_encoded))
+        return tuple(np.concatenate(column) for column in zip(*arrays))
+
+    @locations_arrays.setter
+    def locations_arrays(self, arrays):
+        timestamps, latitudes, longitudes = (np.asarray(array) for array in arrays)
+        order = np.argsort(timestamps, kind="stable")
+        self._replace_locations_encoded(
+            encode_arrays(timestamps[order], latitudes[order], longitudes[order])
+        )
+
+    def _replace_locations_encoded(self, encoded):
+        # Existing chunks are deleted on save, tail is sealed again from scratch
+        self._reset_location_chunks = True
+        self._location_chunks_cache = None
+        self._dirty_location_chunks = None
+        self._chunked_location_count = 0
+        self.locations_encoded = encoded
         self.update_cached_data()
 
     @property
     def locations(self):
-        if not self.locations_encoded:
-            return {"timestamps": [], "latitudes": [], "longitudes": []}
-        locs = self.locations_series
-        data = list(zip(*locs))
+        timestamps, latitudes, longitudes = self.locations_arrays
         return {
-            "timestamps": list(data[LOCATION_TIMESTAMP_INDEX]),
-            "latitudes": list(data[LOCATION_LATITUDE_INDEX]),
-            "longitudes": list(data[LOCATION_LONGITUDE_INDEX]),
+            "timestamps": timestamps.tolist(),
+            "latitudes": latitudes.tolist(),
+            "longitudes": longitudes.tolist(),
         }
 
     @locations.setter
@@ -2103,8 +3055,12 @@ class Device(models.Model):
 
     def update_cached_data(self):
         self._location_count = self.location_count
-        if self._location_count > 0:
-            last_loc = self.locations_series[-1]
+        last_loc = None
+        if self.locations_encoded:
+            last_loc = self.tail_locations_series[-1]
+        elif self._location_count > 0:
+            last_loc = self.get_location_chunks()[-1].locations_series[-1]
+        if last_loc:
             self._last_location_datetime = epoch_to_datetime(
                 last_loc[LOCATION_TIMESTAMP_INDEX]
             )
@@ -2118,7 +3074,15 @@ class Device(models.Model):
     def get_locations_between_dates(self, from_date, end_date, /, *, encode=False):
         from_ts = from_date.timestamp()
         end_ts = end_date.timestamp()
-        locs = self.locations_series
+        locs = []
+        for chunk in self.get_location_chunks(from_date, end_date):
+            locs += chunk.get_locations_between_dates(from_date, end_date)
+        first_tail_location = decode_first_location(self.locations_encoded)
+        if (
+            first_tail_location
+            and first_tail_location[LOCATION_TIMESTAMP_INDEX] <= end_ts
+        ):
+            locs += self.tail_locations_series
         from_idx = bisect.bisect_left(locs, from_ts, key=itemgetter(0))
         end_idx = bisect.bisect_right(locs, end_ts, key=itemgetter(0))
         locs = locs[from_idx:end_idx]
@@ -2128,42 +3092,20 @@ class Device(models.Model):
         return encoded_locs, len(locs)
 
     def gpx(self, from_date, end_date):
-        current_site = get_current_site()
-        gpx = gpxpy.gpx.GPX()
-        gpx.creator = current_site.name
-        gpx_track = gpxpy.gpx.GPXTrack()
-        gpx.tracks.append(gpx_track)
-
-        gpx_segment = gpxpy.gpx.GPXTrackSegment()
         locs, n = self.get_locations_between_dates(from_date, end_date)
-        for location in locs:
-            gpx_segment.points.append(
-                gpxpy.gpx.GPXTrackPoint(
-                    location[LOCATION_LATITUDE_INDEX],
-                    location[LOCATION_LONGITUDE_INDEX],
-                    time=epoch_to_datetime(location[LOCATION_TIMESTAMP_INDEX]),
-                )
-            )
-        gpx_track.segments.append(gpx_segment)
-        return gpx.to_xml()
+        return locations_to_gpx(locs)
 
     def add_locations(self, loc_array, /, *, save=True):
         if len(loc_array) == 0:
             if save:
                 self.save()
             return
-        new_pts = []
-        locations = self.locations_series
-        all_ts = set()
-        max_ts = None
-        if locations:
-            all_ts = set(list(zip(*locations))[LOCATION_TIMESTAMP_INDEX])
-            max_ts = max(all_ts)
+        valid_pts = {}
         for loc in loc_array:
             ts = int(loc[LOCATION_TIMESTAMP_INDEX])
             lat = loc[LOCATION_LATITUDE_INDEX]
             lon = loc[LOCATION_LONGITUDE_INDEX]
-            if max_ts and ts <= max_ts and ts in all_ts:
+            if ts in valid_pts:
                 continue
             try:
                 validate_latitude(lat)
@@ -2174,25 +3116,24 @@ class Device(models.Model):
                 lat = float(lat)
             if isinstance(lon, Decimal):
                 lon = float(lon)
-            all_ts.add(ts)
-            if not max_ts:
-                max_ts = ts
-            else:
-                max_ts = max(ts, max_ts)
-            new_pts.append((ts, lat, lon))
+            valid_pts[ts] = (ts, lat, lon)
+
+        if self._append_locations(valid_pts.values()):
+            new_pts = list(valid_pts.values())
+        else:
+            new_pts = self._merge_locations(valid_pts.values())
 
         if len(new_pts) == 0:
             if save:
                 self.save()
             return
 
-        locations += new_pts
-        self.locations_series = locations
-
         if save:
             self.save()
 
         new_pts = list(sorted(new_pts, key=itemgetter(LOCATION_TIMESTAMP_INDEX)))
+        if is_live_push_enabled():
+            publish_locations(self, new_pts)
         archived_events_affected = self.get_events_between_dates(
             epoch_to_datetime(new_pts[0][LOCATION_TIMESTAMP_INDEX]),
             epoch_to_datetime(new_pts[-1][LOCATION_TIMESTAMP_INDEX]),
@@ -2201,6 +3142,83 @@ class Device(models.Model):
         for archived_event_affected in archived_events_affected:
             archived_event_affected.invalidate_cache()
 
+    def _append_locations(self, pts):
+        """
+        Fast path for locations all newer than the last known one,
+        their encoding is appended to the tail without decoding it.
+        Return False if the locations could not be appended that way.
+        """
+        if not pts:
+            return False
+        last_location = self.last_location
+        # The last location must be the last one of the tail
+        if bool(last_location) != bool(self.locations_encoded):
+            return False
+        sorted_pts = list(sorted(pts, key=itemgetter(LOCATION_TIMESTAMP_INDEX)))
+        if (
+            last_location is not None
+            and sorted_pts[0][LOCATION_TIMESTAMP_INDEX]
+            <= last_location[LOCATION_TIMESTAMP_INDEX]
+        ):
+            return False
+        self.locations_encoded += encode_appended_locations(sorted_pts, last_location)
+        last_pt = sorted_pts[-1]
+        self._location_count = (self._location_count or 0) + len(sorted_pts)
+        self._last_location_datetime = epoch_to_datetime(
+            last_pt[LOCATION_TIMESTAMP_INDEX]
+        )
+        self._last_location_latitude = round_coordinate(
+            last_pt[LOCATION_LATITUDE_INDEX]
+        )
+        self._last_location_longitude = round_coordinate(
+            last_pt[LOCATION_LONGITUDE_INDEX]
+        )
+        return True
+
+    def _merge_locations(self, pts):
+        """Merge locations with the stored ones, return the ones that were added"""
+        # Locations newer than the last sealed chunk go into the tail,
+        # older ones into the chunk covering their timestamp
+        chunks = self.get_location_chunks(data=False)
+        chunks_start_ts = [c.first_location_datetime.timestamp() for c in chunks]
+        last_sealed_ts = (
+            chunks[-1].last_location_datetime.timestamp() if chunks else None
+        )
+        pts_by_chunk = {}
+        tail_pts = []
+        for pt in pts:
+            ts = pt[LOCATION_TIMESTAMP_INDEX]
+            if last_sealed_ts is not None and ts <= last_sealed_ts:
+                idx = max(0, bisect.bisect_right(chunks_start_ts, ts) - 1)
+                pts_by_chunk.setdefault(idx, []).append(pt)
+            else:
+                tail_pts.append(pt)
+
+        new_pts = []
+        for idx, chunk_pts in pts_by_chunk.items():
+            chunk = chunks[idx]
+            added_pts = chunk.add_locations(chunk_pts)
+            if added_pts:
+                self._chunked_location_count += len(added_pts)
+                if self._dirty_location_chunks is None:
+                    self._dirty_location_chunks = {}
+                self._dirty_location_chunks[chunk.pk] = chunk
+                new_pts += added_pts
+        if tail_pts:
+            locations = self.tail_locations_series
+            all_ts = {loc[LOCATION_TIMESTAMP_INDEX] for loc in locations}
+            added_pts = [
+                pt for pt in tail_pts if pt[LOCATION_TIMESTAMP_INDEX] not in all_ts
+            ]
+            if added_pts:
+                locations += added_pts
+                locations.sort(key=itemgetter(LOCATION_TIMESTAMP_INDEX))
+                self.locations_encoded = gps_data_codec.encode(locations)
+                new_pts += added_pts
+        if new_pts:
+            self.update_cached_data()
+        return new_pts
+
     def add_location(self, timestamp, lat, lon, /, *, save=True):
         self.add_locations(
             [
@@ -2209,46 +3227,49 @@ class Device(models.Model):
             save=save,
         )
 
+    def merge_queued_locations(self):
+        """
+        Merge the locations queued by the API into the device, with a single
+        save, return the number of locations merged.
+        The device row should be locked by the caller.
+        """
+        queued = list(self.queued_locations.all())
+        if not queued:
+            return 0
+        locations = []
+        for queued_locations in queued:
+            locations += queued_locations.locations_series
+            if queued_locations.battery_level is not None:
+                self.battery_level = queued_locations.battery_level
+            if queued_locations.user_agent:
+                self.user_agent = queued_locations.user_agent
+        self.add_locations(locations, save=False)
+        self.save()
+        QueuedLocations.objects.filter(id__in=[q.id for q in queued]).delete()
+        return len(locations)
+
     @property
     def location_count(self):
-        # This use a property of the GPS encoding format
-        n = 0
-        encoded = self.locations_encoded
-        for x in encoded:
-            if ord(x) - 63 < 0x20:
-                n += 1
-        return n // 3
+        # No query, it is also read from async code
+        return self._chunked_location_count + self.tail_location_count
 
     def remove_duplicates(self, save=True):
-        loc_count = self.location_count
-        if loc_count == 0:
+        if self.location_count == 0:
             return
 
-        orig_locations = self.locations_series
-        unique_ts = set(list(zip(*orig_locations))[LOCATION_TIMESTAMP_INDEX])
-        if len(unique_ts) == loc_count:
+        timestamps, latitudes, longitudes = self.locations_arrays
+        is_unique = np.ones(len(timestamps), dtype=bool)
+        is_unique[1:] = timestamps[1:] != timestamps[:-1]
+        if is_unique.all():
             return
 
-        updated_locations_list = []
-        prev_t = None
-        for loc in orig_locations:
-            t = loc[LOCATION_TIMESTAMP_INDEX]
-            if t == prev_t:
-                continue
-            updated_locations_list.append(
-                (
-                    t,
-                    round(loc[LOCATION_LATITUDE_INDEX], 5),
-                    round(loc[LOCATION_LONGITUDE_INDEX], 5),
-                )
-            )
-            prev_t = t
-
-        updated_encoded = gps_data_codec.encode(updated_locations_list)
-        if self.locations_encoded != updated_encoded:
-            self.locations_series = updated_locations_list
-            if save:
-                self.save()
+        self.locations_arrays = (
+            timestamps[is_unique],
+            latitudes[is_unique],
+            longitudes[is_unique],
+        )
+        if save:
+            self.save()
 
     @property
     def last_location(self):
@@ -2375,6 +3396,120 @@ class DeviceArchiveReference(models.Model):
     )
 
 
+class DeviceLocationChunk(models.Model):
+    """
+    Block of consecutive locations of a device.
+    The newest locations of a device are kept in Device.locations_encoded
+    until there are enough of them to be sealed into a new chunk.
+    Late locations older than the tail are merged into the chunk covering
+    their timestamp.
+    """
+
+    device = models.ForeignKey(
+        Device, related_name="location_chunks", on_delete=models.CASCADE
+    )
+    first_location_datetime = models.DateTimeField()
+    last_location_datetime = models.DateTimeField()
+    location_count = models.PositiveIntegerField(default=0)
+    locations_encoded = models.TextField(blank=True, default="")
+    # Every LOCATION_INDEX_STEP-th location: [ts, offset, lat, lon]
+    locations_index = models.JSONField(blank=True, default=list)
+
+    class Meta:
+        ordering = ["first_location_datetime"]
+        verbose_name = "device location chunk"
+        verbose_name_plural = "device location chunks"
+        indexes = [
+            models.Index(
+                "device_id",
+                "first_location_datetime",
+                "last_location_datetime",
+                name="core_device_loc_chunk_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id}: {self.first_location_datetime}"
+
+    @property
+    def locations_series(self):
+        if not self.locations_encoded:
+            return []
+        return gps_data_codec.decode(self.locations_encoded)
+
+    @locations_series.setter
+    def locations_series(self, locations_list):
+        self.locations_encoded = gps_data_codec.encode(locations_list)
+        self.locations_index = build_sparse_index(
+            self.locations_encoded, locations_list, LOCATION_INDEX_STEP
+        )
+        self.location_count = len(locations_list)
+        self.first_location_datetime = epoch_to_datetime(
+            locations_list[0][LOCATION_TIMESTAMP_INDEX]
+        )
+        self.last_location_datetime = epoch_to_datetime(
+            locations_list[-1][LOCATION_TIMESTAMP_INDEX]
+        )
+
+    def get_locations_between_dates(self, from_date, end_date):
+        from_ts = from_date.timestamp()
+        end_ts = end_date.timestamp()
+        if (
+            from_date <= self.first_location_datetime
+            and end_date >= self.last_location_datetime
+        ):
+            return self.locations_series
+        return decode_locations_between(
+            self.locations_encoded, self.locations_index, from_ts, end_ts
+        )
+
+    def add_locations(self, new_pts):
+        """Merge locations into the chunk, return the ones that were not known"""
+        locations = self.locations_series
+        all_ts = {loc[LOCATION_TIMESTAMP_INDEX] for loc in locations}
+        added_pts = [pt for pt in new_pts if pt[LOCATION_TIMESTAMP_INDEX] not in all_ts]
+        if added_pts:
+            locations += added_pts
+            locations.sort(key=itemgetter(LOCATION_TIMESTAMP_INDEX))
+            self.locations_series = locations
+        return added_pts
+
+
+class QueuedLocations(models.Model):
+    """
+    Locations posted to the API waiting to be merged into their device
+    by the flush_queued_locations command.
+    """
+
+    creation_date = models.DateTimeField(auto_now_add=True)
+    device = models.ForeignKey(
+        Device, related_name="queued_locations", on_delete=models.CASCADE
+    )
+    locations_encoded = models.TextField(blank=True, default="")
+    battery_level = models.PositiveIntegerField(null=True, default=None, blank=True)
+    user_agent = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "queued locations"
+        verbose_name_plural = "queued locations"
+
+    def __str__(self):
+        return f"{self.device_id}: {self.creation_date}"
+
+    @property
+    def locations_series(self):
+        if not self.locations_encoded:
+            return []
+        return gps_data_codec.decode(self.locations_encoded)
+
+    @locations_series.setter
+    def locations_series(self, locations_list):
+        self.locations_encoded = gps_data_codec.encode(
+            list(sorted(locations_list, key=itemgetter(LOCATION_TIMESTAMP_INDEX)))
+        )
+
+
 class ImeiDevice(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     imei = models.CharField(
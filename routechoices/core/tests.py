@@ -0,0 +1,379 @@
+import tempfile
+from unittest.mock import PropertyMock, patch
+
+import arrow
+import cv2
+import gps_data_codec
+import numpy as np
+from background_task.models import Task
+from django.test import TestCase, override_settings
+
+from routechoices.core.models import (
+    CACHED_BLANK_TILE,
+    CACHED_TILE,
+    STORED_TILE,
+    Club,
+    Device,
+    DeviceLocationChunk,
+    Map,
+    build_image_levels,
+)
+from routechoices.lib.cache import clear_cache
+from routechoices.lib.globalmaptiles import GlobalMercator
+from routechoices.lib.slippy_tiles import (
+    latlon_to_tile_xy,
+    tile_xy_to_mercator_bounds,
+    tile_xy_to_north_west_latlon,
+)
+
+
+@patch("routechoices.core.models.LOCATION_CHUNK_SIZE", 10)
+class DeviceLocationStorageTestCase(TestCase):
+    def test_locations_are_sealed_in_chunks(self):
+        device = Device.objects.create()
+        t0 = arrow.get().shift(hours=-1).int_timestamp
+        for i in range(25):
+            device.add_location(t0 + i, 60 + i / 1000, 20 + i / 1000)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(DeviceLocationChunk.objects.filter(device=device).count(), 2)
+        self.assertEqual(device.tail_location_count, 5)
+        self.assertEqual(device.location_count, 25)
+        self.assertEqual(device._location_count, 25)
+        self.assertEqual(
+            [loc[0] for loc in device.locations_series],
+            list(range(t0, t0 + 25)),
+        )
+
+    def test_late_locations_go_in_their_chunk(self):
+        device = Device.objects.create()
+        t0 = arrow.get().shift(hours=-1).int_timestamp
+        device.add_locations([(t0 + i * 2, 60, 20) for i in range(25)])
+        device = Device.objects.get(pk=device.pk)
+        # One location in the first chunk, one duplicate and one in the tail
+        device.add_locations([(t0 + 3, 61, 21), (t0 + 2, 62, 22), (t0 + 47, 63, 23)])
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.location_count, 27)
+        self.assertEqual(device._location_count, 27)
+        first_chunk = device.location_chunks.first()
+        self.assertEqual(first_chunk.location_count, 11)
+        self.assertIn((t0 + 3, 61, 21), first_chunk.locations_series)
+        self.assertEqual(device.last_location_timestamp, t0 + 48)
+
+        locs, nb_pts = device.get_locations_between_dates(
+            arrow.get(t0 + 2).datetime, arrow.get(t0 + 6).datetime
+        )
+        self.assertEqual(nb_pts, 4)
+        self.assertEqual([loc[0] for loc in locs], [t0 + 2, t0 + 3, t0 + 4, t0 + 6])
+
+    def test_rewrite_locations(self):
+        device = Device.objects.create()
+        t0 = arrow.get().shift(hours=-1).int_timestamp
+        device.add_locations([(t0 + i, 60, 20) for i in range(25)])
+        device.locations_series = [(t0 + i, 60, 20) for i in range(12)]
+        device.save()
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(DeviceLocationChunk.objects.filter(device=device).count(), 1)
+        self.assertEqual(device.location_count, 12)
+        self.assertEqual(len(device.locations_series), 12)
+
+    def test_location_count_tail_edited(self):
+        device = Device.objects.create()
+        t0 = arrow.get().shift(hours=-1).int_timestamp
+        device.add_locations([(t0 + i, 60, 20) for i in range(15)])
+        device = Device.objects.get(pk=device.pk)
+        # Counted without reading the chunks, eg: from the TCP servers
+        with self.assertNumQueries(0):
+            self.assertEqual(device.location_count, 15)
+        # Tail edited directly, eg: in the admin, longer than the stale count
+        device.locations_encoded = gps_data_codec.encode(
+            [(t0 + 100 + i, 60, 20) for i in range(20)]
+        )
+        device.update_cached_data()
+        self.assertEqual(device.location_count, 30)
+        self.assertEqual(device._location_count, 30)
+
+    def test_append_locations(self):
+        device = Device.objects.create()
+        t0 = arrow.get().shift(hours=-1).int_timestamp
+        device.add_locations([(t0, 60.123455, 20.000005)])
+        device = Device.objects.get(pk=device.pk)
+        device.add_locations([(t0 + 2, 60.12346, 20.00001), (t0 + 1, -1.5, 2.5)])
+        self.assertEqual(device._location_count, 3)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.location_count, 3)
+        self.assertEqual(
+            device.locations_series,
+            [
+                (t0, 60.12346, 20.00001),
+                (t0 + 1, -1.5, 2.5),
+                (t0 + 2, 60.12346, 20.00001),
+            ],
+        )
+        self.assertEqual(device.last_location_timestamp, t0 + 2)
+        # Older location, merged the slow way
+        device.add_locations([(t0 - 1, 61, 21)])
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.location_count, 4)
+        self.assertEqual(device.locations_series[0], (t0 - 1, 61, 21))
+
+    def test_locations_arrays(self):
+        device = Device.objects.create()
+        t0 = arrow.get().shift(hours=-1).int_timestamp
+        device.add_locations([(t0 + i, 60 + i / 100, 20) for i in range(25)])
+        device = Device.objects.get(pk=device.pk)
+        timestamps, latitudes, longitudes = device.locations_arrays
+        self.assertEqual(timestamps.tolist(), [t0 + i for i in range(25)])
+        self.assertEqual(latitudes[3], 60.03)
+        device.locations_arrays = (
+            np.concatenate([timestamps, timestamps[:5]]),
+            np.concatenate([latitudes, latitudes[:5]]),
+            np.concatenate([longitudes, longitudes[:5]]),
+        )
+        device.save()
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.location_count, 30)
+        device.remove_duplicates()
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.location_count, 25)
+        self.assertEqual(device.locations["timestamps"], timestamps.tolist())
+
+
+class MapTileTestCase(TestCase):
+    def test_blank_tiles(self):
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            image="maps/T/E/test",
+            width=1000,
+            height=1000,
+        )
+        raster_map = Map.objects.get(pk=raster_map.pk)
+        quad = raster_map.mercator_quad
+        # Stored, not computed again from the corners
+        self.assertEqual(quad, raster_map.compute_mercator_quad())
+        self.assertEqual(len(raster_map.mercator_quad_coordinates), 4)
+        self.assertEqual(raster_map.mercator_min_x, min(x for x, _ in quad))
+        self.assertEqual(raster_map.mercator_max_y, max(y for _, y in quad))
+
+        center = raster_map.center
+        tile_x, tile_y = latlon_to_tile_xy(center["lat"], center["lon"], 16)
+        self.assertTrue(
+            raster_map.intersects_with_tile(
+                *tile_xy_to_mercator_bounds(tile_x, tile_y, 16)
+            )
+        )
+        with patch.object(
+            Map, "image_array", new_callable=PropertyMock, side_effect=AssertionError
+        ):
+            blank_tile, cache_hit = raster_map.create_tile(
+                256,
+                256,
+                "image/png",
+                *tile_xy_to_mercator_bounds(tile_x + 10, tile_y, 16),
+            )
+            self.assertEqual(cache_hit, CACHED_BLANK_TILE)
+            other_blank_tile, _ = raster_map.create_tile(
+                256,
+                256,
+                "image/png",
+                *tile_xy_to_mercator_bounds(tile_x, tile_y - 10, 16),
+            )
+        self.assertIs(other_blank_tile, blank_tile)
+
+
+@override_settings(
+    CACHE_TILES=False,
+    TILE_PYRAMID_ENABLED=True,
+    TILE_PYRAMID_SIZES=[256],
+    TILE_PYRAMID_MIMES=["image/png"],
+)
+class MapTilePyramidTestCase(TestCase):
+    def test_build_tile_pyramid(self):
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            image="maps/T/E/test",
+            width=1000,
+            height=1000,
+        )
+        self.assertTrue(
+            Task.objects.filter(
+                task_name="routechoices.core.bg_tasks.build_map_tile_pyramid"
+            ).exists()
+        )
+
+        stored = {}
+        with (
+            patch(
+                "routechoices.core.models.s3_put_object",
+                side_effect=lambda key, bucket, data, mime: stored.update({key: data}),
+            ),
+            patch.object(
+                Map,
+                "image_array",
+                new_callable=PropertyMock,
+                return_value=np.full((1000, 1000, 4), 255, dtype=np.uint8),
+            ),
+        ):
+            n_tiles = raster_map.build_tile_pyramid()
+        self.assertEqual(n_tiles, len(stored))
+        min_zoom, max_zoom = raster_map.tile_pyramid_zoom_range(256)
+        self.assertLess(min_zoom, max_zoom)
+        raster_map = Map.objects.get(pk=raster_map.pk)
+        self.assertEqual(raster_map.tile_pyramid_hash, raster_map.hash)
+
+        # Tiles requested by the tile service are read from the storage
+        tile_x, tile_y, tile_z = next(raster_map.tile_pyramid_tiles(256))
+        global_mercator = GlobalMercator()
+        max_lat, min_lon = tile_xy_to_north_west_latlon(tile_x, tile_y, tile_z)
+        min_lat, max_lon = tile_xy_to_north_west_latlon(tile_x + 1, tile_y + 1, tile_z)
+        min_xy = global_mercator.latlon_to_meters({"lat": min_lat, "lon": min_lon})
+        max_xy = global_mercator.latlon_to_meters({"lat": max_lat, "lon": max_lon})
+        with patch(
+            "routechoices.core.models.s3_get_object",
+            side_effect=lambda key, bucket: stored[key],
+        ):
+            data, cache_hit = raster_map.create_tile(
+                256,
+                256,
+                "image/png",
+                min_xy["x"],
+                max_xy["x"],
+                min_xy["y"],
+                max_xy["y"],
+            )
+        self.assertEqual(cache_hit, STORED_TILE)
+        self.assertEqual(
+            data,
+            stored[
+                raster_map.stored_tile_path(256, tile_x, tile_y, tile_z, "image/png")
+            ],
+        )
+
+        # Pyramid not used anymore once the map is modified
+        raster_map.corners_coordinates = (
+            "61.45076,24.18994,61.44656,24.24721,61.42094,24.23851,61.42533,24.18156"
+        )
+        raster_map.save()
+        self.assertIsNone(
+            raster_map.get_stored_tile(
+                256,
+                256,
+                "image/png",
+                min_xy["x"],
+                max_xy["x"],
+                min_xy["y"],
+                max_xy["y"],
+            )
+        )
+
+    def test_image_levels(self):
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            width=3000,
+            height=2000,
+        )
+        img = np.zeros((2000, 3000, 4), dtype=np.uint8)
+        img[:, :, 3] = 255
+        img[:, :, 1] = np.linspace(0, 255, 3000, dtype=np.uint8)
+        img[::40, :, 0] = 255
+        levels = build_image_levels(img)
+        self.assertEqual(
+            [level.shape[:2] for level in levels],
+            [(2000, 3000), (1000, 1500), (500, 750), (250, 375), (125, 188)],
+        )
+
+        tile_x, tile_y, tile_z = next(raster_map.tile_pyramid_tiles(256))
+        bounds = tile_xy_to_mercator_bounds(tile_x, tile_y, tile_z)
+        level = raster_map.tile_image_level(bounds[0], bounds[1], 256)
+        self.assertGreater(level, 0)
+        # Tile resolution at the native zoom of the map
+        native_bounds = tile_xy_to_mercator_bounds(
+            *next(
+                (x, y, z)
+                for x, y, z in raster_map.tile_pyramid_tiles(256)
+                if z == raster_map.tile_pyramid_zoom_range(256)[1]
+            )
+        )
+        self.assertEqual(
+            raster_map.tile_image_level(native_bounds[0], native_bounds[1], 256), 0
+        )
+
+        with patch("routechoices.core.models.cv2.imencode") as imencode:
+            imencode.return_value = (True, np.zeros(1, dtype=np.uint8))
+            raster_map.render_tile(levels[level], 256, 256, "image/png", *bounds)
+            from_level = imencode.call_args[0][1]
+            raster_map.render_tile(img, 256, 256, "image/png", *bounds)
+            from_full = imencode.call_args[0][1]
+        self.assertEqual(from_level.shape, (256, 256, 4))
+        difference = np.abs(from_level.astype(int) - from_full.astype(int))
+        self.assertLess(difference.mean(), 3)
+
+    def test_metatile(self):
+        clear_cache()
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            image="maps/T/E/test",
+            width=1000,
+            height=1000,
+        )
+        tile_z = raster_map.tile_pyramid_zoom_range(256)[1]
+        center = raster_map.center
+        tile_x, tile_y = latlon_to_tile_xy(center["lat"], center["lon"], tile_z)
+        block = [
+            (x, y)
+            for x in range(tile_x - tile_x % 2, tile_x - tile_x % 2 + 2)
+            for y in range(tile_y - tile_y % 2, tile_y - tile_y % 2 + 2)
+        ]
+        with (
+            tempfile.TemporaryDirectory() as raster_dir,
+            override_settings(
+                CACHE_TILES=True, METATILE_SIZE=2, RASTER_STORE_DIR=raster_dir
+            ),
+            patch.object(
+                Map,
+                "image_array",
+                new_callable=PropertyMock,
+                return_value=np.full((1000, 1000, 4), 255, dtype=np.uint8),
+            ),
+            patch(
+                "routechoices.core.models.cv2.warpPerspective",
+                wraps=cv2.warpPerspective,
+            ) as warp,
+        ):
+            _, cache_hit = raster_map.create_tile(
+                256,
+                256,
+                "image/png",
+                *tile_xy_to_mercator_bounds(tile_x, tile_y, tile_z),
+            )
+            self.assertNotEqual(cache_hit, CACHED_TILE)
+            for x, y in block:
+                _, cache_hit = raster_map.create_tile(
+                    256, 256, "image/png", *tile_xy_to_mercator_bounds(x, y, tile_z)
+                )
+                self.assertEqual(cache_hit, CACHED_TILE)
+            self.assertEqual(warp.call_count, 1)
+            self.assertEqual(warp.call_args[0][2], (512, 512))
@@ -0,0 +1,164 @@
+"""
+Two level cache: a least recently used cache in the memory of each process in
+front of the cache shared by all the processes.
+
+Only values that never change for a given key, or whose staleness for up to
+LOCAL_CACHE_TIMEOUT seconds is acceptable, should go through it, as deleting
+or updating a key from a process does not reach the other processes memory.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from diskcache import DjangoCache
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+MISSING = object()
+CACHE_WAIT_INTERVAL = 0.05
+
+
+def get_value_size(value):
+    """Approximate size in bytes of a cached value"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(get_value_size(k) + get_value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(get_value_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LocalLRUCache:
+    """
+    Least recently used cache bounded by the total size of its values, with
+    a maximum time to live
+    """
+
+    def __init__(self, max_size, max_timeout):
+        self.max_size = max_size
+        self.max_timeout = max_timeout
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            expire, _, value = item
+            if expire < time.monotonic():
+                self._delete(key)
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.max_timeout
+        else:
+            timeout = min(timeout, self.max_timeout)
+        size = get_value_size(value)
+        with self.lock:
+            self._delete(key)
+            # Values too big would evict most of the others
+            if timeout <= 0 or size > self.max_size // 2:
+                return
+            self.items[key] = (time.monotonic() + timeout, size, value)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size, _) = self.items.popitem(last=False)
+                self.size -= evicted_size
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def _delete(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+
+local_cache = LocalLRUCache(
+    getattr(settings, "LOCAL_CACHE_MAX_SIZE", 64 * 2**20),
+    getattr(settings, "LOCAL_CACHE_TIMEOUT", 60),
+)
+
+
+def shared_cache_get(key):
+    """
+    Return the value of key from the shared cache, MISSING if not found, and
+    the seconds before it expires, None if it never expires or if the cache
+    backend does not tell
+    """
+    shared_cache = caches["default"]
+    if isinstance(shared_cache, DjangoCache):
+        value, expire_time = shared_cache.get(key, MISSING, expire_time=True)
+        if expire_time is None:
+            return value, None
+        return value, expire_time - time.time()
+    value = shared_cache.get(key, MISSING)
+    if value is MISSING or not isinstance(shared_cache, RedisCache):
+        return value, None
+    cache_key = shared_cache.make_and_validate_key(key)
+    ttl = shared_cache._cache.get_client(cache_key).ttl(cache_key)
+    return value, ttl if ttl >= 0 else None
+
+
+def cache_get(key):
+    """
+    Return the value of key from the local cache, or else from the shared
+    cache, MISSING if not found
+    """
+    value = local_cache.get(key)
+    if value is not MISSING:
+        return value
+    try:
+        value, timeout = shared_cache_get(key)
+    except Exception:
+        return MISSING
+    if value is not MISSING:
+        # Not kept locally after it expired from the shared cache
+        local_cache.set(key, value, timeout)
+    return value
+
+
+def cache_set(key, value, timeout=DEFAULT_TIMEOUT):
+    """Set key in the shared cache and in the local cache"""
+    local_timeout = cache.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+    local_cache.set(key, value, local_timeout)
+    try:
+        cache.set(key, value, timeout)
+    except Exception:
+        pass
+
+
+def clear_cache():
+    """Clear the shared cache and the local cache of this process"""
+    local_cache.clear()
+    cache.clear()
+
+
+def wait_for_cache(key, timeout):
+    """Wait for a value being set in the shared cache by another worker"""
+    end = time.time() + timeout
+    while time.time() < end:
+        time.sleep(CACHE_WAIT_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return None
@@ -0,0 +1,234 @@
+"""
+Helpers working directly on the GPS data encoding used by gps_data_codec.
+
+The encoding is a variant of the Google polyline format, each location is
+stored as 3 numbers (timestamp, latitude, longitude), each number is split
+in chunks of 5 bits written as printable characters, all but the last chunk
+of a number having the 0x20 bit set.
+The first location is stored as absolute values (timestamp relative to
+2010-01-01), the next ones as deltas from the previous location.
+"""
+
+import bisect
+import math
+import re
+from decimal import Decimal
+
+import gps_data_codec
+import numpy as np
+
+ENCODING_EPOCH = 1262304000  # 2010-01-01T00:00:00Z
+COORDINATES_PRECISION = 1e5
+
+# Characters holding a chunk that is not the last one of a number
+_CONTINUATION_CHARS = {c: None for c in range(0x20 + 63, 0x40 + 63)}
+# A number ends with the first character that is not a continuation chunk
+_NUMBER_RE = re.compile(r"[_-~]*[?-^]")
+
+
+def _round_half_away_from_zero(value):
+    abs_value = abs(value)
+    rounded = math.floor(abs_value)
+    if abs_value - rounded >= 0.5:
+        rounded += 1
+    return int(math.copysign(rounded, value))
+
+
+def coordinate_to_int(value):
+    if isinstance(value, Decimal):
+        return int((value * 100000).to_integral_value())
+    return _round_half_away_from_zero(value * COORDINATES_PRECISION)
+
+
+def round_coordinate(value):
+    """Round a coordinate the same way it is once encoded"""
+    return coordinate_to_int(value) / COORDINATES_PRECISION
+
+
+def encode_unsigned_number(value):
+    out = []
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+    return "".join(out)
+
+
+def encode_signed_number(value):
+    return encode_unsigned_number(~(value << 1) if value < 0 else value << 1)
+
+
+def encoded_location_count(encoded):
+    # Only the last chunk of a number is below 0x20
+    return len(encoded.translate(_CONTINUATION_CHARS)) // 3
+
+
+def encode_appended_locations(locations, last_location=None):
+    """
+    Encode locations so the result can be concatenated to an encoded string
+    whose last location is last_location.
+    Locations must be sorted and strictly newer than last_location.
+    """
+    if last_location is None:
+        return gps_data_codec.encode(locations)
+    prev_ts, prev_lat, prev_lon = last_location
+    prev_ts = int(prev_ts)
+    prev_lat = coordinate_to_int(prev_lat)
+    prev_lon = coordinate_to_int(prev_lon)
+    out = []
+    for ts, lat, lon in locations:
+        ts = int(ts)
+        if ts <= prev_ts:
+            raise ValueError("Locations must be newer than the last location")
+        lat = coordinate_to_int(lat)
+        lon = coordinate_to_int(lon)
+        out.append(encode_unsigned_number(ts - prev_ts))
+        out.append(encode_signed_number(lat - prev_lat))
+        out.append(encode_signed_number(lon - prev_lon))
+        prev_ts, prev_lat, prev_lon = ts, lat, lon
+    return "".join(out)
+
+
+def decode_first_location(encoded):
+    offset = 0
+    for _ in range(3):
+        match = _NUMBER_RE.match(encoded, offset)
+        if not match:
+            return None
+        offset = match.end()
+    return gps_data_codec.decode(encoded[:offset])[0]
+
+
+def build_sparse_index(encoded, locations, step):
+    """
+    Index every step-th location of an encoded string as a list of
+    [timestamp, offset of the next location, latitude, longitude], coordinates
+    being stored as integers as they are encoded.
+    locations is the decoded content of the encoded string.
+    """
+    if not locations:
+        return []
+    numbers_ends = [m.end() for m in _NUMBER_RE.finditer(encoded)]
+    index = []
+    for i in range(0, len(locations), step):
+        ts, lat, lon = locations[i]
+        index.append(
+            [
+                int(ts),
+                numbers_ends[3 * i + 2],
+                coordinate_to_int(lat),
+                coordinate_to_int(lon),
+            ]
+        )
+    return index
+
+
+def decode_locations_between(encoded, index, from_ts, end_ts):
+    """
+    Decode only the locations between two timestamps (included), using the
+    sparse index to skip the start and the end of the encoded string.
+    """
+    if index:
+        index_ts = [entry[0] for entry in index]
+        start_idx = bisect.bisect_right(index_ts, from_ts) - 1
+        end_idx = bisect.bisect_right(index_ts, end_ts)
+        end_offset = index[end_idx][1] if end_idx < len(index) else len(encoded)
+        if start_idx <= 0:
+            encoded = encoded[:end_offset]
+        else:
+            ts, offset, lat, lon = index[start_idx]
+            # Start from an indexed location, written with absolute values
+            encoded = (
+                gps_data_codec.encode(
+                    [(ts, lat / COORDINATES_PRECISION, lon / COORDINATES_PRECISION)]
+                )
+                + encoded[offset:end_offset]
+            )
+    if not encoded:
+        return []
+    locations = gps_data_codec.decode(encoded)
+    from_idx = bisect.bisect_left(locations, from_ts, key=lambda loc: loc[0])
+    end_idx = bisect.bisect_right(locations, end_ts, key=lambda loc: loc[0])
+    return locations[from_idx:end_idx]
+
+
+def _coordinates_to_int_array(values):
+    values = np.asarray(values, dtype=np.float64) * COORDINATES_PRECISION
+    abs_values = np.abs(values)
+    rounded = np.floor(abs_values)
+    rounded += abs_values - rounded >= 0.5
+    return np.copysign(rounded, values).astype(np.int64)
+
+
+def decode_arrays(encoded):
+    """
+    Decode locations as 3 arrays: timestamps (int64), latitudes and
+    longitudes (float64).
+    Raise ValueError if the encoded data is malformed.
+    """
+    if not encoded:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64),
+        )
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64)
+    chunks -= 63
+    if chunks.min() < 0 or chunks.max() >= 0x40:
+        raise ValueError("Invalid encoded data")
+    is_last_chunk = chunks < 0x20
+    number_ends = np.flatnonzero(is_last_chunk)
+    if not is_last_chunk[-1] or len(number_ends) % 3:
+        raise ValueError("Invalid encoded data")
+    number_starts = np.empty_like(number_ends)
+    number_starts[0] = 0
+    number_starts[1:] = number_ends[:-1] + 1
+    number_lengths = number_ends - number_starts + 1
+    # Longer numbers would overflow 64 bits integers
+    if number_lengths.max() > 12:
+        raise ValueError("Invalid encoded data")
+    # Position of each chunk within its number
+    chunk_positions = np.arange(len(chunks)) - np.repeat(number_starts, number_lengths)
+    values = (chunks & 0x1F) << (5 * chunk_positions)
+    numbers = np.add.reduceat(values, number_starts)
+    numbers = numbers.reshape(-1, 3)
+    # Zigzag decoding, except for the timestamps deltas
+    signed_numbers = (numbers >> 1) ^ -(numbers & 1)
+    signed_numbers[1:, 0] = numbers[1:, 0]
+    signed_numbers[0, 0] += ENCODING_EPOCH
+    absolutes = np.cumsum(signed_numbers, axis=0)
+    return (
+        absolutes[:, 0],
+        absolutes[:, 1] / COORDINATES_PRECISION,
+        absolutes[:, 2] / COORDINATES_PRECISION,
+    )
+
+
+def encode_arrays(timestamps, latitudes, longitudes):
+    """Encode locations given as 3 arrays, sorted by timestamps"""
+    timestamps = np.asarray(timestamps).astype(np.int64)
+    if len(timestamps) == 0:
+        return ""
+    numbers = np.empty((len(timestamps), 3), dtype=np.int64)
+    numbers[:, 0] = np.diff(timestamps, prepend=ENCODING_EPOCH)
+    numbers[:, 1] = np.diff(_coordinates_to_int_array(latitudes), prepend=0)
+    numbers[:, 2] = np.diff(_coordinates_to_int_array(longitudes), prepend=0)
+    if np.any(numbers[1:, 0] < 0):
+        raise ValueError("Input data is not sorted")
+    # Zigzag encoding, except for the timestamps deltas
+    zigzag = np.where(numbers < 0, ~(numbers << 1), numbers << 1)
+    zigzag[1:, 0] = numbers[1:, 0]
+    zigzag = zigzag.ravel().astype(np.uint64)
+    # Split numbers in chunks of 5 bits
+    max_chunks = max(1, -(-int(zigzag.max()).bit_length() // 5))
+    shifts = np.arange(max_chunks, dtype=np.uint64) * np.uint64(5)
+    chunks = ((zigzag[:, None] >> shifts) & np.uint64(0x1F)).astype(np.uint8)
+    chunk_counts = np.ones(len(zigzag), dtype=np.int64)
+    for i in range(1, max_chunks):
+        chunk_counts[zigzag >= np.uint64(1 << (5 * i))] = i + 1
+    positions = np.arange(max_chunks)
+    is_used = positions < chunk_counts[:, None]
+    is_continued = positions < chunk_counts[:, None] - 1
+    chars = chunks | (is_continued.astype(np.uint8) << 5)
+    chars += 63
+    return chars[is_used].tobytes().decode("ascii")
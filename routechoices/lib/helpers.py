@@ -472,3 +472,65 @@ def distance_latlon(a, b):
     )
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c
+
+
+def _orientation(a, b, c):
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (value > 0) - (value < 0)
+
+
+def _on_segment(a, b, c):
+    """Whether c, colinear with a and b, is on the segment a b"""
+    in_x_range = min(a[0], b[0]) <= c[0] <= max(a[0], b[0])
+    return in_x_range and min(a[1], b[1]) <= c[1] <= max(a[1], b[1])
+
+
+def segments_intersect(a, b, c, d):
+    o1 = _orientation(a, b, c)
+    o2 = _orientation(a, b, d)
+    o3 = _orientation(c, d, a)
+    o4 = _orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (
+        (o1 == 0 and _on_segment(a, b, c))
+        or (o2 == 0 and _on_segment(a, b, d))
+        or (o3 == 0 and _on_segment(c, d, a))
+        or (o4 == 0 and _on_segment(c, d, b))
+    )
+
+
+def point_in_polygon(point, polygon):
+    x, y = point
+    inside = False
+    for i in range(len(polygon)):
+        ax, ay = polygon[i - 1]
+        bx, by = polygon[i]
+        if (ay > y) != (by > y) and x < (bx - ax) * (y - ay) / (by - ay) + ax:
+            inside = not inside
+    return inside
+
+
+def polygon_intersects_rectangle(polygon, min_x, max_x, min_y, max_y):
+    """
+    Whether a polygon, given as a list of (x, y), and an axis aligned
+    rectangle have at least a point in common
+    """
+    xs = [p[0] for p in polygon]
+    ys = [p[1] for p in polygon]
+    if max(xs) < min_x or min(xs) > max_x or max(ys) < min_y or min(ys) > max_y:
+        return False
+    for x, y in polygon:
+        if min_x <= x <= max_x and min_y <= y <= max_y:
+            return True
+    # Rectangle inside the polygon
+    if point_in_polygon((min_x, min_y), polygon):
+        return True
+    rectangle = [(min_x, min_y), (min_x, max_y), (max_x, max_y), (max_x, min_y)]
+    for i in range(len(polygon)):
+        for j in range(4):
+            if segments_intersect(
+                polygon[i - 1], polygon[i], rectangle[j - 1], rectangle[j]
+            ):
+                return True
+    return False
@@ -0,0 +1,313 @@
+"""
+Push of live locations to the spectators of an event with Server-Sent Events.
+
+New locations of a device are published on a PostgreSQL notification channel,
+the process running the Tornado servers listens to that channel and forwards
+them to the clients subscribed to the live events in which the device is used.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+import gps_data_codec
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+from tornado.iostream import StreamClosedError
+from tornado.web import Application, HTTPError, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL notifications payloads are limited to 8000 bytes
+NOTIFICATION_MAX_LOCATIONS = 200
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEP_ALIVE_INTERVAL = 15
+EVENTS_REFRESH_INTERVAL = 30
+
+
+def is_live_push_enabled():
+    return getattr(settings, "LIVE_PUSH_ENABLED", False)
+
+
+def get_live_push_channel():
+    return getattr(settings, "LIVE_PUSH_CHANNEL", "routechoices_live_locations")
+
+
+def publish_locations(device, locations):
+    """
+    Publish new locations of a device once the current transaction commits.
+    locations must be sorted by timestamps.
+    """
+    if not locations or connection.vendor != "postgresql":
+        return
+    payloads = []
+    for i in range(0, len(locations), NOTIFICATION_MAX_LOCATIONS):
+        payloads.append(
+            json.dumps(
+                {
+                    "device": device.aid,
+                    "encoded_data": gps_data_codec.encode(
+                        locations[i : i + NOTIFICATION_MAX_LOCATIONS]
+                    ),
+                }
+            )
+        )
+
+    def notify():
+        channel = get_live_push_channel()
+        with connection.cursor() as cursor:
+            for payload in payloads:
+                cursor.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+
+    transaction.on_commit(notify)
+
+
+def _close_queue(queue):
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+class LivePushBroker:
+    """
+    Keep the list of subscribers of each event and forward them the
+    locations received from the notification channel.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        # event aid -> list of (device aid, competitor aid, start ts, end ts)
+        self.events_competitors = {}
+        # device aid -> list of (event aid, competitor aid, start ts, end ts)
+        self.devices_competitors = {}
+
+    async def subscribe(self, event_id, queue):
+        self.subscribers.setdefault(event_id, set()).add(queue)
+        if event_id not in self.events_competitors:
+            self.set_events_competitors(
+                {
+                    **self.events_competitors,
+                    **(await get_live_events_competitors([event_id])),
+                }
+            )
+
+    def unsubscribe(self, event_id, queue):
+        queues = self.subscribers.get(event_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[event_id]
+
+    async def refresh(self):
+        self.set_events_competitors(
+            await get_live_events_competitors(list(self.subscribers.keys()))
+        )
+
+    def set_events_competitors(self, events_competitors):
+        devices_competitors = {}
+        for event_id, competitors in events_competitors.items():
+            for device_id, competitor_id, start_ts, end_ts in competitors:
+                devices_competitors.setdefault(device_id, []).append(
+                    (event_id, competitor_id, start_ts, end_ts)
+                )
+        self.events_competitors = events_competitors
+        self.devices_competitors = devices_competitors
+
+    def dispatch(self, payload):
+        try:
+            data = json.loads(payload)
+            device_id = data["device"]
+            locations = gps_data_codec.decode(data["encoded_data"])
+        except Exception:
+            logger.warning("Invalid live locations notification")
+            return
+        for event_id, competitor_id, start_ts, end_ts in self.devices_competitors.get(
+            device_id, []
+        ):
+            queues = self.subscribers.get(event_id)
+            if not queues:
+                continue
+            competitor_locations = [
+                loc for loc in locations if start_ts <= loc[0] <= end_ts
+            ]
+            if not competitor_locations:
+                continue
+            # Serialized once for all the subscribers of the event
+            message = (
+                "event: locations\ndata: "
+                + json.dumps(
+                    {
+                        "competitor": competitor_id,
+                        "encoded_data": gps_data_codec.encode(competitor_locations),
+                    }
+                )
+                + "\n\n"
+            ).encode()
+            for queue in list(queues):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # Client too slow to keep up, disconnect it
+                    self.unsubscribe(event_id, queue)
+                    _close_queue(queue)
+
+
+@sync_to_async
+def get_live_events_competitors(event_ids):
+    from routechoices.core.models import Competitor
+
+    events_competitors = {event_id: [] for event_id in event_ids}
+    if not event_ids:
+        return events_competitors
+    for competitor in (
+        Competitor.objects.filter(
+            event__aid__in=event_ids,
+            event__start_date__lte=now(),
+            event__end_date__gte=now(),
+            device__isnull=False,
+        )
+        .select_related("event", "device")
+        .order_by("start_time")
+    ):
+        events_competitors[competitor.event.aid].append(
+            (
+                competitor.device.aid,
+                competitor.aid,
+                (competitor.start_time or competitor.event.start_date).timestamp(),
+                competitor.event.end_date.timestamp(),
+            )
+        )
+    connection.close()
+    return events_competitors
+
+
+@sync_to_async
+def get_live_event(event_id):
+    from routechoices.core.models import PRIVACY_PRIVATE, Event
+
+    event = (
+        Event.objects.filter(
+            aid=event_id,
+            start_date__lte=now(),
+            end_date__gte=now(),
+        )
+        .exclude(privacy=PRIVACY_PRIVATE)
+        .first()
+    )
+    connection.close()
+    return event
+
+
+class LiveEventHandler(RequestHandler):
+    def initialize(self, broker):
+        self.broker = broker
+        self.queue = None
+        self.event_id = None
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+
+    async def get(self, event_id):
+        event = await get_live_event(event_id)
+        if not event:
+            raise HTTPError(404)
+        self.event_id = event.aid
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        await self.broker.subscribe(self.event_id, self.queue)
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")
+        end_ts = event.end_date.timestamp()
+        try:
+            self.write(f"retry: {KEEP_ALIVE_INTERVAL * 1000}\n\n")
+            await self.flush()
+            while time.time() < end_ts:
+                try:
+                    message = await asyncio.wait_for(
+                        self.queue.get(), KEEP_ALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    message = b": keep-alive\n\n"
+                if message is None:
+                    break
+                self.write(message)
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.broker.unsubscribe(self.event_id, self.queue)
+
+    def on_connection_close(self):
+        if self.queue is not None:
+            self.broker.unsubscribe(self.event_id, self.queue)
+            _close_queue(self.queue)
+
+
+class LivePushServer:
+    """
+    HTTP server streaming the live locations of an event at
+    /events/<event_id>/live
+    """
+
+    def __init__(self):
+        self.broker = LivePushBroker()
+        self.application = Application(
+            [
+                (
+                    r"/events/([a-zA-Z0-9_-]+)/live/?",
+                    LiveEventHandler,
+                    {"broker": self.broker},
+                ),
+            ]
+        )
+        self.server = None
+        self.tasks = []
+
+    def listen(self, port):
+        self.server = self.application.listen(port, xheaders=True)
+        self.tasks = [
+            asyncio.ensure_future(self.listen_notifications()),
+            asyncio.ensure_future(self.refresh_events()),
+        ]
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+        for task in self.tasks:
+            task.cancel()
+
+    async def refresh_events(self):
+        while True:
+            try:
+                await self.broker.refresh()
+            except Exception:
+                logger.exception("Could not refresh the live events competitors")
+            await asyncio.sleep(EVENTS_REFRESH_INTERVAL)
+
+    async def listen_notifications(self):
+        import psycopg
+
+        db_settings = settings.DATABASES["default"]
+        while True:
+            try:
+                aconn = await psycopg.AsyncConnection.connect(
+                    dbname=db_settings["NAME"],
+                    user=db_settings.get("USER") or None,
+                    password=db_settings.get("PASSWORD") or None,
+                    host=db_settings.get("HOST") or None,
+                    port=db_settings.get("PORT") or None,
+                    autocommit=True,
+                )
+                async with aconn:
+                    await aconn.execute(f'LISTEN "{get_live_push_channel()}"')
+                    async for notification in aconn.notifies():
+                        self.broker.dispatch(notification.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Live locations listener disconnected")
+                await asyncio.sleep(1)
@@ -0,0 +1,90 @@
+"""
+Decoded map images stored as .npy files on the local disk.
+
+They are opened memory-mapped, so all the worker processes of a machine
+share them through the page cache instead of each unpickling its own copy.
+The least recently used files are removed once their total size exceeds
+RASTER_STORE_MAX_SIZE.
+"""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+
+def get_raster_store_dir():
+    return getattr(
+        settings, "RASTER_STORE_DIR", os.path.join(settings.BASE_DIR, "rasters")
+    )
+
+
+def get_raster_path(name):
+    filename = hashlib.sha256(name.encode()).hexdigest()
+    return os.path.join(get_raster_store_dir(), f"{filename}.npy")
+
+
+def load_raster(name):
+    """Return the stored array as a read only memory map, None if not stored"""
+    path = get_raster_path(name)
+    try:
+        array = np.load(path, mmap_mode="r")
+        # Modification time is used as last access time for the eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return array
+
+
+def save_raster(name, array):
+    path = get_raster_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as fp:
+            np.save(fp, np.ascontiguousarray(array))
+        # Atomic, readers never see a partially written file
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+    evict_rasters()
+
+
+def evict_rasters(max_size=None):
+    """Remove the least recently used files until they fit in max_size"""
+    if max_size is None:
+        max_size = getattr(settings, "RASTER_STORE_MAX_SIZE", 4 * 2**30)
+    entries = []
+    try:
+        with os.scandir(get_raster_store_dir()) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total_size = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        # Memory maps already opened by other processes stay valid
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
+def clear_rasters():
+    evict_rasters(max_size=0)
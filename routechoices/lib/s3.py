@@ -1,3 +1,4 @@
+import functools
 import os.path
 
 import boto3
@@ -11,6 +12,8 @@ def bytes_to_str(b):
     return b.decode("utf-8")
 
 
+# Clients are thread safe and slow to create
+@functools.cache
 def get_s3_client():
     return boto3.client(
         "s3",
@@ -47,3 +50,16 @@ def s3_rename_object(bucket, src, dest):
     s3 = get_s3_client()
     s3.copy_object(Bucket=bucket, CopySource=os.path.join(bucket, src), Key=dest)
     s3.delete_object(Bucket=bucket, Key=src)
+
+
+def s3_put_object(key, bucket, data, content_type=None):
+    s3 = get_s3_client()
+    params = {"Bucket": bucket, "Key": key, "Body": data}
+    if content_type:
+        params["ContentType"] = content_type
+    s3.put_object(**params)
+
+
+def s3_get_object(key, bucket):
+    s3 = get_s3_client()
+    return s3.get_object(Bucket=bucket, Key=key)["Body"].read()
@@ -15,3 +15,54 @@ def tile_xy_to_north_west_latlon(xtile, ytile, zoom):
     lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
     lat_deg = math.degrees(lat_rad)
     return (lat_deg, lon_deg)
+
+
+# Half of the spherical mercator projection width, in meters
+MERCATOR_ORIGIN_SHIFT = math.pi * 6378137
+
+
+def tile_xy_to_mercator_bounds(xtile, ytile, zoom):
+    """Return the min x, max x, min y, max y of a tile in spherical mercator"""
+    tile_size = 2 * MERCATOR_ORIGIN_SHIFT / 2**zoom
+    min_x = xtile * tile_size - MERCATOR_ORIGIN_SHIFT
+    max_y = MERCATOR_ORIGIN_SHIFT - ytile * tile_size
+    return (min_x, min_x + tile_size, max_y - tile_size, max_y)
+
+
+def mercator_bounds_to_tile_xy(min_x, max_x, min_y, max_y, max_zoom=30):
+    """
+    Return the x, y, zoom of the tile with the given spherical mercator
+    bounds, None if the bounds are not the ones of a tile
+    """
+    tile_size = max_x - min_x
+    if tile_size <= 0 or abs(max_y - min_y - tile_size) > tile_size * 1e-3:
+        return None
+    zoom = math.log2(2 * MERCATOR_ORIGIN_SHIFT / tile_size)
+    if abs(zoom - round(zoom)) > 1e-3 or not 0 <= round(zoom) <= max_zoom:
+        return None
+    zoom = round(zoom)
+    tile_size = 2 * MERCATOR_ORIGIN_SHIFT / 2**zoom
+    xtile = (min_x + MERCATOR_ORIGIN_SHIFT) / tile_size
+    ytile = (MERCATOR_ORIGIN_SHIFT - max_y) / tile_size
+    if abs(xtile - round(xtile)) > 1e-3 or abs(ytile - round(ytile)) > 1e-3:
+        return None
+    return (round(xtile), round(ytile), zoom)
+
+
+def mercator_bounds_tiles_range(min_x, max_x, min_y, max_y, zoom):
+    """
+    Return the min x, max x, min y, max y indexes of the tiles covering the
+    given spherical mercator bounds at a zoom level
+    """
+    n = 2**zoom
+    tile_size = 2 * MERCATOR_ORIGIN_SHIFT / n
+
+    def clamp(value):
+        return min(max(int(value), 0), n - 1)
+
+    return (
+        clamp((min_x + MERCATOR_ORIGIN_SHIFT) // tile_size),
+        clamp((max_x + MERCATOR_ORIGIN_SHIFT) // tile_size),
+        clamp((MERCATOR_ORIGIN_SHIFT - max_y) // tile_size),
+        clamp((MERCATOR_ORIGIN_SHIFT - min_y) // tile_size),
+    )
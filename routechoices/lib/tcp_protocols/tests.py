@@ -1,13 +1,18 @@
 import asyncio
+import json
 import socket
 
+import arrow
+import gps_data_codec
 from asgiref.sync import sync_to_async
 from django.db import connection
 from django.test import TransactionTestCase
+from tornado.httpserver import HTTPServer
 from tornado.iostream import IOStream
 from tornado.testing import AsyncTestCase, bind_unused_port, gen_test
 
-from routechoices.core.models import Device, ImeiDevice
+from routechoices.core.models import Club, Competitor, Device, Event, ImeiDevice
+from routechoices.lib.live_push import LivePushServer
 from routechoices.lib.tcp_protocols.gt06 import GT06Server
 from routechoices.lib.tcp_protocols.mictrack import MicTrackServer
 from routechoices.lib.tcp_protocols.queclink import QueclinkServer
@@ -31,6 +36,27 @@ def refresh_device(device):
     return device
 
 
+@sync_to_async
+def create_live_event():
+    club = Club.objects.create(name="Test club", slug="club")
+    event = Event.objects.create(
+        club=club,
+        name="Test event",
+        slug="test-event",
+        start_date=arrow.get().shift(hours=-1).datetime,
+        end_date=arrow.get().shift(hours=1).datetime,
+    )
+    device = Device.objects.create()
+    competitor = Competitor.objects.create(
+        name="Alice",
+        short_name="A",
+        event=event,
+        device=device,
+    )
+    connection.close()
+    return event, device, competitor
+
+
 class TCPConnectionsTest(AsyncTestCase, TransactionTestCase):
     @gen_test
     async def test_gt06(self):
@@ -231,3 +257,61 @@ class TCPConnectionsTest(AsyncTestCase, TransactionTestCase):
             server.stop()
         if client is not None:
             client.close()
+
+
+class LivePushTest(AsyncTestCase, TransactionTestCase):
+    @gen_test
+    async def test_live_event_stream(self):
+        event, device, competitor = await create_live_event()
+        sock, port = bind_unused_port()
+        server = LivePushServer()
+        http_server = HTTPServer(server.application)
+        http_server.add_socket(sock)
+
+        client = IOStream(socket.socket())
+        await client.connect(("localhost", port))
+        await client.write(b"GET /events/unknown/live HTTP/1.0\r\n\r\n")
+        data = await client.read_until(b"\r\n")
+        self.assertIn(b"404", data)
+        client.close()
+
+        client = IOStream(socket.socket())
+        await client.connect(("localhost", port))
+        await client.write(
+            f"GET /events/{event.aid}/live HTTP/1.1\r\nHost: localhost\r\n\r\n".encode()
+        )
+        headers = await client.read_until(b"\r\n\r\n")
+        self.assertIn(b"text/event-stream", headers)
+        await client.read_until(b"\n\n")
+        self.assertIn(event.aid, server.broker.subscribers)
+
+        t = int(arrow.get().timestamp())
+        server.broker.dispatch(
+            json.dumps(
+                {
+                    "device": device.aid,
+                    "encoded_data": gps_data_codec.encode([(t, 1.1, 2.2)]),
+                }
+            )
+        )
+        data = await client.read_until(b"\n\n")
+        self.assertIn(b"event: locations", data)
+        message = json.loads(data.split(b"data: ", 1)[1].split(b"\r\n", 1)[-1])
+        self.assertEqual(message["competitor"], competitor.aid)
+        self.assertEqual(
+            gps_data_codec.decode(message["encoded_data"]), [(t, 1.1, 2.2)]
+        )
+
+        # Locations of devices not in the event are not forwarded
+        server.broker.dispatch(
+            json.dumps(
+                {
+                    "device": "unknown",
+                    "encoded_data": gps_data_codec.encode([(t, 1.1, 2.2)]),
+                }
+            )
+        )
+        client.close()
+        await asyncio.sleep(0.05)
+        self.assertNotIn(event.aid, server.broker.subscribers)
+        http_server.stop()
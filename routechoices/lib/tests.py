@@ -1,14 +1,169 @@
+import os
+import tempfile
+from concurrent.futures import Future
 from unittest.mock import Mock, patch
 
+import gps_data_codec
+import numpy as np
+from django.core.cache import cache
 from django.test import TestCase, override_settings
 
 from . import plausible
+from .cache import MISSING, LocalLRUCache, cache_get, clear_cache, local_cache
+from .gps_encoding import (
+    build_sparse_index,
+    decode_arrays,
+    decode_first_location,
+    decode_locations_between,
+    encode_appended_locations,
+    encode_arrays,
+    encoded_location_count,
+)
 from .helpers import (
     check_cname_record,
     check_txt_record,
     compute_corners_from_kml_latlonbox,
+    polygon_intersects_rectangle,
     three_point_calibration_to_corners,
 )
+from .raster_store import evict_rasters, get_raster_path, load_raster, save_raster
+from .slippy_tiles import (
+    mercator_bounds_tiles_range,
+    mercator_bounds_to_tile_xy,
+    tile_xy_to_mercator_bounds,
+)
+from .tile_render_service import TileRenderServer
+
+
+class SlippyTilesTestCase(TestCase):
+    def test_mercator_bounds(self):
+        for tile_x, tile_y, tile_z in ((0, 0, 0), (74352, 36993, 17), (3, 1, 2)):
+            bounds = tile_xy_to_mercator_bounds(tile_x, tile_y, tile_z)
+            self.assertEqual(
+                mercator_bounds_to_tile_xy(*bounds), (tile_x, tile_y, tile_z)
+            )
+            min_x, max_x, min_y, max_y = bounds
+            margin = (max_x - min_x) / 10
+            self.assertEqual(
+                mercator_bounds_tiles_range(
+                    min_x + margin,
+                    max_x - margin,
+                    min_y + margin,
+                    max_y - margin,
+                    tile_z,
+                ),
+                (tile_x, tile_x, tile_y, tile_y),
+            )
+        min_x, max_x, min_y, max_y = tile_xy_to_mercator_bounds(74352, 36993, 17)
+        self.assertIsNone(
+            mercator_bounds_to_tile_xy(min_x + 10, max_x + 10, min_y, max_y)
+        )
+        self.assertIsNone(mercator_bounds_to_tile_xy(min_x, max_x, min_y, max_y + 10))
+
+
+class RasterStoreTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(RASTER_STORE_DIR=self.tmp_dir.name)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp_dir.cleanup()
+
+    def test_load_raster(self):
+        self.assertIsNone(load_raster("maps/A/B/map:level:0"))
+        array = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+        save_raster("maps/A/B/map:level:0", array)
+        loaded = load_raster("maps/A/B/map:level:0")
+        self.assertIsInstance(loaded, np.memmap)
+        self.assertFalse(loaded.flags.writeable)
+        self.assertTrue(np.array_equal(loaded, array))
+
+    def test_eviction(self):
+        for i in range(3):
+            save_raster(f"map:{i}", np.zeros(1000, dtype=np.uint8))
+            os.utime(get_raster_path(f"map:{i}"), (1000 + i, 1000 + i))
+        # Reading a raster makes it the most recently used
+        load_raster("map:0")
+        evict_rasters(max_size=2500)
+        self.assertIsNotNone(load_raster("map:0"))
+        self.assertIsNone(load_raster("map:1"))
+        self.assertIsNotNone(load_raster("map:2"))
+
+
+class TileRenderServerTestCase(TestCase):
+    def test_submit(self):
+        server = TileRenderServer(address="/tmp/tiles.sock", workers=1, queue_size=1)
+        server.executor.shutdown()
+        server.executor = Mock()
+        server.executor.submit.side_effect = lambda *args: Future()
+        request = {"map_id": "a", "key": "map:a:tile", "args": ()}
+        future = server.submit(request)
+        # Same tile shares the pending render
+        self.assertIs(server.submit(request), future)
+        self.assertEqual(server.executor.submit.call_count, 1)
+        # Queue is full
+        self.assertIsNone(server.submit({**request, "key": "map:b:tile"}))
+        future.set_result((b"tile", 0))
+        self.assertEqual(server.pending, {})
+        self.assertIsNotNone(server.submit({**request, "key": "map:b:tile"}))
+
+
+class LocalLRUCacheTestCase(TestCase):
+    def test_eviction(self):
+        local_cache = LocalLRUCache(30, 60)
+        local_cache.set("a", b"0" * 10)
+        local_cache.set("b", b"1" * 10)
+        local_cache.set("c", b"2" * 10)
+        # Reading a value makes it the most recently used
+        self.assertEqual(local_cache.get("a"), b"0" * 10)
+        local_cache.set("d", b"3" * 10)
+        self.assertIs(local_cache.get("b"), MISSING)
+        self.assertEqual(local_cache.get("a"), b"0" * 10)
+        self.assertEqual(local_cache.get("d"), b"3" * 10)
+        self.assertEqual(local_cache.size, 30)
+        # Values bigger than half of the cache are not kept
+        local_cache.set("e", b"4" * 16)
+        self.assertIs(local_cache.get("e"), MISSING)
+        self.assertEqual(local_cache.get("c"), b"2" * 10)
+
+    def test_falsy_values(self):
+        local_cache = LocalLRUCache(100, 60)
+        local_cache.set("none", None)
+        local_cache.set("empty", b"")
+        self.assertIsNone(local_cache.get("none"))
+        self.assertEqual(local_cache.get("empty"), b"")
+        local_cache.delete("empty")
+        self.assertIs(local_cache.get("empty"), MISSING)
+
+    @patch("routechoices.lib.cache.time.monotonic")
+    def test_expiry(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        local_cache = LocalLRUCache(100, 60)
+        local_cache.set("a", b"0", 10)
+        local_cache.set("b", b"1", 3600)
+        mock_monotonic.return_value = 1011
+        self.assertIs(local_cache.get("a"), MISSING)
+        self.assertEqual(local_cache.get("b"), b"1")
+        # Timeouts are capped to the local cache maximum
+        mock_monotonic.return_value = 1061
+        self.assertIs(local_cache.get("b"), MISSING)
+        self.assertEqual(local_cache.size, 0)
+
+    @patch("routechoices.lib.cache.time.monotonic")
+    def test_shared_cache_timeout(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        clear_cache()
+        cache.set("a", b"0", 10)
+        self.assertEqual(cache_get("a"), b"0")
+        # Kept locally no longer than in the shared cache
+        mock_monotonic.return_value = 1011
+        self.assertIs(local_cache.get("a"), MISSING)
+        cache.set("b", b"1", 10)
+        cache_get("b")
+        clear_cache()
+        self.assertIs(local_cache.get("b"), MISSING)
 
 
 @override_settings(ANALYTICS_API_KEY=True)
@@ -84,6 +239,20 @@ class PlausibleTestCase(TestCase):
 
 
 class HelperTestCase(TestCase):
+    def test_polygon_intersects_rectangle(self):
+        diamond = [(0, 2), (2, 0), (0, -2), (-2, 0)]
+        # Vertex inside the rectangle
+        self.assertTrue(polygon_intersects_rectangle(diamond, 1.5, 3, -1, 1))
+        # Rectangle inside the polygon
+        self.assertTrue(polygon_intersects_rectangle(diamond, -0.5, 0.5, -0.5, 0.5))
+        # Edges crossing without any vertex inside the other shape
+        self.assertTrue(polygon_intersects_rectangle(diamond, 0.5, 1.5, -3, 3))
+        # Touching
+        self.assertTrue(polygon_intersects_rectangle(diamond, 1, 2, 1, 2))
+        # Inside the bounding box but outside the polygon
+        self.assertFalse(polygon_intersects_rectangle(diamond, 1.2, 2, 1.2, 2))
+        self.assertFalse(polygon_intersects_rectangle(diamond, 3, 4, -1, 1))
+
     def test_calibration_conversion(self):
         cal = three_point_calibration_to_corners(
             "9.5480564597566|46.701263850274|1|1|9.5617738453051|46.701010852567|4961|1|9.5475331306949|46.687915214433|1|7016",
@@ -125,3 +294,60 @@ class HelperTestCase(TestCase):
     def test_check_dns(self):
         self.assertTrue(check_cname_record("live.kiilat.com"))
         self.assertTrue(check_txt_record("live.kiilat.com"))
+
+
+class GpsEncodingTestCase(TestCase):
+    def test_append_encoded_locations(self):
+        locs = [
+            (1700000000, 60.12345, 20.54321),
+            (1700000001, 60.123455, -20.000005),
+            (1700000004, -0.000025, 0.000005),
+            (1700100000, 1.234565, -179.99999),
+        ]
+        encoded = gps_data_codec.encode(locs[:1])
+        for i in range(1, len(locs)):
+            encoded += encode_appended_locations(locs[i : i + 1], locs[i - 1])
+        self.assertEqual(encoded, gps_data_codec.encode(locs))
+        self.assertEqual(encoded_location_count(encoded), 4)
+        self.assertEqual(encode_appended_locations(locs), gps_data_codec.encode(locs))
+        with self.assertRaises(ValueError):
+            encode_appended_locations(locs[:1], locs[1])
+
+    def test_decode_locations_between(self):
+        locs = [(1700000000 + i * 3, 60 + i / 1000, 20 - i / 700) for i in range(95)]
+        encoded = gps_data_codec.encode(locs)
+        locs = gps_data_codec.decode(encoded)
+        index = build_sparse_index(encoded, locs, 10)
+        self.assertEqual(len(index), 10)
+        self.assertEqual(decode_first_location(encoded), locs[0])
+        for from_idx, end_idx in ((0, 94), (0, 5), (12, 12), (17, 63), (85, 94)):
+            self.assertEqual(
+                decode_locations_between(
+                    encoded, index, locs[from_idx][0], locs[end_idx][0]
+                ),
+                locs[from_idx : end_idx + 1],
+            )
+        self.assertEqual(
+            decode_locations_between(encoded, index, 1600000000, 1600000001), []
+        )
+
+    def test_encode_arrays(self):
+        locs = [
+            (1200000000, 0.000005, -0.000025),
+            (1700000000, 60.12345, 20.54321),
+            (1700000000, 1.234565, -179.99999),
+            (1800000000, -89.99999, 180),
+        ]
+        encoded = gps_data_codec.encode(locs)
+        timestamps, latitudes, longitudes = (np.array(col) for col in zip(*locs))
+        self.assertEqual(encode_arrays(timestamps, latitudes, longitudes), encoded)
+        timestamps, latitudes, longitudes = decode_arrays(encoded)
+        self.assertEqual(timestamps.dtype, np.int64)
+        self.assertEqual(
+            list(zip(timestamps.tolist(), latitudes.tolist(), longitudes.tolist())),
+            gps_data_codec.decode(encoded),
+        )
+        self.assertEqual(encode_arrays([], [], []), "")
+        self.assertEqual(len(decode_arrays("")[0]), 0)
+        with self.assertRaises(ValueError):
+            encode_arrays([2, 1], [0, 0], [0, 0])
@@ -0,0 +1,150 @@
+"""
+Tiles of the public events written on the local disk, served by nginx.
+
+The tiles of a map are stored in maps/<map aid>/<map hash>/<z>/<x>/<y>.<ext>.
+A request for a tile of a public event that is stored is answered with an
+X-Accel-Redirect to the file, before the event is looked up in the database.
+
+The map shown by each layer of an event is kept in the shared cache under a
+version of the event tiles. The version is changed when the event is made
+private or deleted, or when its maps change, so that every app node stops
+serving its tiles at once.
+"""
+
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+DISK_TILE_LOCATION = "/tiles_cache/"
+DISK_TILE_LAYER_TIMEOUT = 7 * 24 * 3600
+
+
+def get_tile_disk_cache_dir():
+    return getattr(settings, "TILE_DISK_CACHE_DIR", "")
+
+
+def get_disk_tiles_version(event_id):
+    """Version of the disk tiles of an event, None if they are disabled"""
+    if not get_tile_disk_cache_dir():
+        return None
+    cache_key = f"event:{event_id}:disk_tiles_version"
+    try:
+        version = cache.get(cache_key)
+        if version is None:
+            # Never reuse the version of an evicted key
+            cache.add(cache_key, time.time_ns(), None)
+            version = cache.get(cache_key)
+    except Exception:
+        return None
+    return version
+
+
+def invalidate_disk_tiles(event_id):
+    if not get_tile_disk_cache_dir():
+        return
+    cache_key = f"event:{event_id}:disk_tiles_version"
+    try:
+        cache.incr(cache_key)
+    except ValueError:
+        if not cache.add(cache_key, time.time_ns(), None):
+            cache.incr(cache_key)
+
+
+def _layer_cache_key(event_id, layer, version):
+    return f"event:{event_id}:disk_tiles:{version}:layer:{layer}"
+
+
+def _tile_path(map_dir, tile_z, tile_x, tile_y, img_mime):
+    return os.path.join(map_dir, str(tile_z), str(tile_x), f"{tile_y}.{img_mime[6:]}")
+
+
+def get_disk_tile_path(event_id, layer, version, tile_z, tile_x, tile_y, img_mime):
+    """Path of a stored tile relative to TILE_DISK_CACHE_DIR, None if missing"""
+    if version is None:
+        return None
+    try:
+        map_dir = cache.get(_layer_cache_key(event_id, layer, version))
+    except Exception:
+        return None
+    if not map_dir:
+        return None
+    path = _tile_path(map_dir, tile_z, tile_x, tile_y, img_mime)
+    if not os.path.exists(os.path.join(get_tile_disk_cache_dir(), path)):
+        return None
+    return path
+
+
+def disk_tile_response(path, img_mime):
+    response = HttpResponse("", content_type=img_mime)
+    response["X-Accel-Redirect"] = f"{DISK_TILE_LOCATION}{path}"
+    return response
+
+
+def save_disk_tile(
+    event_id, layer, version, raster_map, tile_z, tile_x, tile_y, img_mime, data
+):
+    """
+    Write a tile of a public event, version must have been read before the
+    event was loaded from the database
+    """
+    root = get_tile_disk_cache_dir()
+    if not root or version is None:
+        return
+    map_dir = os.path.join("maps", raster_map.aid, raster_map.hash)
+    path = os.path.join(root, _tile_path(map_dir, tile_z, tile_x, tile_y, img_mime))
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+        # Atomic, nginx never serves a partially written file
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+    try:
+        cache.set(
+            _layer_cache_key(event_id, layer, version),
+            map_dir,
+            DISK_TILE_LAYER_TIMEOUT,
+        )
+    except Exception:
+        pass
+
+
+def remove_map_disk_tiles(map_id, keep_hash=None):
+    """
+    Remove the tiles of all the versions of a map but keep_hash, and of the
+    composites of several maps it is part of
+    """
+    root = get_tile_disk_cache_dir()
+    if not root:
+        return
+    maps_dir = os.path.join(root, "maps")
+    try:
+        with os.scandir(maps_dir) as it:
+            composite_ids = [
+                entry.name for entry in it if map_id in entry.name.split("+")
+            ]
+    except OSError:
+        return
+    for composite_id in composite_ids:
+        if composite_id != map_id:
+            shutil.rmtree(os.path.join(maps_dir, composite_id), ignore_errors=True)
+    map_dir = os.path.join(maps_dir, map_id)
+    try:
+        with os.scandir(map_dir) as it:
+            entries = [entry.name for entry in it]
+    except OSError:
+        return
+    for name in entries:
+        if name != keep_hash:
+            shutil.rmtree(os.path.join(map_dir, name), ignore_errors=True)
@@ -0,0 +1,263 @@
+"""
+Rendering of map tiles in a pool of processes, out of the web workers.
+
+The run_tile_renderer command listens on the local socket TILE_RENDER_SOCKET
+and renders the tiles in TILE_RENDER_WORKERS processes. Concurrent requests
+for the same tile share a single render, and requests are refused once
+TILE_RENDER_QUEUE_SIZE renders are pending, so a burst of cold tiles can not
+tie up all the web workers.
+
+Blank, cached and stored tiles are still served by the web workers.
+Without TILE_RENDER_SOCKET the tiles are rendered by the web workers.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import quote_etag
+
+from routechoices.lib.helpers import safe64encodedsha
+
+logger = logging.getLogger(__name__)
+
+
+class TileRenderBusy(Exception):
+    pass
+
+
+class TileRenderError(Exception):
+    pass
+
+
+def get_tile_render_socket():
+    return getattr(settings, "TILE_RENDER_SOCKET", "")
+
+
+def get_tile_render_workers():
+    return getattr(settings, "TILE_RENDER_WORKERS", 4)
+
+
+def get_tile_render_queue_size():
+    return getattr(settings, "TILE_RENDER_QUEUE_SIZE", 64)
+
+
+def get_tile_render_timeout():
+    return getattr(settings, "TILE_RENDER_TIMEOUT", 2)
+
+
+def get_tile_fast_first_max_age():
+    return getattr(settings, "TILE_FAST_FIRST_MAX_AGE", 60)
+
+
+def get_tile_render_authkey():
+    # Requests are pickled, only accept them from processes sharing the secret
+    return settings.SECRET_KEY.encode()
+
+
+def tile_render_busy_response():
+    return HttpResponse(
+        "tile rendering busy",
+        status=503,
+        content_type="text/plain",
+        headers={"Retry-After": "1", "Cache-Control": "no-store"},
+    )
+
+
+def create_tile(
+    raster_map, output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+):
+    """
+    Same as Map.create_tile, for a Map or a MapComposite, but the tiles that
+    must be rendered are rendered by the render service when it is configured.
+    Raise TileRenderBusy if the service can not render the tile in time,
+    TileRenderError if it failed to render it, both answered with a 503.
+    """
+    args = (output_width, output_height, img_mime, min_x, max_x, min_y, max_y)
+    address = get_tile_render_socket()
+    if not address:
+        return raster_map.create_tile(*args)
+
+    data_out, cache_hit = raster_map.get_ready_tile(*args)
+    if data_out is not None:
+        return data_out, cache_hit
+
+    try:
+        conn = Client(address, family="AF_UNIX", authkey=get_tile_render_authkey())
+    except OSError:
+        logger.warning("Tile render service unreachable, rendering in process")
+        return raster_map.create_tile(*args)
+    with conn:
+        conn.send(
+            {
+                "map_id": raster_map.aid,
+                "key": raster_map.tile_cache_key(*args),
+                "args": args,
+            }
+        )
+        try:
+            if not conn.poll(get_tile_render_timeout()):
+                raise TileRenderBusy()
+            response = conn.recv()
+        except (EOFError, OSError):
+            raise TileRenderBusy()
+    status = response[0]
+    if status == "busy":
+        raise TileRenderBusy()
+    if status == "error":
+        raise TileRenderError(response[1])
+    return response[1], response[2]
+
+
+def create_tile_fast_first(
+    raster_map, output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+):
+    """
+    Same as create_tile, but an AVIF or JXL tile that is not ready is
+    encoded in a background task and a WebP tile is returned meanwhile.
+    Return the tile, its cache hit status and its format.
+    """
+    from routechoices.core.models import (
+        FAST_TILE_MIME,
+        SLOW_TILE_MIMES,
+        is_tile_fast_first_enabled,
+    )
+
+    bounds = (min_x, max_x, min_y, max_y)
+    if (
+        img_mime in SLOW_TILE_MIMES
+        and is_tile_fast_first_enabled()
+        and getattr(settings, "CACHE_TILES", False)
+    ):
+        data_out, cache_hit = raster_map.get_ready_tile(
+            output_width, output_height, img_mime, *bounds
+        )
+        if data_out is not None:
+            return data_out, cache_hit, img_mime
+        raster_map.schedule_tile_encoding(
+            output_width, output_height, img_mime, *bounds
+        )
+        img_mime = FAST_TILE_MIME
+    data_out, cache_hit = create_tile(
+        raster_map, output_width, output_height, img_mime, *bounds
+    )
+    return data_out, cache_hit, img_mime
+
+
+def fast_first_tile_headers(
+    raster_map, output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+):
+    """
+    Headers of a tile served in place of the requested format, so that it is
+    not revalidated as the tile in the requested format
+    """
+    key = raster_map.tile_cache_key(
+        output_width, output_height, img_mime, min_x, max_x, min_y, max_y
+    )
+    return {
+        "ETag": quote_etag(safe64encodedsha(key)),
+        "Cache-Control": f"max-age={get_tile_fast_first_max_age()}",
+    }
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+def _render_tile(map_id, args):
+    from django.db import close_old_connections
+
+    from routechoices.core.models import get_tile_map
+
+    close_old_connections()
+    try:
+        raster_map = get_tile_map(map_id)
+        if raster_map is None:
+            raise ValueError(f"Map {map_id} does not exist")
+        return raster_map.create_tile(*args)
+    finally:
+        close_old_connections()
+
+
+class TileRenderServer:
+    def __init__(self, address=None, workers=None, queue_size=None):
+        self.address = address or get_tile_render_socket()
+        self.queue_size = queue_size or get_tile_render_queue_size()
+        # Spawned workers do not share the database connections of the server
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers or get_tile_render_workers(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def submit(self, request):
+        """Future of the render of a tile, None if too many are pending"""
+        key = request["key"]
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            if len(self.pending) >= self.queue_size:
+                return None
+            future = self.executor.submit(
+                _render_tile, request["map_id"], request["args"]
+            )
+            self.pending[key] = future
+
+        def done(_future):
+            with self.lock:
+                self.pending.pop(key, None)
+
+        future.add_done_callback(done)
+        return future
+
+    def handle(self, conn):
+        with conn:
+            try:
+                request = conn.recv()
+                future = self.submit(request)
+                if future is None:
+                    conn.send(("busy",))
+                    return
+                try:
+                    data_out, cache_hit = future.result()
+                except Exception as e:
+                    logger.exception("Could not render tile %s", request["key"])
+                    conn.send(("error", str(e)))
+                    return
+                conn.send(("ok", data_out, cache_hit))
+            except (EOFError, OSError):
+                # Client gave up waiting
+                pass
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self.listener = Listener(
+            self.address, family="AF_UNIX", authkey=get_tile_render_authkey()
+        )
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                # Failed authentication or closed listener
+                if self.listener is None:
+                    break
+                continue
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
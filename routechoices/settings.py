@@ -239,9 +239,61 @@ CACHES = {
         "OPTIONS": {"size_limit": 2**30},  # 1 gigabyte
     },
 }
+# The cache directory is local to a machine, set REDIS_URL to share the cache,
+# and its invalidations, between several app nodes.
+# Redis should evict keys with an LRU policy (maxmemory-policy allkeys-lru),
+# a lost event cache version is seeded again with a new value.
+REDIS_URL = env.str("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "TIMEOUT": 300,
+        },
+    }
 CACHE_TILES = True
 CACHE_THUMBS = True
 CACHE_EVENT_DATA = True
+# Decoded map images, memory-mapped by the workers rendering tiles
+RASTER_STORE_DIR = os.path.join(BASE_DIR, "rasters")
+RASTER_STORE_MAX_SIZE = 4 * 2**30  # 4 gigabytes
+# Tiles are rendered by blocks of METATILE_SIZE x METATILE_SIZE tiles
+METATILE_SIZE = 4
+# Tiles of the maps rendered in the storage by a background task when a map
+# is saved, in the sizes and formats requested by the events viewer. Enable in
+# settings_overrides.py once the storage and the task runner are set up.
+TILE_PYRAMID_ENABLED = False
+TILE_PYRAMID_SIZES = [512]
+TILE_PYRAMID_MIMES = ["image/webp"]
+# Tiles are rendered by the run_tile_renderer command listening on this unix
+# socket, in TILE_RENDER_WORKERS processes. Past TILE_RENDER_QUEUE_SIZE pending
+# renders, or TILE_RENDER_TIMEOUT seconds, tiles are answered with a 503.
+# Leave empty to render the tiles in the web workers.
+TILE_RENDER_SOCKET = ""
+TILE_RENDER_WORKERS = 4
+TILE_RENDER_QUEUE_SIZE = 64
+TILE_RENDER_TIMEOUT = 2
+# AVIF and JXL tiles missing from the cache are encoded by a background task,
+# a WebP tile is served meanwhile with a max-age of TILE_FAST_FIRST_MAX_AGE.
+# Enable in settings_overrides.py once the task runner is set up.
+TILE_FAST_FIRST_ENABLED = False
+TILE_FAST_FIRST_MAX_AGE = 60
+# Tiles of the public events written for nginx to serve them with an
+# X-Accel-Redirect, see the tiles_cache location in nginx/routechoices.conf.
+# Set in settings_overrides.py, eg: os.path.join(BASE_DIR, "tiles_cache"), only
+# behind that nginx. Leave empty to serve them with Django.
+TILE_DISK_CACHE_DIR = ""
+# In-process cache kept in front of the shared cache by each worker
+LOCAL_CACHE_MAX_SIZE = 64 * 2**20  # 64 megabytes
+LOCAL_CACHE_TIMEOUT = 60
+# Locations posted to the API are merged by the flush_queued_locations command
+QUEUE_POSTED_LOCATIONS = False
+# Push new locations to live events spectators, needs a PostgreSQL database
+# and the run_tcp_server command started with --sse-port
+LIVE_PUSH_ENABLED = False
+LIVE_PUSH_CHANNEL = "routechoices_live_locations"
+
 AWS_SESSION_TOKEN = ""
 AWS_S3_BUCKET = "routechoices"
 GEOIP_PATH = os.path.join(BASE_DIR, "geoip")
@@ -1,13 +1,22 @@
+import os
 import tempfile
 from pathlib import Path
+from unittest.mock import patch
 
 import arrow
-from django.core.cache import cache
 from rest_framework import status
 from rest_framework.test import APIClient, override_settings
 
 from routechoices.api.tests import EssentialApiBase
-from routechoices.core.models import Club, Event, Map, MapAssignation
+from routechoices.core.bg_tasks import encode_map_tile
+from routechoices.core.models import (
+    PRIVACY_PRIVATE,
+    Club,
+    Event,
+    Map,
+    MapAssignation,
+)
+from routechoices.lib.cache import clear_cache
 
 
 @override_settings(MEDIA_ROOT=Path(tempfile.gettempdir()))
@@ -127,7 +136,7 @@ class MapApiTestCase(EssentialApiBase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_should_hit_cache(self):
-        cache.clear()
+        clear_cache()
         client = APIClient(HTTP_HOST="tiles.routechoices.dev")
         url = self.reverse_and_check("tile_service", "/", "tiles")
         club = Club.objects.create(name="Test club", slug="club")
@@ -178,16 +187,248 @@ class MapApiTestCase(EssentialApiBase):
             f"{base_url}{intersecting_bbox}",
         )
         self.assertEqual(res.headers["X-Cache-Hit"], "0")
-        # tile that dont intersect, first query should not hit cache
+        # tiles that dont intersect are served the shared blank tile
         res = client.get(
             f"{base_url}{non_intersecting_bbox}",
         )
+        self.assertEqual(res.headers["X-Cache-Hit"], "2")
+        res = client.get(
+            f"{base_url}{non_intersecting_bbox_2}",
+        )
+        self.assertEqual(res.headers["X-Cache-Hit"], "2")
+
+    @override_settings(TILE_RENDER_SOCKET="/tmp/tiles.sock")
+    @patch("routechoices.lib.tile_render_service.Client")
+    def test_tile_render_busy(self, mock_client):
+        clear_cache()
+        mock_conn = mock_client.return_value
+        mock_conn.poll.return_value = True
+        mock_conn.recv.return_value = ("busy",)
+        client = APIClient(HTTP_HOST="tiles.routechoices.dev")
+        url = self.reverse_and_check("tile_service", "/", "tiles")
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            width=1,
+            height=1,
+        )
+        raster_map.data_uri = (
+            "data:image/png;base64,"
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXNSR0IArs4c6Q"
+            "AAAA1JREFUGFdjED765z8ABZcC1M3x7TQAAAAASUVORK5CYII="
+        )
+        raster_map.save()
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            open_registration=True,
+            start_date=arrow.get().shift(minutes=-1).datetime,
+            end_date=arrow.get().shift(hours=1).datetime,
+            map=raster_map,
+        )
+        base_url = f"{url}?z=17&layers={event.aid}&format=image%2Fpng"
+        res = client.get(f"{base_url}&x=74352&y=36993")
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res.headers["Retry-After"], "1")
+        # Blank tiles do not need the render service
+        res = client.get(f"{base_url}&x=742&y=36993")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_client.call_count, 1)
+        mock_conn.recv.return_value = ("error", "Could not decode the map")
+        res = client.get(f"{base_url}&x=74352&y=36993")
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res.headers["Retry-After"], "1")
+        # No response from the render service before the timeout
+        mock_conn.poll.return_value = False
+        mock_conn.recv.reset_mock()
+        res = client.get(f"{base_url}&x=74352&y=36993")
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res.headers["Retry-After"], "1")
+        mock_conn.recv.assert_not_called()
+
+    @override_settings(TILE_FAST_FIRST_ENABLED=True, TILE_FAST_FIRST_MAX_AGE=60)
+    @patch("routechoices.core.bg_tasks.encode_map_tile")
+    def test_fast_first_tile(self, mock_encode):
+        clear_cache()
+        client = APIClient(HTTP_HOST="tiles.routechoices.dev")
+        url = self.reverse_and_check("tile_service", "/", "tiles")
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            width=1,
+            height=1,
+        )
+        raster_map.data_uri = (
+            "data:image/png;base64,"
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXNSR0IArs4c6Q"
+            "AAAA1JREFUGFdjED765z8ABZcC1M3x7TQAAAAASUVORK5CYII="
+        )
+        raster_map.save()
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            open_registration=True,
+            start_date=arrow.get().shift(minutes=-1).datetime,
+            end_date=arrow.get().shift(hours=1).datetime,
+            map=raster_map,
+        )
+        tile_url = f"{url}?z=17&x=74352&y=36993&layers={event.aid}&format=image%2Favif"
+        # WebP served while the AVIF tile is encoded in the background
+        res = client.get(tile_url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["content-type"], "image/webp")
+        self.assertEqual(res.headers["Cache-Control"], "max-age=60")
+        etag = res.headers["ETag"]
+        self.assertEqual(mock_encode.call_count, 1)
+        # Encoding scheduled only once
+        res = client.get(tile_url)
+        self.assertEqual(res["content-type"], "image/webp")
+        self.assertEqual(mock_encode.call_count, 1)
+
+        map_id, map_hash, _ = mock_encode.call_args.args
+        self.assertEqual((map_id, map_hash), (raster_map.aid, raster_map.hash))
+        encode_map_tile.now(*mock_encode.call_args.args)
+        res = client.get(tile_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["content-type"], "image/avif")
+        self.assertEqual(res.headers["X-Cache-Hit"], "1")
+
+    def test_disk_tile(self):
+        clear_cache()
+        tiles_dir = tempfile.mkdtemp()
+        client = APIClient(HTTP_HOST="tiles.routechoices.dev")
+        url = self.reverse_and_check("tile_service", "/", "tiles")
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_map = Map.objects.create(
+            club=club,
+            name="Test map",
+            corners_coordinates=(
+                "61.45075,24.18994,61.44656,24.24721,"
+                "61.42094,24.23851,61.42533,24.18156"
+            ),
+            width=1,
+            height=1,
+        )
+        raster_map.data_uri = (
+            "data:image/png;base64,"
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXNSR0IArs4c6Q"
+            "AAAA1JREFUGFdjED765z8ABZcC1M3x7TQAAAAASUVORK5CYII="
+        )
+        raster_map.save()
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            open_registration=True,
+            start_date=arrow.get().shift(minutes=-1).datetime,
+            end_date=arrow.get().shift(hours=1).datetime,
+            map=raster_map,
+        )
+        map_dir = os.path.join(tiles_dir, "maps", raster_map.aid, raster_map.hash)
+        tile_path = os.path.join(map_dir, "17", "74352", "36993.png")
+        tile_url = f"{url}?z=17&x=74352&y=36993&layers={event.aid}&format=image%2Fpng"
+        with override_settings(TILE_DISK_CACHE_DIR=tiles_dir):
+            res = client.get(tile_url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            with open(tile_path, "rb") as fp:
+                self.assertEqual(fp.read(), b"".join(res.streaming_content))
+            # Served by nginx
+            res = client.get(tile_url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                res["X-Accel-Redirect"],
+                f"/tiles_cache/maps/{raster_map.aid}/{raster_map.hash}"
+                "/17/74352/36993.png",
+            )
+            # Blank tile far from the map
+            res = client.get(
+                f"{url}?z=17&x=742&y=36993&layers={event.aid}&format=image%2Fpng"
+            )
+            self.assertFalse(os.path.exists(os.path.join(map_dir, "17", "742")))
+            # Not served by nginx anymore once the event is private
+            event.privacy = PRIVACY_PRIVATE
+            with self.captureOnCommitCallbacks(execute=True):
+                event.save()
+            res = client.get(tile_url)
+            self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_get_composite_tile(self):
+        clear_cache()
+        client = APIClient(HTTP_HOST="tiles.routechoices.dev")
+        url = self.reverse_and_check("composite_tile_service", "/composite/", "tiles")
+        club = Club.objects.create(name="Test club", slug="club")
+        raster_maps = []
+        for corners_coordinates in (
+            "61.45075,24.18994,61.44656,24.24721,61.42094,24.23851,61.42533,24.18156",
+            "61.45175,24.19994,61.44756,24.25721,61.42194,24.24851,61.42633,24.19156",
+        ):
+            raster_map = Map.objects.create(
+                club=club,
+                name="Test map",
+                corners_coordinates=corners_coordinates,
+                width=1,
+                height=1,
+            )
+            raster_map.data_uri = (
+                "data:image/png;base64,"
+                "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXNSR0IArs4c6Q"
+                "AAAA1JREFUGFdjED765z8ABZcC1M3x7TQAAAAASUVORK5CYII="
+            )
+            raster_map.save()
+            raster_maps.append(raster_map)
+        event = Event.objects.create(
+            club=club,
+            name="Test event",
+            open_registration=True,
+            start_date=arrow.get().shift(minutes=-1).datetime,
+            end_date=arrow.get().shift(hours=1).datetime,
+            map=raster_maps[0],
+        )
+        MapAssignation.objects.create(
+            event=event, map=raster_maps[1], title="Other route"
+        )
+        base_url = f"{url}?z=17&x=74352&y=36993&layers={event.aid}&format=image%2Fpng"
+        res = client.get(base_url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["content-type"], "image/png")
         self.assertEqual(res.headers["X-Cache-Hit"], "0")
-        # same tile, 2nd query should hit cache
-        res = client.get(f"{base_url}&bbox={non_intersecting_bbox}")
+        res = client.get(f"{base_url}&maps=2,1")
         self.assertEqual(res.headers["X-Cache-Hit"], "1")
-        # another tile that dont intersect, should hit cache of blank tiles
+        # Single map, same tile as the map layer
+        res = client.get(f"{base_url}&maps=2")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = client.get(f"{base_url}&maps=3")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        res = client.get(f"{base_url}&maps=one")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        # Outside of both maps
         res = client.get(
-            f"{base_url}{non_intersecting_bbox_2}",
+            f"{url}?z=17&x=742&y=36993&layers={event.aid}&format=image%2Fpng"
         )
         self.assertEqual(res.headers["X-Cache-Hit"], "2")
+        # Not served the tile of the first map stored for the event layer
+        tiles_dir = tempfile.mkdtemp()
+        tile_url = self.reverse_and_check("tile_service", "/", "tiles")
+        with override_settings(TILE_DISK_CACHE_DIR=tiles_dir):
+            client.get(
+                f"{tile_url}?z=17&x=74352&y=36993&layers={event.aid}"
+                "&format=image%2Fpng"
+            )
+            res = client.get(base_url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn("X-Accel-Redirect", res.headers)
+            res = client.get(base_url)
+            self.assertTrue(
+                res["X-Accel-Redirect"].startswith(
+                    f"/tiles_cache/maps/{raster_maps[0].aid}+{raster_maps[1].aid}/"
+                )
+            )
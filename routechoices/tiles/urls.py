@@ -4,4 +4,9 @@ from routechoices.tiles import views
 
 urlpatterns = [
     re_path(r"^$", views.serve_tile, name="tile_service"),
+    re_path(
+        r"^composite/$",
+        views.serve_composite_tile,
+        name="composite_tile_service",
+    ),
 ]
@@ -1,66 +1,104 @@
 from django.http.response import HttpResponseBadRequest
 from django.views.decorators.http import condition
 
-from routechoices.core.models import PRIVACY_PRIVATE, Event
+from routechoices.core.models import PRIVACY_PRIVATE, Event, MapComposite
 from routechoices.lib.globalmaptiles import GlobalMercator
 from routechoices.lib.helpers import get_best_image_mime, safe64encodedsha
 from routechoices.lib.slippy_tiles import tile_xy_to_north_west_latlon
 from routechoices.lib.streaming_response import StreamingHttpRangeResponse
+from routechoices.lib.tile_disk_cache import (
+    disk_tile_response,
+    get_disk_tile_path,
+    get_disk_tiles_version,
+    save_disk_tile,
+)
+from routechoices.lib.tile_render_service import (
+    TileRenderBusy,
+    TileRenderError,
+    create_tile_fast_first,
+    fast_first_tile_headers,
+    tile_render_busy_response,
+)
 
 GLOBAL_MERCATOR = GlobalMercator()
 
 
+def parse_tile_request(request, get_params):
+    """
+    Set the format and bounds of the requested tile on the request,
+    return an error response if the parameters are invalid
+    """
+    asked_mime = get_params.get("format", "image/png").lower()
+    better_mime = get_best_image_mime(request)
+    if asked_mime in (
+        "image/apng",
+        "image/png",
+        "image/webp",
+        "image/avif",
+        "image/jxl",
+    ):
+        img_mime = asked_mime
+        if img_mime == "image/apng":
+            img_mime = "image/png"
+    elif asked_mime == "image/jpeg" and not better_mime:
+        img_mime = "image/jpeg"
+    elif better_mime:
+        img_mime = better_mime
+    else:
+        return HttpResponseBadRequest("invalid image format")
+
+    layers_raw = get_params.get("layers")
+    x_raw = get_params.get("x")
+    y_raw = get_params.get("y")
+    z_raw = get_params.get("z")
+    if not layers_raw or not x_raw or not y_raw or not z_raw:
+        return HttpResponseBadRequest("missing mandatory parameters")
+
+    out_w, out_h = 256, 256
+
+    try:
+        tile_x = int(x_raw)
+        tile_y = int(y_raw)
+        tile_z = int(z_raw)
+    except Exception:
+        return HttpResponseBadRequest("invalid tile indexes")
+
+    max_lat, min_lon = tile_xy_to_north_west_latlon(tile_x, tile_y, tile_z)
+    min_lat, max_lon = tile_xy_to_north_west_latlon(tile_x + 1, tile_y + 1, tile_z)
+
+    min_xy = GLOBAL_MERCATOR.latlon_to_meters({"lat": min_lat, "lon": min_lon})
+    min_x = min_xy["x"]
+    min_y = min_xy["y"]
+    max_xy = GLOBAL_MERCATOR.latlon_to_meters({"lat": max_lat, "lon": max_lon})
+    max_x = max_xy["x"]
+    max_y = max_xy["y"]
+
+    request.tile_xyz = (tile_x, tile_y, tile_z)
+    request.image_request = {
+        "mime": img_mime,
+        "width": out_w,
+        "height": out_h,
+    }
+    request.bound = {
+        "min_x": min_x,
+        "max_x": max_x,
+        "min_y": min_y,
+        "max_y": max_y,
+    }
+    return None
+
+
 def common_tile(function):
     def wrap(request, *args, **kwargs):
         get_params = {}
         for key in request.GET.keys():
             get_params[key.lower()] = request.GET[key]
 
-        asked_mime = get_params.get("format", "image/png").lower()
-        better_mime = get_best_image_mime(request)
-        if asked_mime in (
-            "image/apng",
-            "image/png",
-            "image/webp",
-            "image/avif",
-            "image/jxl",
-        ):
-            img_mime = asked_mime
-            if img_mime == "image/apng":
-                img_mime = "image/png"
-        elif asked_mime == "image/jpeg" and not better_mime:
-            img_mime = "image/jpeg"
-        elif better_mime:
-            img_mime = better_mime
-        else:
-            return HttpResponseBadRequest("invalid image format")
-
-        layers_raw = get_params.get("layers")
-        x_raw = get_params.get("x")
-        y_raw = get_params.get("y")
-        z_raw = get_params.get("z")
-        if not layers_raw or not x_raw or not y_raw or not z_raw:
-            return HttpResponseBadRequest("missing mandatory parameters")
-
-        out_w, out_h = 256, 256
-
-        try:
-            tile_x = int(x_raw)
-            tile_y = int(y_raw)
-            tile_z = int(z_raw)
-        except Exception:
-            return HttpResponseBadRequest("invalid tile indexes")
-
-        max_lat, min_lon = tile_xy_to_north_west_latlon(tile_x, tile_y, tile_z)
-        min_lat, max_lon = tile_xy_to_north_west_latlon(tile_x + 1, tile_y + 1, tile_z)
-
-        min_xy = GLOBAL_MERCATOR.latlon_to_meters({"lat": min_lat, "lon": min_lon})
-        min_x = min_xy["x"]
-        min_y = min_xy["y"]
-        max_xy = GLOBAL_MERCATOR.latlon_to_meters({"lat": max_lat, "lon": max_lon})
-        max_x = max_xy["x"]
-        max_y = max_xy["y"]
+        error_response = parse_tile_request(request, get_params)
+        if error_response:
+            return error_response
 
+        layers_raw = get_params["layers"]
         try:
             if "/" in layers_raw:
                 event_id, map_index = layers_raw.split("/")
@@ -73,23 +111,80 @@ def common_tile(function):
         except Exception:
             return HttpResponseBadRequest("invalid parameters")
 
+        # Read before the event is loaded, see save_disk_tile
+        disk_tiles_version = get_disk_tiles_version(event_id)
+        tile_x, tile_y, tile_z = request.tile_xyz
+        disk_tile_path = get_disk_tile_path(
+            event_id,
+            map_index,
+            disk_tiles_version,
+            tile_z,
+            tile_x,
+            tile_y,
+            request.image_request["mime"],
+        )
+        if disk_tile_path:
+            # Tile of a public event, served by nginx
+            return disk_tile_response(disk_tile_path, request.image_request["mime"])
+
         event, raster_map, _ = Event.get_public_map_at_index(
             request.user, event_id, map_index
         )
 
         request.event = event
         request.raster_map = raster_map
-        request.image_request = {
-            "mime": img_mime,
-            "width": out_w,
-            "height": out_h,
-        }
-        request.bound = {
-            "min_x": min_x,
-            "max_x": max_x,
-            "min_y": min_y,
-            "max_y": max_y,
-        }
+        request.map_index = map_index
+        request.disk_tiles_version = disk_tiles_version
+        return function(request, *args, **kwargs)
+
+    wrap.__doc__ = function.__doc__
+    wrap.__name__ = function.__name__
+    return wrap
+
+
+def common_composite_tile(function):
+    def wrap(request, *args, **kwargs):
+        get_params = {}
+        for key in request.GET.keys():
+            get_params[key.lower()] = request.GET[key]
+
+        error_response = parse_tile_request(request, get_params)
+        if error_response:
+            return error_response
+
+        event_id = get_params["layers"]
+        maps_raw = get_params.get("maps")
+        try:
+            map_indexes = None
+            if maps_raw:
+                map_indexes = [int(map_index) for map_index in maps_raw.split(",")]
+        except Exception:
+            return HttpResponseBadRequest("invalid parameters")
+        # Not the layer of a single map, see common_tile
+        layer = "composite"
+        if map_indexes:
+            layer += ":" + ",".join(str(map_index) for map_index in map_indexes)
+
+        disk_tiles_version = get_disk_tiles_version(event_id)
+        tile_x, tile_y, tile_z = request.tile_xyz
+        disk_tile_path = get_disk_tile_path(
+            event_id,
+            layer,
+            disk_tiles_version,
+            tile_z,
+            tile_x,
+            tile_y,
+            request.image_request["mime"],
+        )
+        if disk_tile_path:
+            return disk_tile_response(disk_tile_path, request.image_request["mime"])
+
+        event, raster_maps = Event.get_public_maps(request.user, event_id, map_indexes)
+
+        request.event = event
+        request.raster_map = MapComposite(raster_maps)
+        request.map_index = layer
+        request.disk_tiles_version = disk_tiles_version
         return function(request, *args, **kwargs)
 
     wrap.__doc__ = function.__doc__
@@ -113,27 +208,76 @@ def tile_etag(request):
     return safe64encodedsha(key)
 
 
-@common_tile
-@condition(etag_func=tile_etag)
-def serve_tile(request):
-    get_params = {}
-    for key in request.GET.keys():
-        get_params[key.lower()] = request.GET[key]
-    data_out, cache_hit = request.raster_map.create_tile(
-        request.image_request["width"],
-        request.image_request["height"],
-        request.image_request["mime"],
-        request.bound["min_x"],
-        request.bound["max_x"],
-        request.bound["min_y"],
-        request.bound["max_y"],
-    )
+def tile_response(request):
+    try:
+        data_out, cache_hit, img_mime = create_tile_fast_first(
+            request.raster_map,
+            request.image_request["width"],
+            request.image_request["height"],
+            request.image_request["mime"],
+            request.bound["min_x"],
+            request.bound["max_x"],
+            request.bound["min_y"],
+            request.bound["max_y"],
+        )
+    except (TileRenderBusy, TileRenderError):
+        return tile_render_busy_response()
     headers = {"X-Cache-Hit": cache_hit}
     if request.event.privacy == PRIVACY_PRIVATE:
         headers = {"Cache-Control": "Private"}
+    elif img_mime == request.image_request["mime"] and (
+        # Blank tiles far from the map are not worth a file
+        request.raster_map.bbox_intersects_with_tile(
+            request.bound["min_x"],
+            request.bound["max_x"],
+            request.bound["min_y"],
+            request.bound["max_y"],
+        )
+    ):
+        tile_x, tile_y, tile_z = request.tile_xyz
+        # Served by nginx from now on
+        save_disk_tile(
+            request.event.aid,
+            request.map_index,
+            request.disk_tiles_version,
+            request.raster_map,
+            tile_z,
+            tile_x,
+            tile_y,
+            img_mime,
+            data_out,
+        )
+    if img_mime != request.image_request["mime"]:
+        # Served in place of a tile still being encoded
+        headers = {
+            **fast_first_tile_headers(
+                request.raster_map,
+                request.image_request["width"],
+                request.image_request["height"],
+                img_mime,
+                request.bound["min_x"],
+                request.bound["max_x"],
+                request.bound["min_y"],
+                request.bound["max_y"],
+            ),
+            **headers,
+        }
     return StreamingHttpRangeResponse(
         request,
         data_out,
-        content_type=request.image_request["mime"],
+        content_type=img_mime,
         headers=headers,
     )
+
+
+@common_tile
+@condition(etag_func=tile_etag)
+def serve_tile(request):
+    return tile_response(request)
+
+
+@common_composite_tile
+@condition(etag_func=tile_etag)
+def serve_composite_tile(request):
+    """Single tile of all the maps of an event, or of the ones given by index"""
+    return tile_response(request)
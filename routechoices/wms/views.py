@@ -15,6 +15,13 @@ from routechoices.core.models import (
 from routechoices.lib.globalmaptiles import GlobalMercator
 from routechoices.lib.helpers import get_best_image_mime, safe64encodedsha
 from routechoices.lib.streaming_response import StreamingHttpRangeResponse
+from routechoices.lib.tile_render_service import (
+    TileRenderBusy,
+    TileRenderError,
+    create_tile_fast_first,
+    fast_first_tile_headers,
+    tile_render_busy_response,
+)
 
 GLOBAL_MERCATOR = GlobalMercator()
 
@@ -151,22 +158,41 @@ def wms_service(request):
     for key in request.GET.keys():
         get_params[key.lower()] = request.GET[key]
     if get_params.get("request", "").lower() == "getmap":
-        data_out, cache_hit = request.raster_map.create_tile(
-            request.image_request["width"],
-            request.image_request["height"],
-            request.image_request["mime"],
-            request.bound["min_x"],
-            request.bound["max_x"],
-            request.bound["min_y"],
-            request.bound["max_y"],
-        )
+        try:
+            data_out, cache_hit, img_mime = create_tile_fast_first(
+                request.raster_map,
+                request.image_request["width"],
+                request.image_request["height"],
+                request.image_request["mime"],
+                request.bound["min_x"],
+                request.bound["max_x"],
+                request.bound["min_y"],
+                request.bound["max_y"],
+            )
+        except (TileRenderBusy, TileRenderError):
+            return tile_render_busy_response()
         headers = {"X-Cache-Hit": cache_hit}
         if request.event.privacy == PRIVACY_PRIVATE:
             headers = {"Cache-Control": "Private"}
+        if img_mime != request.image_request["mime"]:
+            # Served in place of a tile still being encoded
+            headers = {
+                **fast_first_tile_headers(
+                    request.raster_map,
+                    request.image_request["width"],
+                    request.image_request["height"],
+                    img_mime,
+                    request.bound["min_x"],
+                    request.bound["max_x"],
+                    request.bound["min_y"],
+                    request.bound["max_y"],
+                ),
+                **headers,
+            }
         return StreamingHttpRangeResponse(
             request,
             data_out,
-            content_type=request.image_request["mime"],
+            content_type=img_mime,
             headers=headers,
         )
 